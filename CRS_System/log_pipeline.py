@@ -0,0 +1,159 @@
+"""
+非阻塞的结构化日志
+
+请求线程只把日志记录放入有界队列，由 QueueListener 的后台线程格式化为 JSON 并写入文件或标准错误，
+磁盘 I/O 不计入请求耗时。队列满时丢弃新记录并计数，下次有空位时补记一条丢弃汇总。
+热点路径的 INFO/DEBUG 日志可按 logger 配置采样比例，未被采样的记录不会被格式化。
+
+多个工作进程追加写同一个文件，文件不在进程内轮转（各进程各自轮转会互相覆盖、丢失日志），
+由 logrotate 等外部工具按大小或日期移走文件；WatchedFileHandler 发现文件被移走后重新打开。
+
+在 settings.LOGGING 中配置：
+    'filters': {'sampling': {'()': 'CRS_System.log_pipeline.SamplingFilter', 'rates': {...}}}
+    'handlers': {'queued_json': {'class': 'CRS_System.log_pipeline.QueuedJsonHandler', 'filters': ['sampling'], ...}}
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import threading
+import weakref
+from collections import Counter
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, WatchedFileHandler
+from pathlib import Path
+
+# LogRecord 自带的属性，其余属性视为 extra 传入的结构化字段
+RESERVED_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_handlers = weakref.WeakSet()
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录输出一行 JSON，extra 中的字段原样保留"""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in RESERVED_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    按 logger 名称前缀对低于 WARNING 的记录采样
+
+    Args:
+        rates: logger 名称前缀 -> 保留比例（0~1），按最长前缀匹配；未配置的 logger 全部保留
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = dict(rates or {})
+        self._resolved = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1 or random.random() < rate
+
+    def _rate(self, name):
+        rate = self._resolved.get(name)
+        if rate is None:
+            prefixes = [
+                prefix for prefix in self.rates
+                if name == prefix or name.startswith(prefix + '.')
+            ]
+            rate = self.rates[max(prefixes, key=len)] if prefixes else 1.0
+            self._resolved[name] = rate
+        return rate
+
+
+class QueuedJsonHandler(QueueHandler):
+    """
+    放入有界队列的日志处理器，后台线程以 JSON 格式写出
+
+    Args:
+        filename: 日志文件路径（由外部工具轮转），为空时写到标准错误
+        queue_size: 队列容量，满时丢弃新记录
+    """
+
+    def __init__(self, filename=None, queue_size=10000):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        if filename:
+            Path(filename).parent.mkdir(parents=True, exist_ok=True)
+            target = WatchedFileHandler(filename, encoding='utf-8')
+        else:
+            target = logging.StreamHandler()
+        target.setFormatter(JsonFormatter())
+        self.listener = QueueListener(self.queue, target, respect_handler_level=True)
+        self.listener.start()
+        self._dropped = Counter()
+        self._lock = threading.Lock()
+        _handlers.add(self)
+        atexit.register(self.stop)
+
+    def prepare(self, record):
+        # 在调用线程中合并参数（记录引用的对象之后可能被修改），JSON 序列化留给后台线程
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self._dropped[record.levelname] += 1
+            return
+        if self._dropped:
+            self._report_dropped()
+
+    def metrics(self):
+        with self._lock:
+            return {'queued': self.queue.qsize(), 'dropped': dict(self._dropped)}
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def _report_dropped(self):
+        with self._lock:
+            dropped, self._dropped = self._dropped, Counter()
+        if not dropped:
+            return
+        summary = logging.makeLogRecord({
+            'name': __name__,
+            'levelno': logging.WARNING,
+            'levelname': 'WARNING',
+            'msg': f"日志队列已满，丢弃了 {sum(dropped.values())} 条日志",
+            'dropped': dict(dropped),
+        })
+        try:
+            self.queue.put_nowait(summary)
+        except queue.Full:
+            with self._lock:
+                self._dropped.update(dropped)
+
+
+def pipeline_metrics():
+    """各个日志队列的积压和丢弃数"""
+    return [handler.metrics() for handler in list(_handlers)]
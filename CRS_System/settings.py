@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -82,6 +83,9 @@ WSGI_APPLICATION = 'CRS_System.wsgi.application'
 ASGI_APPLICATION = 'CRS_System.asgi.application'
 
 
+# 运行测试时不依赖外部的 Redis
+TESTING = 'test' in sys.argv
+
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
@@ -93,6 +97,56 @@ CACHES = {
     }
 }
 
+if TESTING:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# 推荐结果两级缓存：进程内 LRU + 上面的 default 缓存
+RECOMMENDATION_CACHE = {
+    'LOCAL_MAXSIZE': 512,
+    'TIMEOUT': 600,
+    'REPORT_EVERY': 1000,  # 每 1000 次查询记录一次命中率
+}
+
+# 聊天消息和推荐记录的延迟批量写入
+CHAT_WRITE_BEHIND = {
+    'ENABLED': not TESTING,  # 测试时同步写入，保证断言能读到数据
+    'MAX_QUEUE': 10000,
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 1.0,  # 秒
+    'BLOCK_TIMEOUT': 0.05,  # 缓冲区满时最多等待的秒数
+}
+
+# 订单事件驱动的共同购买/交互/热度增量更新
+ORDER_EVENTS = {
+    'ENABLED': not TESTING,
+    'BATCH_SIZE': 100,
+    'FLUSH_INTERVAL': 1.0,  # 秒
+    'COMPACT_INTERVAL': 600,  # 秒
+    'MAX_NEIGHBORS': 50,
+    'DECAY_INTERVAL': 24 * 3600,  # 秒，decay_popularity 命令在每个间隔内只衰减一次
+    'DECAY_FACTOR': 0.95,
+}
+
+# 异步聊天接口的意图识别线程池
+CHAT_INFERENCE = {
+    'WORKERS': 2,
+    'MAX_PENDING': 32,  # 正在执行和排队的推理请求上限，超过后返回 503
+    'ACQUIRE_TIMEOUT': 2.0,  # 秒
+    'BATCH_SIZE': 32,  # 批量接口每次模型前向计算的文本数
+}
+
+# 浏览/点击事件的环形缓冲区，满时丢弃最旧的事件
+INTERACTION_EVENTS = {
+    'ENABLED': not TESTING,
+    'MAX_QUEUE': 20000,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 2.0,  # 秒
+}
+
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
@@ -102,6 +156,73 @@ CHANNEL_LAYERS = {
     },
 }
 
+if TESTING:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+# WebSocket 聊天的单连接限流
+CHAT_WEBSOCKET = {
+    'RATE': 1.0,  # 每秒允许的消息数
+    'BURST': 5,
+    'MAX_PENDING': 3,  # 排队等待处理的消息数，超过后提示稍候
+}
+
+# 活跃会话状态缓存：每轮只更新缓存，数据库延迟写回（空闲、关闭或连接断开时）
+CONVERSATION_STATE = {
+    'WRITE_BACK': not TESTING,  # 测试中每轮直接写库，便于断言
+    'IDLE_FLUSH': 60,  # 空闲多少秒后写回
+    'MAX_DIRTY_AGE': 300,  # 未写回的修改最多保留多少秒
+}
+
+# 一轮对话的查询预算；测试中超出预算抛出异常，线上只记录警告
+CHAT_TURN = {
+    'QUERY_BUDGET': 20,
+    'BATCH_MAX_ITEMS': 100,  # 批量接口一次最多处理的消息数
+}
+
+QUERY_BUDGET = {
+    'ENFORCE': TESTING,
+}
+
+# 聊天接口的过载控制：按进行中的请求数和最近 P90 耗时切换 normal / degraded / shed 模式
+CHAT_LOAD_SHEDDING = {
+    'ENABLED': True,
+    'DEGRADE_INFLIGHT': 8,
+    'SHED_INFLIGHT': 24,
+    'DEGRADE_LATENCY': 2.0,  # 秒
+    'SHED_LATENCY': 6.0,  # 秒
+    'HOLD_SECONDS': 10,
+    'RETRY_AFTER': 5,  # 秒
+}
+
+# 输入联想：规则预测置信度足够高时在后台预热推荐缓存
+CHAT_TYPEAHEAD = {
+    'PREWARM': True,
+    'PREWARM_CONFIDENCE': 0.8,
+    'PREWARM_WORKERS': 2,
+    'PREWARM_PENDING': 8,  # 超过后丢弃预热任务
+}
+
+# 相同的意图识别和非个性化推荐并发时只计算一次；多进程部署时可开启缓存锁，跨进程共享推荐结果
+CHAT_SINGLE_FLIGHT = {
+    'CACHE_LOCK': False,
+    'LOCK_TIMEOUT': 10,  # 秒
+    'WAIT_TIMEOUT': 10,  # 秒
+}
+
+# 会话归档：过期会话写入按日期分区的 gzip JSONL 分段文件后从热表分批删除
+CHAT_ARCHIVE = {
+    'DIR': BASE_DIR / 'archive' / 'chat',
+    'CLOSED_AFTER_DAYS': 30,  # 已结束的会话多少天后归档
+    'IDLE_AFTER_DAYS': 90,  # 任何会话空闲多少天后归档
+    'BATCH_SIZE': 200,  # 每批导出的会话数
+    'DELETE_BATCH_SIZE': 500,  # 每次 DELETE 的行数，保持事务短小
+    'PAUSE': 0.05,  # 两次删除之间的间隔（秒），给在线请求让出锁
+}
+
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
@@ -180,17 +301,46 @@ AUTH_USER_MODEL = 'accounts.User'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# 日志经有界队列由后台线程以 JSON 格式写出，请求线程不做磁盘 I/O；队列满时丢弃并计数
+# 热点路径（每次识别、每轮推荐）的 INFO 日志按比例采样，WARNING 及以上全部保留
+# 各工作进程追加写同一个文件，轮转交给 logrotate（按大小或日期移走文件即可，不需要 copytruncate）
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'sampling': {
+            '()': 'CRS_System.log_pipeline.SamplingFilter',
+            'rates': {
+                'chat.services.nlp_processor': 0.05,
+                'chat.services.recommender': 0.2,
+                'chat.services.result_cache': 0.2,
+            },
+        },
+    },
     'handlers': {
-        'console': {
-            'class': 'logging.StreamHandler',
+        'queued_json': {
+            'class': 'CRS_System.log_pipeline.QueuedJsonHandler',
+            'filename': None if TESTING else BASE_DIR / 'logs' / 'crs.jsonl',
+            'queue_size': 10000,
+            'filters': ['sampling'],
         },
     },
+    'root': {
+        'handlers': ['queued_json'],
+        'level': 'WARNING',
+    },
     'loggers': {
+        'chat': {
+            'handlers': ['queued_json'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'products': {
+            'handlers': ['queued_json'],
+            'level': 'INFO',
+            'propagate': False,
+        },
         'products.views': {
-            'handlers': ['console'],
             'level': 'DEBUG',
         },
     },
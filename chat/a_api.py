@@ -1,10 +1,15 @@
 # chat/api.py
+import logging
+
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from .models import Conversation, Message
 from .services.dialogue_manager import DialogueManager
 from .services.nlp_processor import NLPProcessor
+from .services.turns import run_turn
+
+logger = logging.getLogger(__name__)
 
 
 class ChatViewSet(viewsets.ViewSet):
@@ -19,36 +24,14 @@ class ChatViewSet(viewsets.ViewSet):
         # NLP处理
         nlp_result = self.processor.process_input(text)
 
-        # 对话管理
-        response = self.manager.process_message(user, {
-            'text': text,
-            'nlp_result': nlp_result
-        })
-
-        # 保存对话记录
-        conv = Conversation.objects.create(
-            user=user,
-            current_state=response['state'],
-            context=response['context']
-        )
-        Message.objects.create(
-            conversation=conv,
-            message_type='user',
-            content=text,
-            structured_data=nlp_result
-        )
+        # 对话管理：沿用当前活跃会话，不再每轮新建会话；消息由 run_turn 批量记录
+        response = run_turn(self.manager, user, text, nlp_result)
 
         return Response(response)
 
     import random
-    import logging
 
-    # 设置日志
-    logging.basicConfig(
-        filename='response_generator.log',
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s'
-    )
+    # 日志由 settings.LOGGING 统一配置（见 CRS_System.log_pipeline），这里不再写文件
 
     class ResponseGenerator:
         """
@@ -57,7 +40,7 @@ class ChatViewSet(viewsets.ViewSet):
         """
 
         def __init__(self):
-            logging.info("初始化ResponseGenerator")
+            logger.debug("初始化ResponseGenerator")
 
         def generate_greeting(self, username=None):
             """生成问候语"""
@@ -67,7 +50,7 @@ class ChatViewSet(viewsets.ViewSet):
                 f"你好{f'，{username}' if username else ''}！我可以帮你推荐合适的商品。你最近在找什么产品吗？"
             ]
             selected = random.choice(greetings)
-            logging.info(f"生成问候: {selected}")
+            logger.debug("生成问候: %s", selected)
             return selected
 
         def generate_collecting_response(self):
@@ -78,7 +61,7 @@ class ChatViewSet(viewsets.ViewSet):
                 "能详细描述一下你要找的产品吗？比如用途、预算或者特定功能。"
             ]
             selected = random.choice(responses)
-            logging.info(f"生成收集需求回复: {selected}")
+            logger.debug("生成收集需求回复: %s", selected)
             return selected
 
         def generate_collecting_with_entities_response(self, entities):
@@ -93,7 +76,7 @@ class ChatViewSet(viewsets.ViewSet):
                 f"好的，你想要了解{entity_text}。你更关注哪些方面的特性呢？"
             ]
             selected = random.choice(responses)
-            logging.info(f"生成带实体收集需求回复: {selected}")
+            logger.debug("生成带实体收集需求回复: %s", selected)
             return selected
 
         def generate_clarifying_response(self, preferences):
@@ -130,7 +113,7 @@ class ChatViewSet(viewsets.ViewSet):
                 ]
 
             selected = random.choice(responses)
-            logging.info(f"生成澄清需求回复: {selected}")
+            logger.debug("生成澄清需求回复: %s", selected)
             return selected
 
         def generate_recommendation_response(self, product_names, entities, preferences):
@@ -163,7 +146,7 @@ class ChatViewSet(viewsets.ViewSet):
             ]
 
             selected = f"{random.choice(intros)} {random.choice(outros)}"
-            logging.info(f"生成推荐回复: {selected}")
+            logger.debug("生成推荐回复: %s", selected)
             return selected
 
         def generate_no_recommendation_response(self):
@@ -174,7 +157,7 @@ class ChatViewSet(viewsets.ViewSet):
                 "很遗憾，我没能找到匹配的产品。你能描述一下你的预算或者其他要求吗？"
             ]
             selected = random.choice(responses)
-            logging.info(f"生成无推荐回复: {selected}")
+            logger.debug("生成无推荐回复: %s", selected)
             return selected
 
         def generate_recommendation_error_response(self):
@@ -185,7 +168,7 @@ class ChatViewSet(viewsets.ViewSet):
                 "很抱歉，我无法完成推荐。请再次告诉我你的需求，我会重新为你推荐。"
             ]
             selected = random.choice(responses)
-            logging.info(f"生成推荐错误回复: {selected}")
+            logger.debug("生成推荐错误回复: %s", selected)
             return selected
 
         def generate_detail_response(self, entities, products):
@@ -217,7 +200,7 @@ class ChatViewSet(viewsets.ViewSet):
             ]
 
             selected = random.choice(responses)
-            logging.info(f"生成详情查询回复: {selected}")
+            logger.debug("生成详情查询回复: %s", selected)
             return selected
 
         def generate_comparison_response(self, entities):
@@ -258,7 +241,7 @@ class ChatViewSet(viewsets.ViewSet):
             ]
 
             selected = random.choice(responses)
-            logging.info(f"生成比较回复: {selected}")
+            logger.debug("生成比较回复: %s", selected)
             return selected
 
         def generate_positive_feedback_response(self):
@@ -269,4 +252,5 @@ class ChatViewSet(viewsets.ViewSet):
                 "谢谢你的肯定！希望这些推荐能真正满足你的需求。有其他问题随时问我。"
             ]
             selected = random.choice(responses)
-            logging.info(
\ No newline at end of file
+            logger.debug("生成积极反馈回复: %s", selected)
+            return selected
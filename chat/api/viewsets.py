@@ -6,6 +6,7 @@ from chat.services.nlp_processor import NLPProcessor
 from chat.services.dialogue_manager import  DialogueManager
 from chat.services.recommender import  HybridRecommender
 from chat.serializers import ConversationSerializer
+from chat.services.turns import run_turn
 
 class ChatViewSet(viewsets.ViewSet):
     processor = NLPProcessor()
@@ -34,37 +35,9 @@ class ChatViewSet(viewsets.ViewSet):
         # NLP 处理
         nlp_result = self.processor.process_input(text)
 
-        # 对话管理
-        response = self.manager.process_message(user, {
-            'text': text,
-            'nlp_result': nlp_result
-        })
-
-        # 保存对话记录
-        conv = Conversation.objects.create(
-            user=user,
-            current_state=response['state'],
-            context=response['context']
-        )
-        Message.objects.create(
-            conversation=conv,
-            message_type='user',
-            content=text,
-            structured_data=nlp_result
-        )
-        Message.objects.create(
-            conversation=conv,
-            message_type='system',
-            content=response['response']
-        )
-
-        # 保存推荐结果（如果有）
-        if response['state'] == 'recommending' and 'products' in response:
-            rec = Recommendation.objects.create(
-                conversation=conv,
-                algorithm='hybrid'
-            )
-            rec.products.set(response['products'])
+        # 对话管理：沿用当前活跃会话，不再每轮新建会话；消息和推荐记录由 run_turn 批量写入
+        conv = self.manager._get_or_create_conversation(user)
+        run_turn(self.manager, user, text, nlp_result, conv)
 
         serializer = ConversationSerializer(conv)
         return Response(serializer.data)
\ No newline at end of file
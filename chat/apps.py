@@ -3,4 +3,10 @@ from django.apps import AppConfig
 
 class ChatConfig(AppConfig):
     name = 'chat'
-    verbose_name = 'Chat Recommendation'
\ No newline at end of file
+    verbose_name = 'Chat Recommendation'
+
+    def ready(self):
+        from orders.signals import order_status_changed
+        from .services.cooccurrence import order_events
+
+        order_status_changed.connect(order_events.handle_status_change, dispatch_uid='chat.order_events')
@@ -1,16 +1,150 @@
-from channels.generic.websocket import AsyncWebsocketConsumer
-import json
+import asyncio
+import logging
+import time
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+
+from products.cards import card_list
+
+from .services.conversation_state import conversation_store
+from .services.dialogue_manager import build_client_messages
+from .services.load_shedding import ChatOverloaded
+from .services.turns import handle_turn_async
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'RATE': 1.0,  # 每秒补充的消息数
+    'BURST': 5,  # 令牌桶容量
+    'MAX_PENDING': 3,  # 每个连接排队等待处理的消息数
+}
+
+
+class TokenBucket:
+    """令牌桶限流"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def consume(self):
+        """取一个令牌，成功返回 0，否则返回需要等待的秒数"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class ChatConsumer(AsyncJsonWebsocketConsumer):
+    """
+    WebSocket 聊天
+
+    每条消息走完整的 意图识别 -> 对话管理 -> 推荐 流程，先推送回复文本和初步的商品卡片，
+    最后推送完整结果。推荐过程中的进度经由 channel layer 发回本连接，保证消息顺序。
+    每个连接同时只处理一条消息，排队的消息数有上限，并按令牌桶限制发送频率。
+    """
 
-class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
+        self.user = self.scope.get('user')
+        if self.user is None or not self.user.is_authenticated:
+            await self.close(code=4401)
+            return
+
+        options = {**DEFAULT_OPTIONS, **getattr(settings, 'CHAT_WEBSOCKET', {})}
+        self.bucket = TokenBucket(options['RATE'], options['BURST'])
+        self.pending = asyncio.Queue(maxsize=options['MAX_PENDING'])
+        self.worker = asyncio.create_task(self._process_pending())
         await self.accept()
 
     async def disconnect(self, close_code):
-        pass
-
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        message = text_data_json['message']
-        await self.send(text_data=json.dumps({
-            'message': message
-        }))
\ No newline at end of file
+        worker = getattr(self, 'worker', None)
+        if worker is not None:
+            worker.cancel()
+            # 连接断开视为会话空闲，把缓存中的会话状态写回数据库
+            await sync_to_async(conversation_store.flush_user)(self.user.id)
+
+    async def receive_json(self, content, **kwargs):
+        text = str(content.get('text') or content.get('message') or '').strip()
+        if not text:
+            await self.send_json({'type': 'error', 'error': '消息不能为空'})
+            return
+
+        retry_after = self.bucket.consume()
+        if retry_after:
+            await self.send_json({
+                'type': 'error',
+                'code': 'rate_limited',
+                'error': '发送太频繁，请稍后再试',
+                'retry_after': round(retry_after, 1),
+            })
+            return
+
+        try:
+            self.pending.put_nowait(text)
+        except asyncio.QueueFull:
+            await self.send_json({'type': 'error', 'code': 'busy', 'error': '上一条消息还在处理中，请稍候'})
+
+    async def _process_pending(self):
+        while True:
+            text = await self.pending.get()
+            try:
+                await self._handle_turn(text)
+            except asyncio.CancelledError:
+                raise
+            except ChatOverloaded as e:
+                await self._send_ordered({
+                    'type': 'chat.error',
+                    'error': '当前咨询人数较多，请稍后再试',
+                    'retry_after': e.retry_after,
+                })
+            except Exception as e:
+                logger.error(f"WebSocket chat error: {e}", exc_info=True)
+                await self._send_ordered({'type': 'chat.error', 'error': '系统暂时出现问题，请稍后再试'})
+
+    async def _handle_turn(self, text):
+        send = async_to_sync(self.channel_layer.send)
+        channel_name = self.channel_name
+
+        def progress(stage, message=None, products=None):
+            # 在工作线程中调用；发送完成前阻塞，推荐线程不会比客户端快太多
+            event = {'type': 'chat.progress', 'stage': stage}
+            if message is not None:
+                event['message'] = message
+            if products is not None:
+                event['products'] = card_list(product.id for product in products)
+            send(channel_name, event)
+
+        response = await handle_turn_async(self.user, text, progress)
+        await self._send_ordered({
+            'type': 'chat.done',
+            'messages': build_client_messages(text, response),
+        })
+
+    async def _send_ordered(self, event):
+        # 与进度消息走同一个 channel，保证客户端按顺序收到
+        await self.channel_layer.send(self.channel_name, event)
+
+    async def chat_progress(self, event):
+        payload = {'type': 'progress', 'stage': event['stage']}
+        if 'message' in event:
+            payload['message'] = event['message']
+        if 'products' in event:
+            payload['products'] = event['products']
+        await self.send_json(payload)
+
+    async def chat_done(self, event):
+        await self.send_json({'type': 'done', 'messages': event['messages']})
+
+    async def chat_error(self, event):
+        payload = {'type': 'error', 'error': event['error']}
+        if 'retry_after' in event:
+            payload['code'] = 'overloaded'
+            payload['retry_after'] = event['retry_after']
+        await self.send_json(payload)
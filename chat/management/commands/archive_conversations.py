@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from chat.services.archive import ConversationArchiver
+
+
+class Command(BaseCommand):
+    help = '把已结束或长期空闲的会话导出到压缩的归档文件，并从数据库分批删除（建议每天低峰期运行）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--closed-days', type=int, help='已结束的会话多少天后归档，默认取 CHAT_ARCHIVE 配置')
+        parser.add_argument('--idle-days', type=int, help='任何会话空闲多少天后归档，默认取 CHAT_ARCHIVE 配置')
+        parser.add_argument('--batch-size', type=int, help='每批导出的会话数')
+        parser.add_argument('--limit', type=int, help='本次最多归档的会话数')
+        parser.add_argument('--dry-run', action='store_true', help='只统计需要归档的会话和消息数')
+
+    def handle(self, *args, **options):
+        overrides = {
+            key: options[name]
+            for key, name in (
+                ('CLOSED_AFTER_DAYS', 'closed_days'),
+                ('IDLE_AFTER_DAYS', 'idle_days'),
+                ('BATCH_SIZE', 'batch_size'),
+            )
+            if options[name] is not None
+        }
+        archiver = ConversationArchiver()
+        archiver.options.update(overrides)
+
+        stats = archiver.run(limit=options['limit'], dry_run=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(f"需要归档 {stats['conversations']} 个会话，{stats['messages']} 条消息")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"归档 {stats['conversations']} 个会话、{stats['messages']} 条消息，"
+            f"写入 {stats['segments']} 个分段文件，删除 {stats['deleted']} 行"
+        ))
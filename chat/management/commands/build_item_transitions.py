@@ -0,0 +1,60 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.models import InteractionEvent
+from chat.services.cooccurrence import PURCHASED_STATUSES
+from chat.services.transitions import MAX_NEXT, TransitionTable, split_sessions, store_transition_table
+from orders.models import OrderItem
+
+
+class Command(BaseCommand):
+    help = '从行为事件和订单统计商品之间的转移关系，生成会话推荐使用的转移表（建议每晚运行）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=60, help='统计最近多少天的数据')
+        parser.add_argument('--max-next', type=int, default=MAX_NEXT, help='每个商品保留的后继商品数')
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options['days'])
+        sequences = []
+
+        # 同一用户（匿名时为同一会话）按时间排列的浏览、点击和加购
+        events = InteractionEvent.objects.filter(created_at__gte=since).order_by(
+            'user_id', 'session_key', 'created_at'
+        ).values_list('user_id', 'session_key', 'product_id', 'created_at')
+        owner = None
+        current = []
+        for user_id, session_key, product_id, created_at in events.iterator(chunk_size=2000):
+            if (user_id, session_key) != owner:
+                sequences.extend(split_sessions(current))
+                owner = (user_id, session_key)
+                current = []
+            current.append((product_id, created_at))
+        sequences.extend(split_sessions(current))
+        event_sequences = len(sequences)
+
+        # 同一用户先后购买的商品
+        items = OrderItem.objects.filter(
+            order__created_at__gte=since,
+            order__status__in=PURCHASED_STATUSES
+        ).order_by('order__user_id', 'order__created_at', 'id').values_list('order__user_id', 'product_id')
+        owner = None
+        current = []
+        for user_id, product_id in items.iterator(chunk_size=2000):
+            if user_id != owner:
+                if len(current) > 1:
+                    sequences.append(current)
+                owner = user_id
+                current = []
+            current.append(product_id)
+        if len(current) > 1:
+            sequences.append(current)
+
+        table = TransitionTable.build(sequences, max_next=options['max_next'])
+        store_transition_table(table)
+        self.stdout.write(self.style.SUCCESS(
+            f'行为序列 {event_sequences} 条，订单序列 {len(sequences) - event_sequences} 条，'
+            f'转移表包含 {len(table)} 个商品'
+        ))
@@ -0,0 +1,61 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.models import InteractionEvent
+from chat.services.events import build_recent_vector, store_recent_vector
+
+WATERMARK_KEY = 'events:compaction:last_id'
+
+
+class Command(BaseCommand):
+    help = '把行为事件汇总为用户最近的交互向量，并清理过期事件（建议每小时运行）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window-days', type=int, default=30, help='交互向量统计的时间窗口')
+        parser.add_argument('--retention-days', type=int, default=90, help='事件保留天数')
+        parser.add_argument('--batch-size', type=int, default=500, help='每批处理的用户数和删除的事件数')
+        parser.add_argument('--full', action='store_true', help='忽略上次的进度，重建所有用户的向量')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        since = now - timedelta(days=options['window_days'])
+
+        # 只重建上次压缩之后有新事件的用户
+        last_id = 0 if options['full'] else cache.get(WATERMARK_KEY, 0)
+        max_id = InteractionEvent.objects.filter(id__gt=last_id).order_by('-id').values_list('id', flat=True).first()
+        user_ids = []
+        if max_id is not None:
+            user_ids = sorted(set(InteractionEvent.objects.filter(
+                id__gt=last_id, id__lte=max_id, user__isnull=False
+            ).values_list('user_id', flat=True)))
+
+        batch_size = options['batch_size']
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            events = defaultdict(list)
+            for user_id, product_id, event_type, created_at in InteractionEvent.objects.filter(
+                user_id__in=batch, created_at__gte=since
+            ).values_list('user_id', 'product_id', 'event_type', 'created_at').iterator():
+                events[user_id].append((product_id, event_type, created_at))
+            for user_id in batch:
+                store_recent_vector(user_id, build_recent_vector(events.get(user_id, []), now))
+
+        if max_id is not None:
+            cache.set(WATERMARK_KEY, max_id, None)
+
+        # 分批删除过期事件，避免长时间锁表
+        cutoff = now - timedelta(days=options['retention_days'])
+        deleted = 0
+        while True:
+            ids = list(InteractionEvent.objects.filter(
+                created_at__lt=cutoff
+            ).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            deleted += InteractionEvent.objects.filter(id__in=ids).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f'更新 {len(user_ids)} 个用户的交互向量，清理 {deleted} 条过期事件'))
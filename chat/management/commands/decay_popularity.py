@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from chat.services.cooccurrence import order_events
+
+
+class Command(BaseCommand):
+    help = '商品热度按比例衰减（建议每小时运行，整个集群每个衰减间隔只执行一次）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='忽略衰减间隔立即执行')
+
+    def handle(self, *args, **options):
+        if order_events.decay(force=options['force']):
+            self.stdout.write(self.style.SUCCESS('商品热度已衰减'))
+        else:
+            self.stdout.write('本衰减间隔内已经执行过，跳过')
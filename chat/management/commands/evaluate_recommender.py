@@ -0,0 +1,184 @@
+import json
+import math
+import time
+from collections import defaultdict
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+
+from chat.models import Conversation
+from chat.services.factorization import MatrixFactorizationModel
+from chat.services.recommender import PURCHASED_STATUSES, Recommender
+from orders.models import OrderItem
+
+VARIANTS = ('hybrid', 'content_rule_hybrid', 'popular', 'factorization')
+
+
+class Command(BaseCommand):
+    help = '按时间切分回放历史会话，评估推荐算法的效果（precision/recall/NDCG）和开销（延迟/查询数）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cutoff', help='训练/测试切分时间（ISO 格式），默认按 --test-ratio 取订单时间分位点')
+        parser.add_argument('--test-ratio', type=float, default=0.2, help='未指定 --cutoff 时测试集所占比例')
+        parser.add_argument('--k', type=int, default=5, help='评估的推荐列表长度')
+        parser.add_argument('--variants', default=','.join(VARIANTS), help=f'要评估的算法，可选 {", ".join(VARIANTS)}')
+        parser.add_argument('--max-users', type=int, default=500, help='最多回放的测试用户数')
+        parser.add_argument('--factors', type=int, default=16, help='矩阵分解的隐向量维度')
+        parser.add_argument('--output', help='JSON 报告输出路径，默认输出到标准输出')
+
+    def handle(self, *args, **options):
+        variants = [v.strip() for v in options['variants'].split(',') if v.strip()]
+        unknown = set(variants) - set(VARIANTS)
+        if unknown:
+            raise CommandError(f'未知的算法: {", ".join(sorted(unknown))}')
+
+        purchases = list(OrderItem.objects.filter(
+            order__status__in=PURCHASED_STATUSES
+        ).values_list(
+            'order__user_id', 'product_id', 'product__category__name', 'quantity', 'order__created_at'
+        ).order_by('order__created_at'))
+        if not purchases:
+            raise CommandError('没有可用于评估的订单数据')
+
+        cutoff = self._resolve_cutoff(options, purchases)
+        train = [row for row in purchases if row[4] < cutoff]
+        test = [row for row in purchases if row[4] >= cutoff]
+        sessions = self._build_sessions(train, test, cutoff, options['max_users'])
+        if not sessions:
+            raise CommandError('切分时间之后没有可回放的用户会话')
+
+        model = None
+        if 'factorization' in variants:
+            model = MatrixFactorizationModel(factors=options['factors']).fit(
+                (user_id, product_id, quantity) for user_id, product_id, _, quantity, _ in train
+            )
+
+        k = options['k']
+        report = {
+            'cutoff': cutoff.isoformat(),
+            'k': k,
+            'train_interactions': len(train),
+            'test_interactions': len(test),
+            'sessions': len(sessions),
+            'variants': {
+                variant: self._evaluate(variant, sessions, k, cutoff, model)
+                for variant in variants
+            },
+        }
+
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output)
+            self.stdout.write(self.style.SUCCESS(f'评估报告已写入 {options["output"]}'))
+        else:
+            self.stdout.write(output)
+
+    def _resolve_cutoff(self, options, purchases):
+        if options['cutoff']:
+            cutoff = parse_datetime(options['cutoff'])
+            if cutoff is None:
+                date = parse_date(options['cutoff'])
+                if date is None:
+                    raise CommandError('--cutoff 格式错误')
+                cutoff = timezone.datetime(date.year, date.month, date.day)
+            if timezone.is_naive(cutoff):
+                cutoff = timezone.make_aware(cutoff)
+            return cutoff
+        index = int(len(purchases) * (1 - options['test_ratio']))
+        return purchases[min(index, len(purchases) - 1)][4]
+
+    def _build_sessions(self, train, test, cutoff, max_users):
+        """为切分时间之后有购买的用户构造回放会话，只使用切分时间之前的信息作为请求"""
+        relevant = defaultdict(set)
+        for user_id, product_id, _, _, _ in test:
+            relevant[user_id].add(product_id)
+
+        seen = defaultdict(set)
+        last_category = {}
+        for user_id, product_id, category_name, _, _ in train:
+            seen[user_id].add(product_id)
+            last_category[user_id] = category_name
+
+        user_ids = list(relevant)[:max_users]
+        users = get_user_model().objects.in_bulk(user_ids)
+
+        # 每个用户切分时间之前最近一次会话中积累的实体
+        session_entities = {}
+        conversations = Conversation.objects.filter(
+            user_id__in=user_ids,
+            updated_at__lt=cutoff,
+        ).order_by('user_id', '-updated_at').values_list('user_id', 'context')
+        for user_id, context in conversations:
+            if user_id not in session_entities:
+                session_entities[user_id] = {k: v for k, v in (context or {}).get('entities', {}).items() if v}
+
+        sessions = []
+        for user_id in user_ids:
+            entities = session_entities.get(user_id)
+            if not entities and user_id in last_category:
+                entities = {'category': last_category[user_id]}
+            # 测试期买的是训练期已经买过的商品，不作为新的推荐目标
+            targets = relevant[user_id] - seen[user_id]
+            if not targets or user_id not in users:
+                continue
+            sessions.append({
+                'user': users[user_id],
+                'entities': entities or {},
+                'seen': seen[user_id],
+                'relevant': targets,
+            })
+        return sessions
+
+    def _recommend(self, variant, recommender, session, k, model):
+        if variant == 'hybrid':
+            result = recommender.get_recommendations('recommend', session['entities'], user=session['user'], limit=k)
+            return [p.id for p in result.get('products', [])]
+        if variant == 'content_rule_hybrid':
+            result = recommender.get_recommendations('recommend', session['entities'], user=None, limit=k)
+            return [p.id for p in result.get('products', [])]
+        if variant == 'popular':
+            return [p.id for p in recommender._get_popular_products(session['entities'], k)]
+        return model.recommend(session['user'].id, k, exclude=session['seen'])
+
+    def _evaluate(self, variant, sessions, k, cutoff, model):
+        recommender = Recommender()
+        recommender.as_of = cutoff
+
+        precisions, recalls, ndcgs, latencies, query_counts = [], [], [], [], []
+        for session in sessions:
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                recommended = self._recommend(variant, recommender, session, k, model)[:k]
+                latencies.append((time.perf_counter() - started) * 1000)
+            query_counts.append(len(captured))
+
+            relevant = session['relevant']
+            hits = [1 if product_id in relevant else 0 for product_id in recommended]
+            precisions.append(sum(hits) / k)
+            recalls.append(sum(hits) / len(relevant))
+            dcg = sum(hit / math.log2(i + 2) for i, hit in enumerate(hits))
+            idcg = sum(1 / math.log2(i + 2) for i in range(min(len(relevant), k)))
+            ndcgs.append(dcg / idcg if idcg else 0.0)
+
+        return {
+            f'precision@{k}': float(np.mean(precisions)),
+            f'recall@{k}': float(np.mean(recalls)),
+            f'ndcg@{k}': float(np.mean(ndcgs)),
+            'latency_ms': {
+                'p50': float(np.percentile(latencies, 50)),
+                'p90': float(np.percentile(latencies, 90)),
+                'p99': float(np.percentile(latencies, 99)),
+                'mean': float(np.mean(latencies)),
+            },
+            'queries': {
+                'mean': float(np.mean(query_counts)),
+                'p90': float(np.percentile(query_counts, 90)),
+                'max': int(max(query_counts)),
+            },
+        }
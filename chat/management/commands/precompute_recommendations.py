@@ -0,0 +1,64 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from chat.models import Conversation
+from chat.services.precomputed import DEFAULT_LIMIT, DEFAULT_PER_CATEGORY, precompute_shard
+from orders.models import Order
+
+
+def _init_worker():
+    # 子进程不能复用父进程的数据库连接
+    django.setup()
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = '为活跃用户预计算推荐候选（建议每晚运行），按用户ID分片并行计算'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='最近多少天内有订单或会话的用户视为活跃用户')
+        parser.add_argument('--shards', type=int, default=8, help='按用户ID取模分成的分片数')
+        parser.add_argument('--workers', type=int, default=4, help='进程池大小')
+        parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT, help='每个用户保存的候选数量')
+        parser.add_argument('--per-category', type=int, default=DEFAULT_PER_CATEGORY, help='每个分类切片的候选数量')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        since = timezone.now() - timedelta(days=options['days'])
+        active_users = set(
+            Order.objects.filter(created_at__gte=since).values_list('user_id', flat=True).distinct()
+        )
+        active_users.update(
+            Conversation.objects.filter(updated_at__gte=since).values_list('user_id', flat=True).distinct()
+        )
+
+        shard_count = max(1, options['shards'])
+        shards = [[] for _ in range(shard_count)]
+        for user_id in sorted(active_users):
+            shards[user_id % shard_count].append(user_id)
+
+        self.stdout.write(f'活跃用户 {len(active_users)} 个，分为 {shard_count} 片')
+
+        connections.close_all()
+        totals = [0, 0, 0]
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as executor:
+            futures = {
+                executor.submit(precompute_shard, user_ids, options['limit'], options['per_category']): index
+                for index, user_ids in enumerate(shards)
+                if user_ids
+            }
+            for future in as_completed(futures):
+                stored, empty, failed = future.result()
+                totals = [totals[0] + stored, totals[1] + empty, totals[2] + failed]
+                self.stdout.write(f'分片 {futures[future]} 完成: 保存 {stored}, 无候选 {empty}, 失败 {failed}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'预计算完成: 保存 {totals[0]}, 无候选 {totals[1]}, 失败 {totals[2]}, '
+            f'耗时 {time.monotonic() - started:.1f} 秒'
+        ))
@@ -15,6 +15,16 @@ class Conversation(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # 对话管理器查找用户当前活跃会话
+            models.Index(fields=['user', 'current_state', '-updated_at'], name='conv_user_state_updated_idx'),
+            # 会话历史按 (updated_at, id) 键集分页
+            models.Index(fields=['user', '-updated_at', '-id'], name='conv_user_updated_idx'),
+            # 归档任务按最后更新时间查找过期会话
+            models.Index(fields=['updated_at'], name='conv_updated_idx'),
+        ]
+
     def __str__(self):
         return f"Conversation {self.id} ({self.user})"
 
@@ -41,4 +51,112 @@ class Recommendation(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"Recommendation {self.id} ({self.algorithm})"
\ No newline at end of file
+        return f"Recommendation {self.id} ({self.algorithm})"
+
+class ProductCoPurchase(models.Model):
+    """两个商品被同一订单购买的次数（对称存储，两个方向各一行）"""
+    product = models.ForeignKey('products.Product', related_name='+', on_delete=models.CASCADE)
+    other = models.ForeignKey('products.Product', related_name='+', on_delete=models.CASCADE)
+    count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'other'], name='copurchase_pair_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['product', '-count'], name='copurchase_product_count_idx'),
+        ]
+
+    def __str__(self):
+        return f"CoPurchase {self.product_id}-{self.other_id} ({self.count})"
+
+
+class UserProductInteraction(models.Model):
+    """用户与商品的交互权重，由订单事件增量更新"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    product = models.ForeignKey('products.Product', related_name='+', on_delete=models.CASCADE)
+    weight = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='interaction_user_product_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-weight'], name='interaction_user_weight_idx'),
+        ]
+
+    def __str__(self):
+        return f"Interaction {self.user_id}-{self.product_id} ({self.weight})"
+
+
+class ProductPopularity(models.Model):
+    """商品热度计数，定期按时间衰减"""
+    product = models.OneToOneField(
+        'products.Product',
+        primary_key=True,
+        related_name='popularity',
+        on_delete=models.CASCADE,
+    )
+    score = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score'], name='popularity_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"Popularity {self.product_id} ({self.score})"
+
+
+class InteractionEvent(models.Model):
+    """浏览、点击、加入订单等行为事件，只追加写入，由压缩任务汇总后定期清理"""
+    class Type(models.TextChoices):
+        VIEW = 'view', 'View'
+        CLICK = 'click', 'Click'
+        ADD_TO_ORDER = 'add_to_order', 'Add to order'
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.CASCADE)
+    session_key = models.CharField(max_length=40, blank=True, default='')
+    product = models.ForeignKey('products.Product', related_name='+', on_delete=models.CASCADE)
+    event_type = models.CharField(max_length=20, choices=Type.choices)
+    source = models.CharField(max_length=20, blank=True, default='')
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # 压缩任务按用户读取时间窗口内的事件
+            models.Index(fields=['user', 'created_at'], name='event_user_created_idx'),
+            models.Index(fields=['created_at'], name='event_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Event {self.event_type} {self.user_id}-{self.product_id}"
+
+
+class ArchivedConversation(models.Model):
+    """
+    已归档会话的索引
+
+    会话及其消息、推荐记录写入压缩的 JSONL 分段文件后从热表删除，
+    这里记录会话所在的分段文件，读取归档历史时按需打开。
+    """
+    conversation_id = models.BigIntegerField(unique=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    current_state = models.CharField(max_length=20)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    segment = models.CharField(max_length=255)  # 相对于归档目录的路径
+    message_count = models.PositiveIntegerField(default=0)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # 归档历史与热表历史一样按 (updated_at, id) 键集分页
+            models.Index(fields=['user', '-updated_at', '-conversation_id'], name='archive_user_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived conversation {self.conversation_id} ({self.segment})"
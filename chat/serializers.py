@@ -1,14 +1,44 @@
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
+
+from products.cards import get_cards
+from products.versions import catalog_version
+
 from .models import Conversation, Message
+from .services.history import hydrate_structured_data
+
 
 class MessageSerializer(serializers.ModelSerializer):
+    # 消息中只保存商品引用，输出时补全为卡片（与历史接口相同）
+    structured_data = serializers.SerializerMethodField()
+
     class Meta:
         model = Message
         fields = ('message_type', 'content', 'structured_data')
 
+    def get_structured_data(self, message):
+        # 卡片由 ConversationSerializer 为整个会话批量读取；单独使用时按消息读取
+        cards = self.context.get('cards')
+        if cards is None:
+            cards = get_cards((message.structured_data or {}).get('product_ids', []))
+        return hydrate_structured_data(message.structured_data, cards, self.context.get('catalog_version'))
+
+
 class ConversationSerializer(serializers.ModelSerializer):
     messages = MessageSerializer(many=True)
 
     class Meta:
         model = Conversation
-        fields = ('id', 'messages')
\ No newline at end of file
+        fields = ('id', 'messages')
+
+    def to_representation(self, instance):
+        prefetch_related_objects([instance], 'messages')
+        cards = self.context.setdefault('cards', {})
+        cards.update(get_cards(
+            product_id
+            for message in instance.messages.all()
+            for product_id in (message.structured_data or {}).get('product_ids', [])
+            if product_id not in cards
+        ))
+        self.context.setdefault('catalog_version', catalog_version())
+        return super().to_representation(instance)
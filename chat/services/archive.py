@@ -0,0 +1,326 @@
+"""
+会话归档
+
+已结束或长期空闲的会话连同消息、推荐记录导出为 gzip 压缩的 JSONL 分段文件，
+按会话创建日期分区存放在本地目录（<DIR>/YYYY/MM/DD/*.jsonl.gz），每行一个会话。
+分段文件写完并改名后才写入 ArchivedConversation 索引，再从热表分批删除；
+中途失败时下次运行会跳过已导出的会话，只继续删除。
+只删除导出之后没有变化的会话（updated_at 与消息数都与索引一致），
+选出之后又有新一轮对话的会话留在热表，下次运行时重新导出。
+读取归档历史时按索引找到分段文件，每个文件只打开一次。
+"""
+import gzip
+import json
+import logging
+import os
+import time
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from django.utils import timezone
+
+from products.cards import get_cards
+from products.versions import catalog_version
+
+from ..models import ArchivedConversation, Conversation, Message, Recommendation
+from .conversation_state import ACTIVE_STATES, conversation_store
+from .history import DEFAULT_PAGE_SIZE, decode_cursor, encode_cursor, hydrate_structured_data
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'DIR': Path(settings.BASE_DIR) / 'archive' / 'chat',
+    'CLOSED_AFTER_DAYS': 30,
+    'IDLE_AFTER_DAYS': 90,
+    'BATCH_SIZE': 200,
+    'DELETE_BATCH_SIZE': 500,
+    'PAUSE': 0.05,
+}
+
+
+class ConversationArchiver:
+    """会话的导出、清理和归档读取"""
+
+    def __init__(self, options=None):
+        self.options = {**DEFAULT_OPTIONS, **(options or getattr(settings, 'CHAT_ARCHIVE', {}))}
+        self.root = Path(self.options['DIR'])
+
+    # 导出与清理
+
+    def candidates(self, now=None):
+        """需要归档的会话：已结束超过 CLOSED_AFTER_DAYS 天，或空闲超过 IDLE_AFTER_DAYS 天"""
+        now = now or timezone.now()
+        closed_cutoff = now - timedelta(days=self.options['CLOSED_AFTER_DAYS'])
+        idle_cutoff = now - timedelta(days=self.options['IDLE_AFTER_DAYS'])
+        return Conversation.objects.filter(
+            Q(updated_at__lt=idle_cutoff)
+            | Q(updated_at__lt=closed_cutoff) & ~Q(current_state__in=ACTIVE_STATES)
+        )
+
+    def run(self, now=None, limit=None, dry_run=False):
+        """
+        分批归档过期会话
+
+        Args:
+            now: 计算过期时间的基准时间
+            limit: 最多处理的会话数，为空时不限
+            dry_run: 只统计，不导出也不删除
+
+        Returns:
+            dict: conversations、messages、segments、deleted 计数
+        """
+        stats = {'conversations': 0, 'messages': 0, 'segments': 0, 'deleted': 0}
+        candidates = self.candidates(now)
+        if dry_run:
+            stats['conversations'] = candidates.count()
+            stats['messages'] = Message.objects.filter(conversation__in=candidates).count()
+            return stats
+
+        last_id = 0
+        while limit is None or stats['conversations'] < limit:
+            size = self.options['BATCH_SIZE']
+            if limit is not None:
+                size = min(size, limit - stats['conversations'])
+            ids = list(candidates.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:size])
+            if not ids:
+                break
+            last_id = ids[-1]
+            batch = self.archive_batch(ids)
+            for key, value in batch.items():
+                stats[key] += value
+        return stats
+
+    def archive_batch(self, conversation_ids):
+        """导出一批会话并从热表删除"""
+        stats = {'conversations': len(conversation_ids), 'messages': 0, 'segments': 0, 'deleted': 0}
+        current = self._snapshot(conversation_ids)
+        exported = {
+            row['conversation_id']: (row['updated_at'], row['message_count'])
+            for row in ArchivedConversation.objects.filter(conversation_id__in=conversation_ids).values(
+                'conversation_id', 'updated_at', 'message_count'
+            )
+        }
+        # 未导出过的，以及导出后又有新对话的会话需要（重新）导出
+        pending = [
+            conversation_id for conversation_id in conversation_ids
+            if conversation_id in current and exported.get(conversation_id) != current[conversation_id]
+        ]
+
+        if pending:
+            records = self._collect(pending)
+            partitions = defaultdict(list)
+            for record, conversation in records:
+                partitions[timezone.localdate(conversation.created_at)].append((record, conversation))
+
+            index_rows = []
+            for day, items in partitions.items():
+                segment = self._write_segment(day, [record for record, _ in items])
+                stats['segments'] += 1
+                for record, conversation in items:
+                    stats['messages'] += len(record['messages'])
+                    index_rows.append(ArchivedConversation(
+                        conversation_id=conversation.id,
+                        user_id=conversation.user_id,
+                        current_state=conversation.current_state,
+                        created_at=conversation.created_at,
+                        updated_at=conversation.updated_at,
+                        segment=segment,
+                        message_count=len(record['messages']),
+                    ))
+            with transaction.atomic():
+                # 重新导出的会话以新的分段文件为准
+                ArchivedConversation.objects.filter(conversation_id__in=[row.conversation_id for row in index_rows]).delete()
+                ArchivedConversation.objects.bulk_create(index_rows)
+
+        stats['deleted'] = self._purge(conversation_ids)
+        return stats
+
+    def _snapshot(self, conversation_ids):
+        """会话当前的 {id: (updated_at, 消息数)}"""
+        return {
+            row['id']: (row['updated_at'], row['message_count'])
+            for row in Conversation.objects.filter(id__in=conversation_ids).annotate(
+                message_count=Count('messages')
+            ).values('id', 'updated_at', 'message_count')
+        }
+
+    def _collect(self, conversation_ids):
+        """读取会话、消息和推荐记录，返回 [(归档记录, 会话)]"""
+        messages = defaultdict(list)
+        for message in Message.objects.filter(conversation_id__in=conversation_ids).order_by('id').values(
+            'id', 'conversation_id', 'message_type', 'content', 'structured_data', 'created_at'
+        ).iterator():
+            messages[message.pop('conversation_id')].append(message)
+
+        Through = Recommendation.products.through
+        recommended = defaultdict(list)
+        for recommendation_id, product_id in Through.objects.filter(
+            recommendation__conversation_id__in=conversation_ids
+        ).order_by('id').values_list('recommendation_id', 'product_id').iterator():
+            recommended[recommendation_id].append(product_id)
+
+        recommendations = defaultdict(list)
+        for recommendation in Recommendation.objects.filter(conversation_id__in=conversation_ids).order_by('id').values(
+            'id', 'conversation_id', 'algorithm', 'feedback', 'created_at'
+        ).iterator():
+            recommendation['product_ids'] = recommended.get(recommendation['id'], [])
+            recommendations[recommendation.pop('conversation_id')].append(recommendation)
+
+        records = []
+        for conversation in Conversation.objects.filter(id__in=conversation_ids).order_by('id'):
+            records.append(({
+                'id': conversation.id,
+                'user_id': conversation.user_id,
+                'state': conversation.current_state,
+                'context': conversation.context,
+                'created_at': conversation.created_at,
+                'updated_at': conversation.updated_at,
+                'messages': messages.get(conversation.id, []),
+                'recommendations': recommendations.get(conversation.id, []),
+            }, conversation))
+        return records
+
+    def _write_segment(self, day, records):
+        """写入一个分段文件，先写临时文件再改名，返回相对路径"""
+        relative = Path(day.strftime('%Y/%m/%d')) / (
+            f"{timezone.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}.jsonl.gz"
+        )
+        path = self.root / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(path.name + '.part')
+        with open(temp_path, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as stream:
+                for record in records:
+                    line = json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+                    stream.write(line.encode('utf-8'))
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(temp_path, path)
+        return relative.as_posix()
+
+    def _purge(self, conversation_ids):
+        """
+        按依赖顺序分批删除已导出且导出后没有变化的会话
+
+        先按消息数核对一次，每批删除时再按 (id, updated_at) 与索引核对，
+        之间有新一轮对话的会话不会被删除。
+        """
+        current = self._snapshot(conversation_ids)
+        archived = list(ArchivedConversation.objects.filter(conversation_id__in=conversation_ids).values_list(
+            'conversation_id', 'user_id', 'updated_at', 'message_count'
+        ))
+        unchanged = [
+            (conversation_id, user_id) for conversation_id, user_id, updated_at, message_count in archived
+            if current.get(conversation_id) == (updated_at, message_count)
+        ]
+        if not unchanged:
+            return 0
+        purgeable = Conversation.objects.filter(
+            id__in=[conversation_id for conversation_id, _ in unchanged]
+        ).filter(Exists(ArchivedConversation.objects.filter(
+            conversation_id=OuterRef('id'), updated_at=OuterRef('updated_at')
+        )))
+
+        Through = Recommendation.products.through
+        deleted = 0
+        for queryset in (
+            Through.objects.filter(recommendation__conversation__in=purgeable),
+            Recommendation.objects.filter(conversation__in=purgeable),
+            Message.objects.filter(conversation__in=purgeable),
+            purgeable,
+        ):
+            deleted += self._delete_in_batches(queryset)
+        # 缓存或进程内可能还留着这些会话，删除后一并丢弃
+        for conversation_id, user_id in unchanged:
+            conversation_store.discard(user_id, conversation_id)
+        return deleted
+
+    def _delete_in_batches(self, queryset):
+        # 每次按主键删除一小批，自动提交，锁只持有一条 DELETE 的时间
+        model = queryset.model
+        deleted = 0
+        while True:
+            pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:self.options['DELETE_BATCH_SIZE']])
+            if not pks:
+                return deleted
+            deleted += model.objects.filter(pk__in=pks).delete()[0]
+            if self.options['PAUSE']:
+                time.sleep(self.options['PAUSE'])
+
+    # 读取
+
+    def get_page(self, user, cursor=None, size=DEFAULT_PAGE_SIZE):
+        """
+        读取一页归档会话，格式与 history.get_page 相同
+
+        Returns:
+            dict: {'conversations': [...], 'next_cursor': 下一页游标，没有更多时为 None}
+        """
+        queryset = ArchivedConversation.objects.filter(user=user)
+        if cursor:
+            updated_at, conversation_id = decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(updated_at__lt=updated_at) | Q(updated_at=updated_at, conversation_id__lt=conversation_id)
+            )
+        rows = list(queryset.order_by('-updated_at', '-conversation_id')[:size + 1])
+        has_more = len(rows) > size
+        rows = rows[:size]
+        return {
+            'conversations': self.load(rows),
+            'next_cursor': encode_cursor(rows[-1].updated_at, rows[-1].conversation_id) if has_more else None,
+        }
+
+    def load(self, rows):
+        """按索引行读取归档会话，顺序与 rows 一致；分段文件缺失时跳过并记录日志"""
+        wanted = defaultdict(set)
+        for row in rows:
+            wanted[row.segment].add(row.conversation_id)
+
+        records = {}
+        for segment, conversation_ids in wanted.items():
+            try:
+                with gzip.open(self.root / segment, 'rt', encoding='utf-8') as stream:
+                    for line in stream:
+                        record = json.loads(line)
+                        if record['id'] in conversation_ids:
+                            records[record['id']] = record
+            except OSError as e:
+                logger.error(f"读取归档分段 {segment} 失败: {e}")
+
+        cards = get_cards(
+            product_id
+            for record in records.values()
+            for message in record['messages']
+            for product_id in (message['structured_data'] or {}).get('product_ids', [])
+        )
+        current_version = catalog_version()
+        conversations = []
+        for row in rows:
+            record = records.get(row.conversation_id)
+            if record is None:
+                continue
+            conversations.append({
+                'id': record['id'],
+                'created_at': record['created_at'],
+                'updated_at': record['updated_at'],
+                'archived': True,
+                'messages': [
+                    {
+                        'message_type': message['message_type'],
+                        'content': message['content'],
+                        'structured_data': hydrate_structured_data(message['structured_data'], cards, current_version),
+                        'created_at': message['created_at'],
+                    }
+                    for message in record['messages']
+                ],
+            })
+        return conversations
+
+
+archiver = ConversationArchiver()
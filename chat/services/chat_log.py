@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.db import connection, transaction
+
+from ..models import Message, Recommendation
+from .write_behind import BackgroundBatcher
+
+DEFAULT_OPTIONS = {
+    'ENABLED': True,
+    'MAX_QUEUE': 10000,
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 1.0,
+    'BLOCK_TIMEOUT': 0.05,
+}
+
+
+class ChatLogBuffer(BackgroundBatcher):
+    """
+    聊天消息与推荐记录的延迟批量写入
+
+    请求路径只调用 log_message / log_recommendation 入队，
+    后台线程用 bulk_create 一次写入消息、推荐记录以及推荐商品的多对多关联行。
+    """
+
+    def __init__(self):
+        options = {**DEFAULT_OPTIONS, **getattr(settings, 'CHAT_WRITE_BEHIND', {})}
+        super().__init__(
+            'chat-log',
+            max_queue=options['MAX_QUEUE'],
+            batch_size=options['BATCH_SIZE'],
+            flush_interval=options['FLUSH_INTERVAL'],
+            block_timeout=options['BLOCK_TIMEOUT'],
+            enabled=options['ENABLED'],
+        )
+
+    def log_message(self, conversation_id, message_type, content, structured_data=None):
+        return self.submit(('message', {
+            'conversation_id': conversation_id,
+            'message_type': message_type,
+            'content': content,
+            'structured_data': structured_data,
+        }))
+
+    def log_recommendation(self, conversation_id, algorithm, product_ids):
+        return self.submit(('recommendation', {
+            'conversation_id': conversation_id,
+            'algorithm': algorithm,
+            'product_ids': list(product_ids),
+        }))
+
+    def write_batch(self, items):
+        messages = []
+        recommendations = []
+        for kind, fields in items:
+            if kind == 'message':
+                messages.append(Message(**fields))
+            elif kind == 'recommendation':
+                recommendation = Recommendation(
+                    conversation_id=fields['conversation_id'],
+                    algorithm=fields['algorithm'],
+                )
+                recommendations.append((recommendation, fields['product_ids']))
+
+        with transaction.atomic():
+            if messages:
+                Message.objects.bulk_create(messages)
+
+            if recommendations:
+                if connection.features.can_return_rows_from_bulk_insert:
+                    Recommendation.objects.bulk_create([rec for rec, _ in recommendations])
+                else:
+                    # MySQL 的 bulk_create 拿不到自增主键，推荐记录逐条插入，关联行仍然批量写入
+                    for rec, _ in recommendations:
+                        rec.save()
+
+                Through = Recommendation.products.through
+                Through.objects.bulk_create([
+                    Through(recommendation_id=rec.id, product_id=product_id)
+                    for rec, product_ids in recommendations
+                    for product_id in dict.fromkeys(product_ids)
+                ])
+
+
+chat_log = ChatLogBuffer()
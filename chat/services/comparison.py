@@ -0,0 +1,284 @@
+"""
+基于规格参数的商品比较
+
+按分类把商品的数值型规格（电池容量、屏幕尺寸、存储、价格等）解析单位后换算成统一单位，
+预先构建成 商品 x 属性 的矩阵，按分类版本号缓存。比较 N 个商品时只需取出对应的行，
+返回对齐的属性值和每个属性的胜出商品。
+"""
+import logging
+import re
+from collections import OrderedDict
+
+import numpy as np
+from django.core.cache import cache
+
+from products.models import Product, ProductAttribute
+from products.versions import category_tag, get_versions
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY_PREFIX = 'compare:matrix:'
+CACHE_TIMEOUT = 24 * 3600
+LOCAL_CACHE_SIZE = 32  # 进程内缓存的分类矩阵数
+
+# 规格键的同义词统一成一个名字，值为 (名字, 显示名称)
+KEY_MAP = {
+    '电池': ('battery', '电池容量'),
+    '电池容量': ('battery', '电池容量'),
+    '屏幕': ('screen', '屏幕尺寸'),
+    '屏幕尺寸': ('screen', '屏幕尺寸'),
+    '存储': ('storage', '存储容量'),
+    '存储容量': ('storage', '存储容量'),
+    '机身存储': ('storage', '存储容量'),
+    '硬盘': ('storage', '存储容量'),
+    '内存': ('memory', '内存'),
+    '运行内存': ('memory', '内存'),
+    '重量': ('weight', '重量'),
+    '厚度': ('thickness', '厚度'),
+    '刷新率': ('refresh_rate', '刷新率'),
+    '主频': ('cpu_frequency', '主频'),
+    '像素': ('camera', '摄像头像素'),
+    '摄像头': ('camera', '摄像头像素'),
+    '充电功率': ('charging', '充电功率'),
+    '续航': ('battery_life', '续航时间'),
+}
+
+# 单位换算：原单位 -> (统一单位, 倍数)，按长度从长到短匹配
+UNITS = {
+    'mah': ('mAh', 1),
+    'tb': ('GB', 1024),
+    'gb': ('GB', 1),
+    'mb': ('GB', 1 / 1024),
+    '英寸': ('英寸', 1),
+    '寸': ('英寸', 1),
+    'inch': ('英寸', 1),
+    '"': ('英寸', 1),
+    'kg': ('g', 1000),
+    '千克': ('g', 1000),
+    '克': ('g', 1),
+    'g': ('g', 1),
+    'mm': ('mm', 1),
+    'cm': ('mm', 10),
+    'ghz': ('GHz', 1),
+    'mhz': ('GHz', 0.001),
+    'hz': ('Hz', 1),
+    '万像素': ('万像素', 1),
+    'mp': ('万像素', 100),
+    'w': ('W', 1),
+    '小时': ('小时', 1),
+    'h': ('小时', 1),
+}
+_UNIT_ORDER = sorted(UNITS, key=len, reverse=True)
+_VALUE_RE = re.compile(r'(-?\d+(?:\.\d+)?)\s*(\S*)')
+
+# 这些属性中的 "G" 表示 GB 而不是克
+GIGABYTE_KEYS = {'storage', 'memory'}
+
+# 数值越小越好的属性
+LOWER_IS_BETTER = {'price', 'weight', 'thickness'}
+
+# 用户提到的特性对应的属性
+FEATURE_KEYS = {
+    '续航': 'battery',
+    '电池': 'battery',
+    '屏幕': 'screen',
+    '存储': 'storage',
+    '内存': 'memory',
+    '拍照': 'camera',
+    '摄像': 'camera',
+    '轻薄': 'weight',
+    '充电': 'charging',
+    '价格': 'price',
+}
+
+
+def parse_quantity(value):
+    """
+    解析带单位的数值
+
+    Returns:
+        tuple: (换算后的数值, 统一单位)，无法解析时返回 None；没有单位时单位为空字符串
+    """
+    match = _VALUE_RE.search(str(value))
+    if not match:
+        return None
+    number = float(match.group(1))
+    suffix = match.group(2).lower()
+    for unit in _UNIT_ORDER:
+        if suffix.startswith(unit):
+            base, factor = UNITS[unit]
+            return number * factor, base
+    return number, ''
+
+
+def canonical_key(key):
+    """规格键统一后的 (名字, 显示名称)"""
+    return KEY_MAP.get(key, (key, key))
+
+
+class SpecMatrix:
+    """
+    一个分类的规格矩阵
+
+    product_ids 升序排列，matrix[i, j] 是第 i 个商品第 j 个属性的数值，缺失为 NaN。
+    columns 为每个属性的 (名字, 显示名称, 单位)。
+    """
+
+    def __init__(self, product_ids, columns, matrix):
+        self.product_ids = product_ids
+        self.columns = columns
+        self.matrix = matrix
+
+    @classmethod
+    def build(cls, category_id):
+        products = dict(Product.objects.filter(category_id=category_id).values_list('id', 'price'))
+        product_ids = np.array(sorted(products), dtype=np.int64)
+        row_index = {product_id: i for i, product_id in enumerate(product_ids.tolist())}
+
+        columns = [('price', '价格', '元')]
+        column_index = {'price': 0}
+        values = {(row_index[product_id], 0): float(price) for product_id, price in products.items()}
+
+        attributes = ProductAttribute.objects.filter(
+            product__category_id=category_id,
+            numeric_value__isnull=False
+        ).values_list('product_id', 'key', 'value')
+        for product_id, key, value in attributes:
+            if product_id not in row_index:
+                continue
+            parsed = parse_quantity(value)
+            if parsed is None:
+                continue
+            number, unit = parsed
+            name, label = canonical_key(key)
+            if name in GIGABYTE_KEYS and unit == 'g':
+                unit = 'GB'
+            if name not in column_index:
+                column_index[name] = len(columns)
+                columns.append((name, label, unit))
+            j = column_index[name]
+            if columns[j][2] != unit:
+                # 同一属性出现不同量纲（例如混入了型号数字），以先出现的单位为准
+                continue
+            values.setdefault((row_index[product_id], j), number)
+
+        matrix = np.full((len(product_ids), len(columns)), np.nan)
+        for (i, j), number in values.items():
+            matrix[i, j] = number
+        return cls(product_ids, columns, matrix)
+
+    def rows(self, product_ids):
+        """取出商品对应的行，不在矩阵中的商品为全 NaN 行"""
+        ids = np.asarray(product_ids, dtype=np.int64)
+        positions = np.searchsorted(self.product_ids, ids)
+        positions = np.clip(positions, 0, max(len(self.product_ids) - 1, 0))
+        found = (self.product_ids[positions] == ids) if len(self.product_ids) else np.zeros(len(ids), dtype=bool)
+        rows = np.full((len(ids), len(self.columns)), np.nan)
+        if len(self.product_ids):
+            rows[found] = self.matrix[positions[found]]
+        return rows
+
+    def to_cache(self):
+        return {
+            'product_ids': self.product_ids.tobytes(),
+            'columns': self.columns,
+            'matrix': self.matrix.tobytes(),
+        }
+
+    @classmethod
+    def from_cache(cls, entry):
+        product_ids = np.frombuffer(entry['product_ids'], dtype=np.int64)
+        matrix = np.frombuffer(entry['matrix'], dtype=np.float64).reshape(len(product_ids), len(entry['columns']))
+        return cls(product_ids, [tuple(column) for column in entry['columns']], matrix)
+
+
+_local_matrices = OrderedDict()
+
+
+def get_spec_matrix(category_id):
+    """返回分类的规格矩阵，分类版本号变化后自动重建"""
+    tag = category_tag(category_id)
+    version = get_versions([tag])[tag]
+    local_key = (category_id, version)
+
+    matrix = _local_matrices.get(local_key)
+    if matrix is not None:
+        _local_matrices.move_to_end(local_key)
+        return matrix
+
+    cache_key = f'{CACHE_KEY_PREFIX}{category_id}:{version}'
+    entry = cache.get(cache_key)
+    if entry is not None:
+        matrix = SpecMatrix.from_cache(entry)
+    else:
+        matrix = SpecMatrix.build(category_id)
+        cache.set(cache_key, matrix.to_cache(), CACHE_TIMEOUT)
+
+    _local_matrices[local_key] = matrix
+    while len(_local_matrices) > LOCAL_CACHE_SIZE:
+        _local_matrices.popitem(last=False)
+    return matrix
+
+
+def compare_products(products, feature=None):
+    """
+    比较一组商品的数值规格
+
+    Args:
+        products: 商品对象列表
+        feature: 用户关注的特性，对应的属性排在最前
+
+    Returns:
+        dict: {'product_ids': [...], 'attributes': [{'key', 'label', 'unit', 'values', 'winner'}, ...]}，
+              少于两个商品时返回 None
+    """
+    products = list(products)
+    if len(products) < 2:
+        return None
+
+    product_ids = [product.id for product in products]
+    position = {product_id: i for i, product_id in enumerate(product_ids)}
+
+    # 每个分类取一次矩阵切片，再按属性名对齐到同一张表
+    columns = OrderedDict()
+    for category_id in dict.fromkeys(product.category_id for product in products):
+        matrix = get_spec_matrix(category_id)
+        members = [product.id for product in products if product.category_id == category_id]
+        rows = matrix.rows(members)
+        member_positions = [position[product_id] for product_id in members]
+        for j, (name, label, unit) in enumerate(matrix.columns):
+            column = columns.get(name)
+            if column is None:
+                column = columns[name] = {
+                    'key': name, 'label': label, 'unit': unit, 'values': np.full(len(product_ids), np.nan)
+                }
+            elif column['unit'] != unit:
+                continue
+            column['values'][member_positions] = rows[:, j]
+
+    focus = FEATURE_KEYS.get(feature) if feature else None
+    attributes = []
+    for name, column in columns.items():
+        values = column['values']
+        present = ~np.isnan(values)
+        # 至少两个商品有值才有比较意义
+        if present.sum() < 2:
+            continue
+        if name in LOWER_IS_BETTER:
+            best = np.nanargmin(values)
+        else:
+            best = np.nanargmax(values)
+        # 所有商品取值相同时没有胜出者
+        winner = None if np.nanmin(values) == np.nanmax(values) else product_ids[int(best)]
+        attributes.append({
+            'key': name,
+            'label': column['label'],
+            'unit': column['unit'],
+            'values': [None if np.isnan(v) else round(float(v), 2) for v in values],
+            'winner': winner,
+        })
+
+    if focus:
+        attributes.sort(key=lambda attribute: attribute['key'] != focus)
+
+    return {'product_ids': product_ids, 'attributes': attributes}
@@ -0,0 +1,346 @@
+"""
+活跃会话的状态存储
+
+活跃会话的状态和上下文保存在 settings 中配置的缓存里，每轮对话只在结束时提交一次。
+数据库采用延迟写回：会话空闲一段时间、离开活跃状态（关闭）或连接断开时才写入，
+多轮的修改合并为一次 UPDATE。
+
+多个工作进程共享缓存中的副本：每次读取都比较缓存与本进程副本的版本号，取较新的一个；
+进程内副本只保存尚未写库的修改，缓存丢失时作为后备。提交时按 (会话, 版本号) 在缓存中
+原子地占位，两个进程基于同一版本并发提交时只有先到的生效，后到的记为冲突并丢弃本进程副本。
+"""
+import atexit
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from ..models import Conversation
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'WRITE_BACK': True,  # 为 False 时每次提交立即写库（测试环境使用）
+    'LOCAL_MAXSIZE': 1024,
+    'CACHE_TIMEOUT': 24 * 3600,
+    'CLAIM_TIMEOUT': 600,  # 版本号占位的保留秒数，覆盖并发提交的时间窗口
+    'IDLE_FLUSH': 60,  # 会话空闲多少秒后写库
+    'MAX_DIRTY_AGE': 300,  # 未写库的修改最多保留多少秒
+    'CHECK_INTERVAL': 5,  # 后台线程检查的间隔（秒）
+}
+
+CACHE_KEY_PREFIX = 'chat:conversation:'
+
+# 仍在进行中的会话状态，其他状态视为会话已结束
+ACTIVE_STATES = (
+    Conversation.State.INIT,
+    Conversation.State.COLLECTING,
+    Conversation.State.RECOMMENDING,
+)
+
+
+def _cache_key(user_id):
+    return f'{CACHE_KEY_PREFIX}{user_id}'
+
+
+def _claim_key(entry):
+    return f"{CACHE_KEY_PREFIX}claim:{entry['id']}:{entry['revision']}"
+
+
+def _load_revision():
+    """从数据库加载时的起始版本号：取毫秒时间戳，不会与之前加载后提交过的版本号重复"""
+    return int(time.time() * 1000)
+
+
+def _to_entry(conversation, revision):
+    return {
+        'id': conversation.id,
+        'user_id': conversation.user_id,
+        'state': conversation.current_state,
+        'context': conversation.context,
+        'created_at': conversation.created_at,
+        'revision': revision,
+    }
+
+
+def _from_entry(entry, user=None):
+    conversation = Conversation(
+        id=entry['id'],
+        user_id=entry['user_id'],
+        current_state=entry['state'],
+        # 复制一份，调用方修改上下文不会影响缓存中的副本
+        context=copy.deepcopy(entry['context']),
+        created_at=entry['created_at'],
+    )
+    conversation._state.adding = False
+    conversation._state_revision = entry['revision']
+    if user is not None:
+        # 避免访问 conversation.user 时再查一次用户表
+        conversation.user = user
+    return conversation
+
+
+class ConversationStateStore:
+    """活跃会话状态的缓存与延迟写回"""
+
+    def __init__(self, options=None):
+        self.options = {**DEFAULT_OPTIONS, **(options or getattr(settings, 'CONVERSATION_STATE', {}))}
+        self._local = OrderedDict()  # user_id -> (写入时间, entry)
+        self._dirty = {}  # user_id -> (首次修改时间, 最近修改时间)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+        self._metrics = {
+            'local_hits': 0, 'cache_hits': 0, 'db_loads': 0, 'commits': 0, 'conflicts': 0, 'db_writes': 0,
+        }
+        atexit.register(self.shutdown)
+
+    # 读取
+
+    def get_active(self, user):
+        """返回用户当前的活跃会话，没有时创建"""
+        entry = self._newest(user.id, cache.get(_cache_key(user.id)))
+        if entry is None or entry['state'] not in ACTIVE_STATES:
+            entry = self._load_or_create(user)
+        return _from_entry(entry, user)
+
+    def peek(self, user):
+        """只读地返回用户当前的活跃会话，没有时返回 None，不创建会话也不写缓存"""
+        entry = self._newest(user.id, cache.get(_cache_key(user.id)))
+        if entry is not None and entry['state'] in ACTIVE_STATES:
+            return _from_entry(entry, user)
+        return Conversation.objects.filter(
+            user_id=user.id,
+            current_state__in=ACTIVE_STATES
+        ).order_by('-updated_at').first()
+
+    async def aget_active(self, user):
+        """get_active 的异步版本，使用异步缓存接口和异步 ORM"""
+        entry = self._newest(user.id, await cache.aget(_cache_key(user.id)))
+        if entry is not None and entry['state'] in ACTIVE_STATES:
+            return _from_entry(entry, user)
+
+        conversation = await Conversation.objects.filter(
+            user_id=user.id,
+            current_state__in=ACTIVE_STATES
+        ).order_by('-updated_at').afirst()
+        if conversation is None:
+            conversation = await Conversation.objects.acreate(
+                user_id=user.id,
+                current_state=Conversation.State.INIT,
+                context={}
+            )
+        self._record('db_loads')
+        entry = _to_entry(conversation, _load_revision())
+        await cache.aset(_cache_key(user.id), entry, self.options['CACHE_TIMEOUT'])
+        return _from_entry(entry, user)
+
+    def _newest(self, user_id, cached):
+        """缓存中的副本与本进程尚未写库的副本，取版本号较大的一个"""
+        if cached is not None:
+            self._record('cache_hits')
+        with self._lock:
+            local = self._local.get(user_id)
+        if local is not None and (cached is None or local[1]['revision'] > cached['revision']):
+            self._record('local_hits')
+            return local[1]
+        return cached
+
+    def _load_or_create(self, user):
+        conversation = Conversation.objects.filter(
+            user_id=user.id,
+            current_state__in=ACTIVE_STATES
+        ).order_by('-updated_at').first()
+        if conversation is None:
+            conversation = Conversation.objects.create(
+                user_id=user.id,
+                current_state=Conversation.State.INIT,
+                context={}
+            )
+        self._record('db_loads')
+        entry = _to_entry(conversation, _load_revision())
+        # 在事务中新建的会话等提交后再放进缓存，回滚后缓存里不会留下不存在的会话
+        transaction.on_commit(lambda: self._publish_loaded(user.id, entry))
+        return entry
+
+    def _publish_loaded(self, user_id, entry):
+        cache.set(_cache_key(user_id), entry, self.options['CACHE_TIMEOUT'])
+
+    # 提交与写回
+
+    def commit(self, conversation):
+        """
+        提交一轮对话结束时的状态
+
+        会话离开活跃状态（或关闭了写回）时在当前事务中写库；
+        缓存在事务提交后才更新，回滚的一轮不会在缓存中留下未提交的状态。
+        """
+        revision = getattr(conversation, '_state_revision', 0) + 1
+        conversation._state_revision = revision
+        entry = _to_entry(conversation, revision)
+        written = entry['state'] not in ACTIVE_STATES or not self.options['WRITE_BACK']
+        if written:
+            self._write_row(entry)
+        transaction.on_commit(lambda: self._publish(entry, written))
+
+    def _publish(self, entry, written):
+        """事务提交后更新缓存，未写库的修改交给后台线程写回"""
+        user_id = entry['user_id']
+        if not cache.add(_claim_key(entry), True, self.options['CLAIM_TIMEOUT']):
+            # 其他进程已经基于同一版本提交过，本轮的修改不能覆盖它
+            self._record('conflicts')
+            logger.warning(f"会话 {entry['id']} 的版本 {entry['revision']} 已被其他请求提交，丢弃本次修改")
+            with self._lock:
+                self._dirty.pop(user_id, None)
+                self._local.pop(user_id, None)
+            return
+        self._record('commits')
+        if written:
+            with self._lock:
+                self._dirty.pop(user_id, None)
+                self._local.pop(user_id, None)
+            if entry['state'] not in ACTIVE_STATES:
+                self._evict(user_id)
+                return
+        cache.set(_cache_key(user_id), entry, self.options['CACHE_TIMEOUT'])
+        if written:
+            return
+        self._remember(user_id, entry)
+
+        now = time.monotonic()
+        with self._lock:
+            first, _ = self._dirty.get(user_id, (now, now))
+            self._dirty[user_id] = (first, now)
+        self._ensure_started()
+
+    def flush_user(self, user_id):
+        """立即写回某个用户未写库的会话状态（例如连接断开时）"""
+        with self._lock:
+            dirty = self._dirty.pop(user_id, None)
+        if dirty is not None:
+            self._flush_entry(user_id)
+            self._forget_flushed(user_id)
+
+    def flush(self, force=False):
+        """写回空闲或修改过久的会话，force 为 True 时全部写回"""
+        now = time.monotonic()
+        with self._lock:
+            due = [
+                user_id for user_id, (first, last) in self._dirty.items()
+                if force
+                or now - last >= self.options['IDLE_FLUSH']
+                or now - first >= self.options['MAX_DIRTY_AGE']
+            ]
+            for user_id in due:
+                del self._dirty[user_id]
+        for user_id in due:
+            try:
+                self._flush_entry(user_id)
+            except Exception as e:
+                logger.error(f"写回会话状态失败（用户 {user_id}）: {e}", exc_info=True)
+                continue
+            self._forget_flushed(user_id)
+
+    def shutdown(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.options['CHECK_INTERVAL'] * 2)
+        self.flush(force=True)
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['dirty'] = len(self._dirty)
+            metrics['local_size'] = len(self._local)
+        return metrics
+
+    def _flush_entry(self, user_id):
+        # 以缓存中的最新版本为准，其他进程可能已经提交过更新的状态
+        entry = cache.get(_cache_key(user_id))
+        with self._lock:
+            local = self._local.get(user_id)
+        if local is not None and (entry is None or local[1]['revision'] > entry['revision']):
+            entry = local[1]
+        if entry is not None:
+            self._write(entry)
+
+    def _write(self, entry):
+        self._write_row(entry)
+        if entry['state'] not in ACTIVE_STATES:
+            self._evict(entry['user_id'])
+
+    def _write_row(self, entry):
+        Conversation.objects.filter(id=entry['id']).update(
+            current_state=entry['state'],
+            context=entry['context'],
+            updated_at=timezone.now(),
+        )
+        self._record('db_writes')
+
+    def discard(self, user_id, conversation_id):
+        """会话已从数据库删除（例如归档后），丢弃缓存和本进程中指向它的副本"""
+        cached = cache.get(_cache_key(user_id))
+        if cached is not None and cached['id'] == conversation_id:
+            cache.delete(_cache_key(user_id))
+        with self._lock:
+            local = self._local.get(user_id)
+            if local is not None and local[1]['id'] == conversation_id:
+                self._local.pop(user_id, None)
+                self._dirty.pop(user_id, None)
+
+    def _evict(self, user_id):
+        cache.delete(_cache_key(user_id))
+        with self._lock:
+            self._local.pop(user_id, None)
+
+    # 进程内未写库的副本
+
+    def _forget_flushed(self, user_id):
+        """写库后丢弃进程内副本，之后以缓存为准；写回期间又有新修改时保留"""
+        with self._lock:
+            if user_id not in self._dirty:
+                self._local.pop(user_id, None)
+
+    def _remember(self, user_id, entry):
+        with self._lock:
+            self._local[user_id] = (time.monotonic(), entry)
+            self._local.move_to_end(user_id)
+            while len(self._local) > self.options['LOCAL_MAXSIZE']:
+                oldest = next(iter(self._local))
+                if oldest in self._dirty:
+                    # 未写库的会话不淘汰，移到末尾
+                    self._local.move_to_end(oldest)
+                    if len(self._dirty) >= len(self._local):
+                        break
+                    continue
+                del self._local[oldest]
+
+    def _record(self, counter):
+        with self._lock:
+            self._metrics[counter] += 1
+
+    # 后台写回线程
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='conversation-state-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.options['CHECK_INTERVAL']):
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+
+conversation_store = ConversationStateStore()
@@ -0,0 +1,199 @@
+"""
+订单事件驱动的协同信号增量更新
+
+订单进入已支付/已发货/已完成状态时（orders.signals.order_status_changed），
+按订单内的商品增量更新共同购买次数、用户-商品交互权重和商品热度；
+已购买的订单被取消时反向扣减。事件在后台线程中批量合并写入，
+用幂等键保证同一订单只计一次，并定期清理被改动商品的计数。
+热度衰减是全局操作，由 decay_popularity 命令定时执行，不在各进程的事件处理中进行。
+"""
+import logging
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from ..models import ProductCoPurchase, ProductPopularity, UserProductInteraction
+from .write_behind import BackgroundBatcher
+
+logger = logging.getLogger(__name__)
+
+# 订单状态在推荐模块中使用英文，在订单视图中使用中文，两者都要识别
+PURCHASED_STATUSES = {'paid', 'shipped', 'completed', '已支付', '已发货', '已完成'}
+CANCELLED_STATUSES = {'cancelled', '已取消'}
+
+IDEMPOTENCY_KEY_PREFIX = 'order-event:'
+IDEMPOTENCY_TIMEOUT = 90 * 24 * 3600
+
+# 热度衰减的占位键，存在期间（一个衰减间隔）其他进程和主机不再衰减
+DECAY_LOCK_KEY = 'popularity:decayed'
+
+DEFAULT_OPTIONS = {
+    'ENABLED': True,
+    'MAX_QUEUE': 10000,
+    'BATCH_SIZE': 100,
+    'FLUSH_INTERVAL': 1.0,
+    'COMPACT_INTERVAL': 600,  # 清理被改动商品的计数的间隔（秒）
+    'MAX_NEIGHBORS': 50,  # 每个商品保留的共同购买商品数
+    'DECAY_INTERVAL': 24 * 3600,  # 热度衰减间隔（秒）
+    'DECAY_FACTOR': 0.95,
+}
+
+
+class OrderEventConsumer(BackgroundBatcher):
+    """订单事件消费者"""
+
+    def __init__(self):
+        options = {**DEFAULT_OPTIONS, **getattr(settings, 'ORDER_EVENTS', {})}
+        super().__init__(
+            'order-events',
+            max_queue=options['MAX_QUEUE'],
+            batch_size=options['BATCH_SIZE'],
+            flush_interval=options['FLUSH_INTERVAL'],
+            block_timeout=0.05,
+            enabled=options['ENABLED'],
+        )
+        self.options = options
+        self._touched_products = set()
+        self._touched_users = set()
+        self._last_compaction = time.monotonic()
+
+    def handle_status_change(self, sender, order, old_status, new_status, **kwargs):
+        """order_status_changed 的接收函数，只读取本订单的商品"""
+        if new_status in PURCHASED_STATUSES and old_status not in PURCHASED_STATUSES:
+            kind, sign = 'purchase', 1
+        elif new_status in CANCELLED_STATUSES and old_status in PURCHASED_STATUSES:
+            kind, sign = 'refund', -1
+        else:
+            return
+
+        self.submit({
+            'key': f'{order.id}:{kind}',
+            'user_id': order.user_id,
+            'sign': sign,
+            'items': list(order.items.values_list('product_id', 'quantity')),
+        })
+
+    def write_batch(self, events):
+        # 幂等：同一订单的同一类事件只处理一次
+        accepted = [
+            event for event in events
+            if cache.add(f"{IDEMPOTENCY_KEY_PREFIX}{event['key']}", 1, IDEMPOTENCY_TIMEOUT)
+        ]
+        if not accepted:
+            return
+
+        copurchase = Counter()
+        interactions = Counter()
+        popularity = Counter()
+        for event in accepted:
+            quantities = Counter()
+            for product_id, quantity in event['items']:
+                quantities[product_id] += quantity
+            sign = event['sign']
+            for product_id, quantity in quantities.items():
+                interactions[(event['user_id'], product_id)] += sign * quantity
+                popularity[(product_id,)] += sign * quantity
+                for other_id in quantities:
+                    if other_id != product_id:
+                        copurchase[(product_id, other_id)] += sign
+
+        try:
+            with transaction.atomic():
+                _apply_deltas(ProductCoPurchase, ('product_id', 'other_id'), 'count', copurchase)
+                _apply_deltas(UserProductInteraction, ('user_id', 'product_id'), 'weight', interactions)
+                _apply_deltas(ProductPopularity, ('product_id',), 'score', popularity)
+        except Exception:
+            # 写入失败时撤销幂等键，重试时还能再处理
+            cache.delete_many([f"{IDEMPOTENCY_KEY_PREFIX}{event['key']}" for event in accepted])
+            raise
+
+        self._touched_products.update(product_id for product_id, _ in copurchase)
+        self._touched_users.update(user_id for user_id, _ in interactions)
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        now = time.monotonic()
+        if now - self._last_compaction >= self.options['COMPACT_INTERVAL']:
+            self._last_compaction = now
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"清理协同信号失败: {e}", exc_info=True)
+
+    def compact(self):
+        """只处理上次清理后被改动过的商品和用户：删除非正计数，截断共同购买列表"""
+        products, self._touched_products = self._touched_products, set()
+        users, self._touched_users = self._touched_users, set()
+
+        if products:
+            ProductCoPurchase.objects.filter(product_id__in=products, count__lte=0).delete()
+            for product_id in products:
+                overflow = list(ProductCoPurchase.objects.filter(
+                    product_id=product_id
+                ).order_by('-count').values_list('id', flat=True)[self.options['MAX_NEIGHBORS']:])
+                if overflow:
+                    ProductCoPurchase.objects.filter(id__in=overflow).delete()
+        if users:
+            UserProductInteraction.objects.filter(user_id__in=users, weight__lte=0).delete()
+
+    def decay(self, force=False):
+        """
+        热度整体按比例衰减，近期的购买权重更高
+
+        整个集群每个 DECAY_INTERVAL 只衰减一次：先在缓存中原子地占位，占位已存在时跳过。
+
+        Returns:
+            bool: 是否执行了衰减
+        """
+        if force:
+            cache.set(DECAY_LOCK_KEY, 1, self.options['DECAY_INTERVAL'])
+        elif not cache.add(DECAY_LOCK_KEY, 1, self.options['DECAY_INTERVAL']):
+            return False
+        try:
+            with transaction.atomic():
+                ProductPopularity.objects.update(score=F('score') * self.options['DECAY_FACTOR'])
+                ProductPopularity.objects.filter(score__lt=0.01).delete()
+        except Exception:
+            # 失败时释放占位，下次运行可以重试
+            cache.delete(DECAY_LOCK_KEY)
+            raise
+        return True
+
+
+def _apply_deltas(model, key_fields, value_field, deltas):
+    """把增量累加到计数表：已有行批量更新，新行批量插入"""
+    if not deltas:
+        return
+
+    condition = Q()
+    for key in deltas:
+        condition |= Q(**dict(zip(key_fields, key)))
+    existing = {
+        tuple(getattr(row, field) for field in key_fields): row
+        for row in model.objects.select_for_update().filter(condition)
+    }
+
+    now = timezone.now()
+    to_update = []
+    to_create = []
+    for key, delta in deltas.items():
+        row = existing.get(key)
+        if row is None:
+            to_create.append(model(**dict(zip(key_fields, key)), **{value_field: delta}))
+        else:
+            setattr(row, value_field, getattr(row, value_field) + delta)
+            row.updated_at = now
+            to_update.append(row)
+
+    if to_update:
+        model.objects.bulk_update(to_update, [value_field, 'updated_at'])
+    if to_create:
+        model.objects.bulk_create(to_create)
+
+
+order_events = OrderEventConsumer()
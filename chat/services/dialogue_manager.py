@@ -1,13 +1,49 @@
 import json
 import logging
 from datetime import datetime
-from .nlp_processor import NLPProcessor
+from .inference import get_nlp_processor
 from .recommender import Recommender
+from .chat_log import chat_log
+from .conversation_state import conversation_store
+from .events import get_recent_clicks
 from ..models import Conversation, Message, Recommendation
+from products.cards import card_list
 from products.models import Product
 
 logger = logging.getLogger(__name__)
 
+SESSION_ITEMS_LIMIT = 20  # 会话上下文中保留的最近商品数
+
+
+def build_client_messages(text, response):
+    """把对话管理器的回复转换成前端使用的消息列表"""
+    messages = [
+        {
+            'message_type': 'user',
+            'content': text
+        },
+        {
+            'message_type': 'system',
+            'content': response['response']
+        },
+    ]
+
+    # 如果有商品数据，为每个商品创建单独的消息
+    structured_data = response.get('structured_data') or {}
+    for product in structured_data.get('products') or []:
+        messages.append({
+            'message_type': 'product',
+            'content': product['name'],
+            'structured_data': product
+        })
+    return messages
+
+
+def turn_entities(context_entities, entities):
+    """本轮推荐使用的实体：会话中保存的实体，被本轮识别出的实体覆盖"""
+    saved = {**context_entities, **{key: value for key, value in entities.items() if value}}
+    return {**saved, **entities}
+
 
 class DialogueManager:
     """
@@ -21,16 +57,23 @@ class DialogueManager:
     """
 
     def __init__(self):
-        self.nlp = NLPProcessor()
         self.recommender = Recommender()
 
-    def process_message(self, user, message_data):
+    @property
+    def nlp(self):
+        # 模型在进程内只加载一次，调用方已给出识别结果时不加载
+        return get_nlp_processor()
+
+    def process_message(self, user, message_data, conversation=None, progress=None, degraded=False):
         """
         处理用户消息并返回系统回复
 
         Args:
             user: 当前用户对象
             message_data: 包含用户消息和NLP结果的字典
+            conversation: 调用方已经取得的当前会话，为空时在这里查找或创建
+            progress: 可选的进度回调，推荐过程中先推送回复文本和初步结果
+            degraded: 过载降级模式，推荐不做个性化，直接使用非个性化的缓存结果
 
         Returns:
             dict: 包含系统回复和对话状态的字典
@@ -43,7 +86,8 @@ class DialogueManager:
             nlp_result = self.nlp.process_input(text)
 
         # 获取或创建会话
-        conversation = self._get_or_create_conversation(user)
+        if conversation is None:
+            conversation = self._get_or_create_conversation(user)
 
         # 更新会话上下文
         self._update_context(conversation, nlp_result)
@@ -53,21 +97,24 @@ class DialogueManager:
         entities = nlp_result['entities']
 
         # 根据意图生成回复
-        response = self._generate_response(conversation, intent, entities)
+        response = self._generate_response(conversation, intent, entities, progress, degraded)
+
+        # 记住本轮出现的商品，供后续轮次的会话推荐使用
+        self._remember_products(conversation, response)
 
-        # 更新会话状态
+        # 更新会话状态，本轮的修改在这里一次性提交（数据库延迟写回）
         new_state = self._determine_next_state(conversation.current_state, intent)
+        conversation.current_state = new_state
+        conversation_store.commit(conversation)
 
-        # 记录本次推荐
+        # 记录本次推荐（延迟批量写入，不阻塞请求）
         if 'products' in response and response['products'] and len(response['products']) > 0:
             algorithm = response.get('algorithm', 'unknown')
-            recommendation = Recommendation.objects.create(
-                conversation=conversation,
-                algorithm=algorithm
+            chat_log.log_recommendation(
+                conversation.id,
+                algorithm,
+                [product.id for product in response['products']]
             )
-            # 添加推荐的商品
-            for product in response['products']:
-                recommendation.products.add(product)
 
         return {
             'response': response['message'] if isinstance(response, dict) and 'message' in response else response,
@@ -77,26 +124,12 @@ class DialogueManager:
         }
 
     def _get_or_create_conversation(self, user):
-        """获取当前活跃会话或创建新会话"""
-        # 查找当前用户最近的未关闭会话
-        active_conversation = Conversation.objects.filter(
-            user=user,
-            current_state__in=[
-                Conversation.State.INIT,
-                Conversation.State.COLLECTING,
-                Conversation.State.RECOMMENDING
-            ]
-        ).order_by('-updated_at').first()
-
-        if active_conversation:
-            return active_conversation
-
-        # 创建新会话
-        return Conversation.objects.create(
-            user=user,
-            current_state=Conversation.State.INIT,
-            context={}
-        )
+        """获取当前活跃会话或创建新会话（优先从会话状态缓存读取）"""
+        return conversation_store.get_active(user)
+
+    async def aget_or_create_conversation(self, user):
+        """_get_or_create_conversation 的异步版本"""
+        return await conversation_store.aget_active(user)
 
     def _update_context(self, conversation, nlp_result):
         """更新会话上下文"""
@@ -115,9 +148,30 @@ class DialogueManager:
         context['last_intent'] = nlp_result['intent']
         context['last_message_time'] = datetime.now().isoformat()
 
-        # 保存上下文
         conversation.context = context
-        conversation.save()
+
+    def _session_items(self, conversation):
+        """当前会话中按时间排列的商品：推荐过、询问过的，以及从推荐卡片点击进入的"""
+        items = list(conversation.context.get('session_items', []))
+        # 点击在记录事件时同步到缓存，这里不查询事件表
+        for product_id in get_recent_clicks(conversation.user_id, since=conversation.created_at):
+            if product_id in items:
+                items.remove(product_id)
+            items.append(product_id)
+        return items[-SESSION_ITEMS_LIMIT:]
+
+    def _remember_products(self, conversation, response):
+        """把回复中的商品追加到会话上下文"""
+        if not isinstance(response, dict) or not response.get('products'):
+            return
+        # 排名靠前的商品放在最后，视为最近的商品
+        product_ids = [product.id for product in reversed(response['products'])]
+        items = [
+            product_id for product_id in conversation.context.get('session_items', [])
+            if product_id not in product_ids
+        ]
+        items.extend(product_ids)
+        conversation.context['session_items'] = items[-SESSION_ITEMS_LIMIT:]
 
     def _determine_next_state(self, current_state, intent):
         """确定下一个对话状态"""
@@ -143,7 +197,7 @@ class DialogueManager:
 
         return current_state
 
-    def _generate_response(self, conversation, intent, entities):
+    def _generate_response(self, conversation, intent, entities, progress=None, degraded=False):
         """
         根据意图和实体生成系统回复
 
@@ -151,36 +205,41 @@ class DialogueManager:
             conversation: 当前会话对象
             intent: 用户意图
             entities: 实体信息
+            progress: 可选的进度回调
+            degraded: 过载降级模式
 
         Returns:
             dict: 回复信息，包含文本消息和结构化数据
         """
         try:
             # 合并会话中保存的实体信息
-            context_entities = conversation.context.get('entities', {})
-            merged_entities = {**context_entities, **entities}
+            merged_entities = turn_entities(conversation.context.get('entities', {}), entities)
 
             # 根据不同意图处理
             if intent == 'recommend':
-                # 商品推荐
+                # 商品推荐；降级模式下不传用户和会话商品，命中非个性化的结果缓存
                 return self.recommender.get_recommendations(
                     intent='recommend',
                     entities=merged_entities,
-                    user=conversation.user
+                    user=None if degraded else conversation.user,
+                    session_items=None if degraded else self._session_items(conversation),
+                    progress=progress
                 )
 
             elif intent == 'ask_info':
                 # 商品信息查询
                 return self.recommender.get_recommendations(
                     intent='ask_info',
-                    entities=merged_entities
+                    entities=merged_entities,
+                    progress=progress
                 )
 
             elif intent == 'compare':
                 # 商品比较
                 return self.recommender.get_recommendations(
                     intent='compare',
-                    entities=merged_entities
+                    entities=merged_entities,
+                    progress=progress
                 )
 
             elif intent == 'unknown':
@@ -221,20 +280,8 @@ class DialogueManager:
 
         # 添加商品信息
         if isinstance(response, dict) and 'products' in response and response['products']:
-            products_data = []
-            for product in response['products']:
-                product_dict = {
-                    'id': product.id,
-                    'name': product.name,
-                    'price': float(product.price),
-                    'description': product.description,
-                    'specifications': product.specifications,
-                    'image': product.image.url if product.image else None,
-                    'category': product.category.name,
-                }
-                products_data.append(product_dict)
-
-            structured_data['products'] = products_data
+            # 商品卡片从缓存批量读取，未命中的一次查询补齐
+            structured_data['products'] = card_list(product.id for product in response['products'])
 
             # 添加算法信息
             if 'algorithm' in response:
@@ -244,4 +291,8 @@ class DialogueManager:
             if 'comparison_feature' in response:
                 structured_data['comparison_feature'] = response['comparison_feature']
 
+            # 添加对齐后的规格比较表
+            if response.get('comparison'):
+                structured_data['comparison'] = response['comparison']
+
         return structured_data if structured_data else None
\ No newline at end of file
@@ -0,0 +1,139 @@
+"""
+浏览与点击行为事件
+
+页面渲染路径只调用 record_event 把事件放进内存中的环形缓冲区，由后台线程批量写入
+InteractionEvent 表；突发流量超过缓冲区容量时丢弃最旧的事件，不阻塞请求。
+压缩任务（compact_interaction_events 命令）把事件汇总成每个用户最近的交互向量，
+保存在缓存中供推荐引擎读取。
+"""
+import logging
+import math
+from array import array
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from ..models import InteractionEvent
+from .write_behind import BackgroundBatcher
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'ENABLED': True,
+    'MAX_QUEUE': 20000,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 2.0,
+}
+
+# 不同行为的权重，越接近购买权重越高
+EVENT_WEIGHTS = {
+    InteractionEvent.Type.VIEW: 1.0,
+    InteractionEvent.Type.CLICK: 2.0,
+    InteractionEvent.Type.ADD_TO_ORDER: 4.0,
+}
+HALF_LIFE_DAYS = 7  # 交互权重的半衰期
+VECTOR_SIZE = 50  # 每个用户保留的商品数
+
+CACHE_KEY_PREFIX = 'recs:recent:'
+CACHE_TIMEOUT = 7 * 24 * 3600
+
+CLICKS_KEY_PREFIX = 'recs:clicks:'
+RECENT_CLICKS = 5  # 每个用户保留的最近点击数
+
+
+class EventBuffer(BackgroundBatcher):
+    """行为事件的环形缓冲区"""
+
+    def __init__(self):
+        options = {**DEFAULT_OPTIONS, **getattr(settings, 'INTERACTION_EVENTS', {})}
+        super().__init__(
+            'interaction-events',
+            max_queue=options['MAX_QUEUE'],
+            batch_size=options['BATCH_SIZE'],
+            flush_interval=options['FLUSH_INTERVAL'],
+            drop_oldest=True,
+            enabled=options['ENABLED'],
+        )
+
+    def write_batch(self, items):
+        InteractionEvent.objects.bulk_create([InteractionEvent(**fields) for fields in items])
+
+
+event_buffer = EventBuffer()
+
+
+def record_event(request, product_id, event_type, source=''):
+    """记录一条行为事件，失败时只记日志，不影响页面"""
+    try:
+        if request.user.is_authenticated:
+            user_id, session_key = request.user.id, ''
+        else:
+            # 匿名用户只记录会话，不为其创建会话
+            user_id, session_key = None, request.session.session_key or ''
+        created_at = timezone.now()
+        event_buffer.submit({
+            'user_id': user_id,
+            'session_key': session_key,
+            'product_id': product_id,
+            'event_type': event_type,
+            'source': source[:20],
+            'created_at': created_at,
+        })
+        if user_id and event_type == InteractionEvent.Type.CLICK:
+            remember_click(user_id, product_id, created_at)
+    except Exception as e:
+        logger.error(f"记录行为事件失败: {e}")
+
+
+def remember_click(user_id, product_id, clicked_at):
+    """记下用户最近点击的商品，对话管理读取会话商品时不必查询事件表"""
+    key = f'{CLICKS_KEY_PREFIX}{user_id}'
+    clicks = [click for click in cache.get(key, []) if click[0] != product_id]
+    clicks.append((product_id, clicked_at.timestamp()))
+    cache.set(key, clicks[-RECENT_CLICKS:], CACHE_TIMEOUT)
+
+
+def get_recent_clicks(user_id, since=None):
+    """用户最近点击的商品ID，按点击时间排列（最后一个是最近的），since 之前的点击不返回"""
+    threshold = since.timestamp() if since else 0
+    clicks = cache.get(f'{CLICKS_KEY_PREFIX}{user_id}', [])
+    return [product_id for product_id, clicked_at in clicks if clicked_at >= threshold]
+
+
+def build_recent_vector(events, now=None):
+    """
+    按行为权重和时间衰减汇总一个用户的事件
+
+    Args:
+        events: 可迭代的 (product_id, event_type, created_at)
+
+    Returns:
+        list: 按权重降序的 [(product_id, weight), ...]
+    """
+    now = now or timezone.now()
+    weights = defaultdict(float)
+    for product_id, event_type, created_at in events:
+        age_days = max((now - created_at).total_seconds(), 0) / 86400
+        weights[product_id] += EVENT_WEIGHTS.get(event_type, 1.0) * math.pow(0.5, age_days / HALF_LIFE_DAYS)
+    return sorted(weights.items(), key=lambda item: item[1], reverse=True)[:VECTOR_SIZE]
+
+
+def store_recent_vector(user_id, vector):
+    cache.set(f'{CACHE_KEY_PREFIX}{user_id}', {
+        'ids': array('q', [product_id for product_id, _ in vector]).tobytes(),
+        'weights': array('d', [weight for _, weight in vector]).tobytes(),
+    }, CACHE_TIMEOUT)
+
+
+def get_recent_interactions(user_id):
+    """读取用户最近的交互向量，返回按权重降序的 [(product_id, weight), ...]"""
+    entry = cache.get(f'{CACHE_KEY_PREFIX}{user_id}')
+    if entry is None:
+        return []
+    ids = array('q')
+    ids.frombytes(entry['ids'])
+    weights = array('d')
+    weights.frombytes(entry['weights'])
+    return list(zip(ids.tolist(), weights.tolist()))
@@ -0,0 +1,169 @@
+"""
+会话历史的分页读取
+
+按 (updated_at, id) 倒序做键集分页，游标记录上一页最后一个会话的位置，
+翻页成本与页码无关。消息只为当前页的会话读取，每页一次查询。
+
+消息的结构化数据中商品只保存 ID、当时的价格和目录版本号（见 reference_structured_data），
+读取时通过商品卡片缓存批量补全，每页一次批量读取。目录版本号变化过的消息逐个比对价格，
+价格已变化的卡片带上消息当时的价格（price_at_message）。
+"""
+import base64
+from datetime import datetime
+from itertools import islice
+
+from django.db.models import Prefetch, Q
+
+from products.cards import get_cards
+from products.versions import catalog_version
+
+from ..models import Conversation, Message
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+
+
+class InvalidCursor(ValueError):
+    """无法解析的分页游标"""
+
+
+def encode_cursor(updated_at, conversation_id):
+    raw = f'{updated_at.isoformat()}|{conversation_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        updated_at, conversation_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(updated_at), int(conversation_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(f'无效的游标: {cursor}') from e
+
+
+def page_size(value):
+    """解析每页会话数，超出范围时取边界值"""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def history_queryset(user, cursor=None):
+    """
+    用户的会话，按最近更新倒序，从游标之后开始
+
+    消息通过 prefetch 按会话批量读取；配合 iterator(chunk_size) 使用时每个分块读取一次。
+    """
+    queryset = Conversation.objects.filter(user=user)
+    if cursor:
+        updated_at, conversation_id = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(updated_at__lt=updated_at) | Q(updated_at=updated_at, id__lt=conversation_id)
+        )
+    return queryset.order_by('-updated_at', '-id').only(
+        'id', 'user_id', 'created_at', 'updated_at'
+    ).prefetch_related(Prefetch(
+        'messages',
+        queryset=Message.objects.order_by('id').only(
+            'id', 'conversation_id', 'message_type', 'content', 'structured_data', 'created_at'
+        ),
+    ))
+
+
+def reference_structured_data(structured_data):
+    """
+    写入消息表的结构化数据
+
+    商品列表替换为商品 ID、当时的价格和目录版本号，不再复制描述、规格等商品信息。
+    """
+    if not structured_data or not structured_data.get('products'):
+        return structured_data
+    data = {key: value for key, value in structured_data.items() if key != 'products'}
+    data['product_ids'] = [product['id'] for product in structured_data['products']]
+    data['prices'] = [product['price'] for product in structured_data['products']]
+    data['catalog_version'] = catalog_version()
+    return data
+
+
+def hydrate_structured_data(structured_data, cards, current_version=None):
+    """
+    把商品 ID 补全为卡片，已删除的商品跳过；旧格式（完整商品数据）原样返回
+
+    Args:
+        cards: 商品 ID -> 卡片
+        current_version: 当前的目录版本号，与消息记录的相同时说明商品没有变化，不再比对价格；
+                         为空时总是比对
+    """
+    if not structured_data or 'product_ids' not in structured_data:
+        return structured_data
+    data = {
+        key: value for key, value in structured_data.items()
+        if key not in ('product_ids', 'prices', 'catalog_version')
+    }
+    products = [cards[product_id] for product_id in structured_data['product_ids'] if product_id in cards]
+    prices = structured_data.get('prices')
+    if prices and (current_version is None or structured_data.get('catalog_version') != current_version):
+        prices = dict(zip(structured_data['product_ids'], prices))
+        products = [
+            {**card, 'price_at_message': prices[card['id']]} if prices[card['id']] != card['price'] else card
+            for card in products
+        ]
+    data['products'] = products
+    return data
+
+
+def serialize_conversations(conversations):
+    """序列化一批会话，消息中引用的商品卡片一次批量读取"""
+    cards = get_cards(
+        product_id
+        for conversation in conversations
+        for message in conversation.messages.all()
+        for product_id in (message.structured_data or {}).get('product_ids', [])
+    )
+    current_version = catalog_version()
+    return [
+        {
+            'id': conversation.id,
+            'created_at': conversation.created_at.isoformat(),
+            'updated_at': conversation.updated_at.isoformat(),
+            'messages': [
+                {
+                    'message_type': message.message_type,
+                    'content': message.content,
+                    'structured_data': hydrate_structured_data(message.structured_data, cards, current_version),
+                    'created_at': message.created_at.isoformat(),
+                }
+                for message in conversation.messages.all()
+            ],
+        }
+        for conversation in conversations
+    ]
+
+
+def get_page(user, cursor=None, size=DEFAULT_PAGE_SIZE):
+    """
+    读取一页会话
+
+    Returns:
+        dict: {'conversations': [...], 'next_cursor': 下一页游标，没有更多时为 None}
+    """
+    # 多取一条判断是否还有下一页
+    conversations = list(history_queryset(user, cursor)[:size + 1])
+    has_more = len(conversations) > size
+    conversations = conversations[:size]
+    return {
+        'conversations': serialize_conversations(conversations),
+        'next_cursor': encode_cursor(conversations[-1].updated_at, conversations[-1].id) if has_more else None,
+    }
+
+
+def iter_conversations(user, cursor=None, chunk_size=DEFAULT_PAGE_SIZE):
+    """逐个产出序列化后的会话，数据库游标分块读取，内存占用与历史长度无关"""
+    conversations = history_queryset(user, cursor).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(conversations, chunk_size))
+        if not chunk:
+            break
+        yield from serialize_conversations(chunk)
@@ -0,0 +1,190 @@
+"""
+意图识别模型的共享实例与推理线程池
+
+BERT 模型在每个进程中只加载一次。异步视图把推理提交到专用的有界线程池，
+等待中的请求数超过上限时直接拒绝，避免推理排队拖住事件循环上的其他请求。
+"""
+import asyncio
+import copy
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'WORKERS': 2,  # 推理线程数
+    'MAX_PENDING': 32,  # 正在执行和排队的推理请求上限
+    'ACQUIRE_TIMEOUT': 2.0,  # 达到上限时最多等待的秒数
+    'BATCH_SIZE': 32,  # 批量识别时每次前向计算的最大文本数
+}
+
+
+class InferenceOverloaded(Exception):
+    """推理请求过多"""
+
+
+_processor = None
+_processor_lock = threading.Lock()
+
+# 相同文本的并发识别请求只推理一次
+_recognition_flight = SingleFlight('nlp')
+
+
+def get_nlp_processor():
+    """返回进程内共享的 NLPProcessor，首次调用时加载模型"""
+    global _processor
+    if _processor is None:
+        with _processor_lock:
+            if _processor is None:
+                from .nlp_processor import NLPProcessor
+                _processor = NLPProcessor()
+    return _processor
+
+
+class InferenceExecutor:
+    """有界的推理线程池"""
+
+    def __init__(self, options=None):
+        options = {**DEFAULT_OPTIONS, **(options or getattr(settings, 'CHAT_INFERENCE', {}))}
+        self.workers = options['WORKERS']
+        self.max_pending = options['MAX_PENDING']
+        self.acquire_timeout = options['ACQUIRE_TIMEOUT']
+        self._executor = None
+        self._lock = threading.Lock()
+        # 名额计数不依赖事件循环；等待名额的协程登记在 _waiters 中，归还名额时唤醒
+        self._pending = 0
+        self._waiters = []  # [(事件循环, Future)]
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='nlp-inference')
+        return self._executor
+
+    async def run(self, func, *args):
+        """在推理线程池中执行 func(*args)"""
+        if not await self._acquire():
+            raise InferenceOverloaded(f'推理请求超过上限 {self.max_pending}')
+        try:
+            future = self._get_executor().submit(func, *args)
+        except BaseException:
+            self._release()
+            raise
+        # 名额在推理真正结束（或未开始就被取消）时归还，等待结果的协程被取消不影响计数
+        future.add_done_callback(lambda _: self._release())
+        return await asyncio.wrap_future(future)
+
+    async def _acquire(self):
+        """取得一个名额，最多等待 ACQUIRE_TIMEOUT 秒；等待期间被取消时不占用名额"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.acquire_timeout
+        while True:
+            with self._lock:
+                if self._pending < self.max_pending:
+                    self._pending += 1
+                    return True
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+            try:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False
+                try:
+                    await asyncio.wait_for(waiter, remaining)
+                except asyncio.TimeoutError:
+                    pass
+            finally:
+                with self._lock:
+                    if (loop, waiter) in self._waiters:
+                        self._waiters.remove((loop, waiter))
+
+    def _release(self):
+        # 可能在推理线程中调用：通过各自的事件循环唤醒等待者，由它们重新争取名额
+        with self._lock:
+            self._pending -= 1
+            waiters, self._waiters = self._waiters, []
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+    async def process_input(self, text, use_model=True):
+        """
+        异步执行意图识别和实体抽取（首次调用时的模型加载也在推理线程中进行）
+
+        use_model 为 False 时只用规则识别，不占用推理线程池的名额
+        """
+        if not use_model:
+            return await asyncio.get_running_loop().run_in_executor(None, _process_input, text, False)
+        return await self.run(_process_input, text)
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def normalize_text(text):
+    """合并空白，作为合并识别请求的键（实体抽取区分大小写，不统一大小写）"""
+    return ' '.join(text.split())
+
+
+def recognize(text, use_model=True):
+    """意图识别和实体抽取；同一进程内相同文本的并发请求共享一次推理的结果"""
+    result, shared = _recognition_flight.do(
+        (use_model, normalize_text(text)),
+        lambda: get_nlp_processor().process_input(text, use_model=use_model),
+    )
+    if shared:
+        result = copy.deepcopy(result)
+        result['original_text'] = text
+    return result
+
+
+def recognize_batch(texts, use_model=True):
+    """
+    批量意图识别和实体抽取
+
+    相同的文本只识别一次，其余文本按 BATCH_SIZE 分批，每批做一次模型前向计算。
+
+    Returns:
+        list: 与 texts 顺序一致的识别结果
+    """
+    options = {**DEFAULT_OPTIONS, **getattr(settings, 'CHAT_INFERENCE', {})}
+    unique = {}
+    for text in texts:
+        unique.setdefault(normalize_text(text), text)
+
+    keys = list(unique)
+    recognized = {}
+    processor = get_nlp_processor()
+    for start in range(0, len(keys), options['BATCH_SIZE']):
+        chunk = keys[start:start + options['BATCH_SIZE']]
+        results = processor.process_batch([unique[key] for key in chunk], use_model=use_model)
+        recognized.update(zip(chunk, results))
+
+    results = []
+    for text in texts:
+        result = copy.deepcopy(recognized[normalize_text(text)])
+        result['original_text'] = text
+        results.append(result)
+    return results
+
+
+def recognition_metrics():
+    return _recognition_flight.metrics()
+
+
+def _process_input(text, use_model=True):
+    return recognize(text, use_model)
+
+
+inference = InferenceExecutor()
@@ -0,0 +1,145 @@
+"""
+聊天接口的过载控制
+
+按进程统计正在处理的对话轮数和最近的响应耗时，在三种模式之间切换：
+    normal    正常处理
+    degraded  规则意图识别代替 BERT，推荐只用非个性化的缓存结果，消息记录缓冲区满时直接丢弃不等待
+    shed      直接拒绝新请求并给出重试时间
+升级立即生效；降级需要在当前模式停留 HOLD_SECONDS 秒，且指标低于阈值的 RECOVER_RATIO 倍，避免来回抖动。
+"""
+import logging
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+NORMAL = 'normal'
+DEGRADED = 'degraded'
+SHED = 'shed'
+
+MODES = (NORMAL, DEGRADED, SHED)
+
+DEFAULT_OPTIONS = {
+    'ENABLED': True,
+    'DEGRADE_INFLIGHT': 8,  # 同时处理的对话轮数达到该值进入降级模式
+    'SHED_INFLIGHT': 24,  # 达到该值开始拒绝请求
+    'DEGRADE_LATENCY': 2.0,  # 最近耗时的 P90（秒）达到该值进入降级模式
+    'SHED_LATENCY': 6.0,  # 达到该值开始拒绝请求
+    'LATENCY_WINDOW': 30,  # 只统计最近多少秒内完成的请求
+    'LATENCY_SAMPLES': 200,  # 最多保留的耗时样本数
+    'HOLD_SECONDS': 10,  # 降级前至少在当前模式停留的秒数
+    'RECOVER_RATIO': 0.5,
+    'RETRY_AFTER': 5,  # 拒绝请求时建议客户端等待的秒数
+}
+
+
+class ChatOverloaded(Exception):
+    """系统过载，请求被拒绝"""
+
+    def __init__(self, retry_after):
+        super().__init__(f'聊天服务过载，{retry_after} 秒后重试')
+        self.retry_after = retry_after
+
+
+class OverloadController:
+    """按正在处理的请求数和最近耗时决定当前的服务模式"""
+
+    def __init__(self, options=None):
+        self.options = {**DEFAULT_OPTIONS, **(options or getattr(settings, 'CHAT_LOAD_SHEDDING', {}))}
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._latencies = deque(maxlen=self.options['LATENCY_SAMPLES'])  # (完成时间, 耗时)
+        self._level = 0
+        self._since = time.monotonic()
+        self._transitions = Counter()
+        self._counts = Counter()
+
+    @property
+    def mode(self):
+        return MODES[self._level]
+
+    @contextmanager
+    def admit(self):
+        """
+        接收一轮对话，返回本轮使用的模式
+
+        Raises:
+            ChatOverloaded: 当前处于 shed 模式
+        """
+        if not self.options['ENABLED']:
+            yield NORMAL
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            self._update(now, self._inflight + 1)
+            mode = self.mode
+            self._counts[mode] += 1
+            if mode == SHED:
+                raise ChatOverloaded(self.options['RETRY_AFTER'])
+            self._inflight += 1
+
+        started = time.monotonic()
+        try:
+            yield mode
+        finally:
+            finished = time.monotonic()
+            with self._lock:
+                self._inflight -= 1
+                self._latencies.append((finished, finished - started))
+                self._update(finished, self._inflight)
+
+    def metrics(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                'mode': self.mode,
+                'mode_seconds': round(now - self._since, 1),
+                'inflight': self._inflight,
+                'latency_p90': round(self._latency_p90(now), 3),
+                'turns': dict(self._counts),
+                'transitions': dict(self._transitions),
+            }
+
+    def _latency_p90(self, now):
+        cutoff = now - self.options['LATENCY_WINDOW']
+        while self._latencies and self._latencies[0][0] < cutoff:
+            self._latencies.popleft()
+        if not self._latencies:
+            return 0.0
+        samples = sorted(latency for _, latency in self._latencies)
+        return samples[int(len(samples) * 0.9)]
+
+    def _level_for(self, inflight, latency, ratio=1.0):
+        options = self.options
+        if inflight >= options['SHED_INFLIGHT'] * ratio or latency >= options['SHED_LATENCY'] * ratio:
+            return 2
+        if inflight >= options['DEGRADE_INFLIGHT'] * ratio or latency >= options['DEGRADE_LATENCY'] * ratio:
+            return 1
+        return 0
+
+    def _update(self, now, inflight):
+        latency = self._latency_p90(now)
+        level = self._level_for(inflight, latency)
+        if level < self._level:
+            if now - self._since < self.options['HOLD_SECONDS']:
+                return
+            # 降级要求指标明显低于阈值
+            level = max(level, self._level_for(inflight, latency, self.options['RECOVER_RATIO']))
+            if level >= self._level:
+                return
+        if level == self._level:
+            return
+
+        old_mode, new_mode = self.mode, MODES[level]
+        self._level = level
+        self._since = now
+        self._transitions[f'{old_mode}->{new_mode}'] += 1
+        logger.warning(f"聊天服务切换到 {new_mode} 模式（进行中 {inflight}，P90 耗时 {latency:.2f}s）")
+
+
+overload = OverloadController()
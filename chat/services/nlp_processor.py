@@ -1,5 +1,4 @@
 import os
-import json
 import torch
 import logging
 from transformers import BertTokenizer, BertForSequenceClassification
@@ -45,7 +44,7 @@ class NLPProcessor:
                 ).to(self.device)
 
         except Exception as e:
-            logger.error(f"加载模型失败: {e}")
+            logger.error("加载模型失败: %s", e)
             # 使用规则引擎作为备份
             self.model = None
             self.tokenizer = None
@@ -127,51 +126,71 @@ class NLPProcessor:
         else:
             return 'unknown'
 
-    def process_input(self, text):
-        """处理用户输入，返回意图和实体信息"""
-        intent = 'unknown'
-        confidence = 0.0
+    def process_input(self, text, use_model=True):
+        """
+        处理用户输入，返回意图和实体信息
+
+        use_model 为 False 时跳过 BERT，只用规则识别意图（过载降级时使用）
+        """
+        return self.process_batch([text], use_model=use_model)[0]
+
+    def process_batch(self, texts, use_model=True):
+        """
+        批量处理多条用户输入，BERT 对整批文本只做一次前向计算
+
+        Returns:
+            list: 与 texts 顺序一致的处理结果，格式同 process_input
+        """
+        texts = list(texts)
+        predictions = None
 
         # 使用BERT模型进行意图识别
-        if self.model and self.tokenizer:
+        if use_model and self.model and self.tokenizer and texts:
             try:
-                inputs = self.tokenizer(text, return_tensors="pt", truncation=True, padding=True, max_length=128).to(
-                    self.device)
-                with torch.no_grad():
-                    outputs = self.model(**inputs)
-
-                logits = outputs.logits
-                predicted_class = torch.argmax(logits, dim=1).item()
-                confidence = torch.softmax(logits, dim=1)[0][predicted_class].item()
-                intent = INTENTS[predicted_class]
-
-                logger.info(f"BERT模型意图预测: {intent}, 置信度: {confidence:.4f}")
-
-                # 如果置信度过低，使用规则引擎辅助判断
-                if confidence < 0.7:
-                    rule_intent = self._rule_based_intent(text)
-                    # 如果BERT模型预测为unknown，采用规则引擎的结果
-                    if intent == 'unknown':
-                        intent = rule_intent
-                        logger.info(f"BERT置信度低，切换到规则引擎结果: {intent}")
+                predictions = self._predict_intents(texts)
             except Exception as e:
-                logger.error(f"模型预测失败: {e}")
+                logger.error("模型预测失败: %s", e)
+                predictions = [(self._rule_based_intent(text), 0.0) for text in texts]
+
+        results = []
+        for index, text in enumerate(texts):
+            if predictions is None:
+                # 如果模型加载失败，使用规则引擎
+                intent, confidence = self._rule_based_intent(text), 0.0
+                logger.info("使用规则引擎预测意图: %s", intent)
+            else:
+                intent, confidence = predictions[index]
+
+            # 返回处理结果
+            result = {
+                'intent': intent,
+                'confidence': float(confidence),
+                'entities': self._extract_entities(text),
+                'original_text': text
+            }
+            # 参数在日志被采样保留后才格式化
+            logger.info("NLP处理结果: 意图 %s, 置信度 %.4f", intent, confidence, extra={'entities': result['entities']})
+            results.append(result)
+        return results
+
+    def _predict_intents(self, texts):
+        """BERT 模型预测一批文本的意图，返回 [(意图, 置信度)]"""
+        inputs = self.tokenizer(texts, return_tensors="pt", truncation=True, padding=True, max_length=128).to(
+            self.device)
+        with torch.no_grad():
+            outputs = self.model(**inputs)
+
+        probabilities = torch.softmax(outputs.logits, dim=1)
+        confidences, classes = probabilities.max(dim=1)
+
+        predictions = []
+        for text, predicted_class, confidence in zip(texts, classes.tolist(), confidences.tolist()):
+            intent = INTENTS[predicted_class]
+            logger.info("BERT模型意图预测: %s, 置信度: %.4f", intent, confidence)
+
+            # 如果置信度过低，且BERT模型预测为unknown，采用规则引擎的结果
+            if confidence < 0.7 and intent == 'unknown':
                 intent = self._rule_based_intent(text)
-        else:
-            # 如果模型加载失败，使用规则引擎
-            intent = self._rule_based_intent(text)
-            logger.info(f"使用规则引擎预测意图: {intent}")
-
-        # 提取实体信息
-        entities = self._extract_entities(text)
-
-        # 返回处理结果
-        result = {
-            'intent': intent,
-            'confidence': float(confidence),
-            'entities': entities,
-            'original_text': text
-        }
-
-        logger.info(f"NLP处理结果: {json.dumps(result, ensure_ascii=False)}")
-        return result
\ No newline at end of file
+                logger.info("BERT置信度低，切换到规则引擎结果: %s", intent)
+            predictions.append((intent, confidence))
+        return predictions
@@ -0,0 +1,119 @@
+"""
+预计算的用户推荐候选
+
+离线任务（precompute_recommendations 命令）为活跃用户计算协同过滤和基于内容的候选商品，
+按得分保存总榜和分品类的切片。请求时推荐引擎只需把这些列表与当前实体条件和库存求交集，
+没有预计算结果的冷用户再走实时计算。
+"""
+import logging
+import time
+from array import array
+from collections import defaultdict
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY_PREFIX = 'recs:user:'
+CACHE_TIMEOUT = 36 * 3600  # 比每晚的重建周期长一些，任务失败一次也不会全部过期
+
+DEFAULT_LIMIT = 100  # 总榜长度
+DEFAULT_PER_CATEGORY = 20  # 每个分类切片长度
+
+
+def _pack(ids):
+    return array('q', ids).tobytes()
+
+
+def _unpack(data):
+    ids = array('q')
+    ids.frombytes(data)
+    return ids.tolist()
+
+
+def _cache_key(user_id):
+    return f'{CACHE_KEY_PREFIX}{user_id}'
+
+
+def build_user_candidates(recommender, user, limit=DEFAULT_LIMIT, per_category=DEFAULT_PER_CATEGORY):
+    """
+    计算单个用户的候选列表
+
+    Returns:
+        dict: {'ids': [...], 'categories': {category_id: [...]}}，没有候选时返回 None
+    """
+    pool_size = limit * 2
+    cf_candidates = recommender._get_collaborative_filtering_candidates(user, {}, pool_size)
+    content_candidates = recommender._get_content_based_candidates(user, {}, pool_size)
+
+    scores = defaultdict(float)
+    categories = {}
+    for weight, candidates in ((recommender.user_weight, cf_candidates),
+                               (recommender.content_weight, content_candidates)):
+        for i, product in enumerate(candidates):
+            scores[product.id] += weight * (len(candidates) - i) / len(candidates)
+            categories[product.id] = product.category_id
+
+    if not scores:
+        return None
+
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    slices = defaultdict(list)
+    for product_id in ranked:
+        category_slice = slices[categories[product_id]]
+        if len(category_slice) < per_category:
+            category_slice.append(product_id)
+
+    return {'ids': ranked[:limit], 'categories': dict(slices)}
+
+
+def store_user_candidates(user_id, candidates):
+    cache.set(_cache_key(user_id), {
+        'built_at': time.time(),
+        'ids': _pack(candidates['ids']),
+        'categories': {category_id: _pack(ids) for category_id, ids in candidates['categories'].items()},
+    }, CACHE_TIMEOUT)
+
+
+def get_user_candidates(user_id):
+    """读取预计算结果，没有时返回 None"""
+    entry = cache.get(_cache_key(user_id))
+    if entry is None:
+        return None
+    return {
+        'built_at': entry['built_at'],
+        'ids': _unpack(entry['ids']),
+        'categories': {category_id: _unpack(ids) for category_id, ids in entry['categories'].items()},
+    }
+
+
+def precompute_shard(user_ids, limit=DEFAULT_LIMIT, per_category=DEFAULT_PER_CATEGORY):
+    """
+    处理一个分片的用户，在进程池的子进程中运行
+
+    Returns:
+        tuple: (成功数, 无候选数, 失败数)
+    """
+    from django.contrib.auth import get_user_model
+    from django.db import close_old_connections
+
+    from .recommender import Recommender
+
+    recommender = Recommender()
+    stored = empty = failed = 0
+    users = list(get_user_model().objects.filter(id__in=user_ids))
+    try:
+        for user in users:
+            try:
+                candidates = build_user_candidates(recommender, user, limit, per_category)
+                if candidates is None:
+                    empty += 1
+                    continue
+                store_user_candidates(user.id, candidates)
+                stored += 1
+            except Exception as e:
+                failed += 1
+                logger.error(f"预计算用户 {user.id} 的推荐失败: {e}")
+    finally:
+        close_old_connections()
+    return stored, empty, failed
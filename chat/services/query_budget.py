@@ -0,0 +1,75 @@
+"""
+查询预算
+
+统计一段代码（例如一轮对话）在当前数据库连接上执行的查询数，并按阶段分别计数。
+超出预算时在测试环境中抛出 QueryBudgetExceeded，线上只记录警告日志。
+"""
+import logging
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'ENFORCE': False,  # 为 True 时超出预算抛出异常（测试环境使用）
+}
+
+
+class QueryBudgetExceeded(Exception):
+    """查询次数超出预算"""
+
+
+class QueryBudget:
+    """
+    查询预算上下文
+
+    用法:
+        with QueryBudget(20, 'chat turn') as budget:
+            budget.stage('load')
+            ...
+            budget.stage('respond')
+            ...
+
+    只统计进入上下文的线程所用连接上的查询，其他线程中的查询不计入。
+    """
+
+    def __init__(self, limit, label, enforce=None):
+        if enforce is None:
+            options = {**DEFAULT_OPTIONS, **getattr(settings, 'QUERY_BUDGET', {})}
+            enforce = options['ENFORCE']
+        self.limit = limit
+        self.label = label
+        self.enforce = enforce
+        self.count = 0
+        self.by_stage = Counter()
+        self.current = 'start'
+        self._wrapper = None
+
+    def stage(self, name):
+        """之后执行的查询计入该阶段"""
+        self.current = name
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        self.by_stage[self.current] += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._wrapper.__exit__(exc_type, exc_value, traceback)
+        self._wrapper = None
+        if exc_type is not None or self.count <= self.limit:
+            return False
+
+        stages = ', '.join(f'{stage}={count}' for stage, count in self.by_stage.items())
+        message = f"{self.label} 执行了 {self.count} 次查询，超出预算 {self.limit}（{stages}）"
+        if self.enforce:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+        return False
@@ -1,16 +1,41 @@
 import logging
 import random
+import threading
+from contextlib import contextmanager
 import numpy as np
 from datetime import timedelta
-from django.db.models import Q, Avg, Count, Sum, F, FloatField
-from django.db.models.functions import Cast
+from collections import defaultdict
+from django.db.models import Q, Avg, Count, Sum, F, FloatField, Window
+from django.db.models.functions import Cast, RowNumber
 from django.utils import timezone
-from products.models import Product, Category
+from products import attributes, retrieval, search
+from products.models import Product, Category, SearchPosting
+from products.retrieval import price_band
 from orders.models import Order, OrderItem
-from chat.models import Conversation, Recommendation
+from ..models import ProductCoPurchase, UserProductInteraction
+from .comparison import compare_products
+from .events import get_recent_interactions
+from .precomputed import get_user_candidates
+from .result_cache import candidate_cache, result_cache
+from .single_flight import SingleFlight
+from .transitions import get_transition_table
 
 logger = logging.getLogger(__name__)
 
+Field = SearchPosting.Field
+
+# 非个性化推荐的并发合并，跨进程时通过结果缓存共享
+recommendation_flight = SingleFlight('recommendations')
+
+# 计入购买行为的订单状态
+PURCHASED_STATUSES = ['paid', 'shipped', 'completed']
+
+# 结果可以缓存的意图
+CACHEABLE_INTENTS = ('recommend', 'ask_info', 'compare')
+
+# 输入联想可以预热的候选查询，与用户无关，预热结果保存在 candidate_cache 中
+PREWARMED_CANDIDATES = ('rule_based', 'popular')
+
 
 class Recommender:
     """
@@ -18,13 +43,17 @@ class Recommender:
     结合内容过滤、协同过滤和规则过滤的混合推荐系统
     """
 
+    result_cache = result_cache
+
     def __init__(self):
         self.similarity_threshold = 0.3
         self.user_weight = 0.4  # 用户协同过滤权重
         self.content_weight = 0.3  # 内容过滤权重
         self.rule_weight = 0.3  # 规则过滤权重
+        self.as_of = None  # 离线评估时只使用该时间点之前的商品和订单，避免未来数据泄露
+        self._filter_scope = threading.local()
 
-    def get_recommendations(self, intent, entities, user=None, limit=5):
+    def get_recommendations(self, intent, entities, user=None, limit=5, session_items=None, progress=None):
         """
         根据意图和实体生成推荐
 
@@ -33,22 +62,160 @@ class Recommender:
             entities: 实体信息字典
             user: 当前用户对象
             limit: 最大推荐商品数量
+            session_items: 当前会话中按时间排列的商品ID（推荐过、点击过、询问过的）
+            progress: 可选的回调 progress(stage, message=None, products=None)。各意图都先推送回复文本（'message'），
+                      推荐再推送规则过滤的初步结果，之后每个候选生成步骤完成时推送一次阶段，
+                      带上用已有候选融合排序的临时前 limit 个商品，最终结果仍通过返回值给出
 
         Returns:
             dict: 包含推荐商品和相关信息的字典
         """
+        # 非个性化的结果只取决于意图和实体，可以直接使用缓存
+        segment = self._user_segment(intent, user)
+        if segment is None:
+            return self._dispatch(intent, entities, user, limit, session_items, progress)
+
+        computed = False
+        result = self._cached(intent, entities, segment)
+        if result is None:
+            # 缓存未命中时，相同意图和实体的并发请求只计算一次
+            result, shared = recommendation_flight.do(
+                self.result_cache.make_key(intent, entities, segment),
+                lambda: self._compute_and_cache(intent, entities, segment, user, limit, progress),
+                lookup=lambda: self._cached(intent, entities, segment),
+            )
+            if shared:
+                result = {**result, 'products': list(result.get('products', []))}
+            computed = not shared
+        if not computed:
+            # 命中缓存或由其他请求算出，回复文本已经确定，同样先推送
+            self._notify(progress, 'message', message=result.get('message'))
+
+        # 会话部分不进缓存：在缓存的基础结果上按转移表重排
+        if intent == 'recommend' and session_items:
+            result = self._rerank_with_session(result, session_items, entities, limit)
+        return result
+
+    def _rerank_with_session(self, result, session_items, entities, limit):
+        """把转移表根据会话商品序列预测的下一个商品排在基础结果前面"""
+        if not result.get('products'):
+            return result
+        session_candidates = self._get_session_candidates(session_items, entities, limit)
+        if not session_candidates:
+            return result
+        return {**result, 'products': self._merge_candidates(session_candidates, result['products'])[:limit]}
+
+    @contextmanager
+    def shared_filters(self):
+        """
+        范围内同一线程中实体条件相同的分类匹配、规则过滤和热门商品查询只执行一次；
+        每次推荐都在自己的范围内执行，批量处理多轮对话时在外层打开，整批共用
+        """
+        if getattr(self._filter_scope, 'results', None) is not None:
+            yield
+            return
+        self._filter_scope.results = {}
+        try:
+            yield
+        finally:
+            self._filter_scope.results = None
+
+    def _shared(self, kind, entities, limit, compute):
+        """在 shared_filters 范围内按实体条件复用 compute() 的结果"""
+        results = getattr(self._filter_scope, 'results', None)
+        if results is None:
+            return compute()
+        key = (kind, tuple(sorted(self.result_cache.normalize_entities(entities).items())), limit)
+        if key not in results:
+            prewarmed = self._prewarmed(kind, entities, limit)
+            results[key] = compute() if prewarmed is None else prewarmed
+        return list(results[key])
+
+    def _prewarmed(self, kind, entities, limit):
+        """读取输入联想预热的候选，没有预热或预热的数量不够时返回 None"""
+        if kind not in PREWARMED_CANDIDATES or self.as_of is not None:
+            return None
+        try:
+            entry = candidate_cache.get(kind, entities, 'prewarmed')
+        except Exception as e:
+            logger.error(f"读取预热候选出错: {e}")
+            return None
+        if entry is None or entry['limit'] < limit:
+            return None
+        return entry['products'][:limit]
+
+    def prewarm_candidates(self, entities, limit=5):
+        """
+        预先计算个性化推荐中与用户无关的部分：规则过滤和热门商品候选，写入 candidate_cache
+
+        两者都按最新或热度排序后截断，预热时取推荐中可能用到的最大数量，读取时截取前缀。
+
+        Returns:
+            list: 候选商品ID，供调用方预热商品卡片
+        """
+        product_ids = []
+        with self.shared_filters():
+            for kind, count, compute in (
+                ('rule_based', limit * 2, lambda: self._get_rule_based_candidates(entities, limit * 2)),
+                ('popular', limit, lambda: self._get_popular_products(entities, limit)),
+            ):
+                products = compute()
+                candidate_cache.set(kind, entities, 'prewarmed', {'products': products, 'limit': count})
+                product_ids.extend(product.id for product in products)
+        return product_ids
+
+    def _cached(self, intent, entities, segment):
+        try:
+            return self.result_cache.get(intent, entities, segment)
+        except Exception as e:
+            logger.error(f"读取推荐缓存出错: {e}")
+            return None
+
+    def _compute_and_cache(self, intent, entities, segment, user, limit, progress):
+        result = self._dispatch(intent, entities, user, limit, None, progress)
+        if result.get('algorithm') != 'error':
+            try:
+                self.result_cache.set(intent, entities, segment, result)
+            except Exception as e:
+                logger.error(f"写入推荐缓存出错: {e}")
+        return result
+
+    def _user_segment(self, intent, user):
+        """
+        确定缓存使用的用户分群
+
+        商品信息查询和比较与用户无关，未登录用户的推荐也不做个性化，
+        这些情况归为匿名分群；已登录用户的推荐是个性化的，不缓存（返回 None）。
+        会话商品只用于在缓存结果上重排，不影响分群。
+        其他意图（问候、无法理解等）不查询商品，也不缓存。
+        """
+        if self.as_of is not None or intent not in CACHEABLE_INTENTS:
+            return None
+        if intent == 'recommend' and user and user.is_authenticated:
+            return None
+        return 'anon'
+
+    def _as_of_query(self, field='created_at'):
+        """离线评估的时间截断条件，在线推荐时为空条件"""
+        if self.as_of is None:
+            return Q()
+        return Q(**{f'{field}__lt': self.as_of})
+
+    def _dispatch(self, intent, entities, user, limit, session_items=None, progress=None):
+        """按意图分发到具体的处理逻辑"""
         try:
             if intent == 'recommend':
-                return self._handle_recommendation(entities, user, limit)
+                with self.shared_filters():
+                    return self._handle_recommendation(entities, user, limit, session_items, progress)
             elif intent == 'ask_info':
-                return self._handle_product_info(entities)
+                return self._handle_product_info(entities, progress)
             elif intent == 'compare':
-                return self._handle_product_comparison(entities)
+                return self._handle_product_comparison(entities, progress)
             else:
                 return {"products": [], "message": "无法理解您的需求，请尝试询问商品推荐或信息。"}
         except Exception as e:
             logger.error(f"推荐过程出错: {e}")
-            return {"products": [], "message": "推荐系统暂时无法提供服务，请稍后再试。"}
+            return {"products": [], "message": "推荐系统暂时无法提供服务，请稍后再试。", "algorithm": "error"}
 
     def _build_query(self, entities):
         """构建商品查询条件"""
@@ -68,49 +235,53 @@ class Recommender:
 
         # 按品牌筛选
         if entities.get('brand'):
-            brand = entities['brand']
-            # 假设商品名称或描述中包含品牌名称
-            brand_query = Q(name__icontains=brand) | Q(specifications__brand__icontains=brand)
-            query &= brand_query
-
-        # 按价格筛选
-        if entities.get('price'):
-            price = entities['price']
-            # 价格上下浮动20%
-            min_price = price * 0.8
-            max_price = price * 1.2
-            query &= Q(price__gte=min_price) & Q(price__lte=max_price)
-        elif entities.get('price_range'):
-            price_range = entities['price_range']
-            if price_range == '1000以下':
-                query &= Q(price__lt=1000)
-            elif price_range == '1000-2000':
-                query &= Q(price__gte=1000) & Q(price__lte=2000)
-            elif price_range == '2000-3000':
-                query &= Q(price__gte=2000) & Q(price__lte=3000)
-            elif price_range == '3000-5000':
-                query &= Q(price__gte=3000) & Q(price__lte=5000)
-            elif price_range == '5000-8000':
-                query &= Q(price__gte=5000) & Q(price__lte=8000)
-            elif price_range == '8000以上':
-                query &= Q(price__gte=8000)
+            # 假设商品名称或规格中包含品牌名称
+            query &= self._brand_query(entities['brand'])
+
+        # 按价格筛选（价格上下浮动20%，或价格区间）
+        band = price_band(entities)
+        if band is not None:
+            query &= band.as_query()
 
         # 按特性筛选
         if entities.get('feature'):
-            feature = entities['feature']
             # 在描述或规格中查找特性
-            feature_query = Q(description__icontains=feature) | Q(specifications__icontains=feature)
-            query &= feature_query
+            query &= self._feature_query(entities['feature'])
 
         return query
 
-    def _handle_recommendation(self, entities, user=None, limit=5):
+    def _brand_query(self, brand, prefix=''):
+        """品牌条件：名称走倒排索引，规格中的品牌走属性表索引"""
+        query = Q(**{f'{prefix}id__in': attributes.products_with_value('brand', brand)})
+        name_ids = search.matching_product_ids(brand, [Field.NAME])
+        if name_ids is None:
+            return query | Q(**{f'{prefix}name__icontains': brand})
+        return query | Q(**{f'{prefix}id__in': name_ids})
+
+    def _feature_query(self, feature, prefix=''):
+        """
+        特性条件：描述和规格值走倒排索引，规格名走属性表索引
+
+        倒排索引要求包含特性的全部 bigram，与原来对描述和规格 JSON 的 icontains 一样是包含匹配，
+        "快充" 能匹配规格值 "65W快充"；特性无法切分（单个字）时退回 icontains。
+        """
+        query = attributes.term_query(feature, field=f'{prefix}id')
+        description_ids = search.matching_product_ids(feature, [Field.DESCRIPTION])
+        specification_ids = search.matching_product_ids(feature, [Field.SPECIFICATIONS])
+        if description_ids is None or specification_ids is None:
+            return (query | Q(**{f'{prefix}description__icontains': feature}) |
+                    Q(**{f'{prefix}specifications__icontains': feature}))
+        return query | Q(**{f'{prefix}id__in': description_ids}) | Q(**{f'{prefix}id__in': specification_ids})
+
+    def _handle_recommendation(self, entities, user=None, limit=5, session_items=None, progress=None):
         """
         处理商品推荐逻辑，结合多种推荐算法
         """
         try:
             # 基于规则过滤的候选商品
-            rule_candidates = self._get_rule_based_candidates(entities, limit * 2)
+            rule_candidates = self._shared(
+                'rule_based', entities, limit * 2, lambda: self._get_rule_based_candidates(entities, limit * 2)
+            )
 
             # 如果没有足够的候选商品，直接返回规则过滤结果
             if len(rule_candidates) < 2:
@@ -128,13 +299,42 @@ class Recommender:
                         "algorithm": "rule_based"
                     }
 
+            # 先推送回复文本和规则过滤的初步结果，个性化排序完成后由返回值给出最终结果
+            self._notify(progress, 'message', message=self._generate_recommendation_message(entities))
+            self._notify(progress, 'rule_based', products=rule_candidates[:limit])
+
+            # 当前会话中的商品序列预测的下一个商品，作为内容推荐的一部分排在最前
+            session_candidates = self._get_session_candidates(session_items, entities, limit * 2)
+            personalized = bool(user and user.is_authenticated)
+            self._notify_ranked(
+                progress, 'session', rule_candidates, [] if personalized else None, session_candidates, entities, limit
+            )
+
             # 为已登录用户提供个性化推荐
-            if user and user.is_authenticated:
-                # 基于用户协同过滤的推荐
-                cf_candidates = self._get_collaborative_filtering_candidates(user, entities, limit * 2)
+            if personalized:
+                precomputed_candidates = self._get_precomputed_candidates(user, entities, limit * 2)
+                if precomputed_candidates is not None:
+                    # 离线预计算的候选已融合协同过滤和内容推荐，作为个性化部分参与排序；
+                    # 预计算之后的新购买由增量维护的共同购买关系补上
+                    cf_candidates = precomputed_candidates
+                    self._notify_ranked(
+                        progress, 'precomputed', rule_candidates, cf_candidates, session_candidates, entities, limit
+                    )
+                    content_candidates = self._get_copurchase_candidates(user, entities, limit * 2)
+                    content_stage = 'copurchase'
+                else:
+                    # 冷用户实时计算
+                    # 基于用户协同过滤的推荐
+                    cf_candidates = self._get_collaborative_filtering_candidates(user, entities, limit * 2)
+                    self._notify_ranked(
+                        progress, 'collaborative', rule_candidates, cf_candidates, session_candidates, entities, limit
+                    )
 
-                # 基于内容的推荐
-                content_candidates = self._get_content_based_candidates(user, entities, limit * 2)
+                    # 基于内容的推荐
+                    content_candidates = self._get_content_based_candidates(user, entities, limit * 2)
+                    content_stage = 'content_based'
+
+                content_candidates = self._merge_candidates(session_candidates, content_candidates)
 
                 # 融合多种推荐结果
                 final_products = self._hybrid_ranking(
@@ -144,11 +344,13 @@ class Recommender:
                     entities,
                     limit
                 )
+                self._notify(progress, content_stage, products=final_products)
 
                 algorithm = "hybrid"
             else:
                 # 未登录用户只使用规则过滤和基于内容的推荐
                 content_candidates = self._get_content_based_candidates(None, entities, limit * 2)
+                content_candidates = self._merge_candidates(session_candidates, content_candidates)
 
                 # 简单融合规则过滤和基于内容的推荐
                 final_products = self._simple_hybrid_ranking(
@@ -157,12 +359,16 @@ class Recommender:
                     entities,
                     limit
                 )
+                self._notify(progress, 'content_based', products=final_products)
 
                 algorithm = "content_rule_hybrid"
 
             # 如果结果不足，补充热门商品
             if len(final_products) < limit:
-                popular_products = self._get_popular_products(entities, limit - len(final_products))
+                popular_limit = limit - len(final_products)
+                popular_products = self._shared(
+                    'popular', entities, popular_limit, lambda: self._get_popular_products(entities, popular_limit)
+                )
                 # 去重
                 existing_ids = {p.id for p in final_products}
                 for p in popular_products:
@@ -170,27 +376,12 @@ class Recommender:
                         final_products.append(p)
                         if len(final_products) >= limit:
                             break
+                self._notify(progress, 'popular', products=final_products)
 
             # 构建推荐回复消息
+            # 推荐记录由 DialogueManager 统一写入，这里不再重复记录
             message = self._generate_recommendation_message(entities)
 
-            # 如果用户已登录，记录这次推荐
-            if user and user.is_authenticated:
-                try:
-                    # 获取当前会话
-                    current_conversation = Conversation.objects.filter(user=user).order_by('-created_at').first()
-
-                    if current_conversation:
-                        # 创建推荐记录
-                        recommendation = Recommendation.objects.create(
-                            conversation=current_conversation,
-                            algorithm=algorithm
-                        )
-                        # 添加推荐的商品
-                        recommendation.products.add(*[p.id for p in final_products])
-                except Exception as e:
-                    logger.error(f"记录推荐出错: {e}")
-
             return {
                 "products": final_products,
                 "message": message,
@@ -205,12 +396,150 @@ class Recommender:
                 "algorithm": "error"
             }
 
+    def _notify_ranked(self, progress, stage, rule_candidates, cf_candidates, content_candidates, entities, limit):
+        """推送某个阶段完成后用已有候选融合排序的临时结果，cf_candidates 为 None 时按未登录用户排序"""
+        if progress is None:
+            return
+        if cf_candidates is None:
+            products = self._simple_hybrid_ranking(rule_candidates, content_candidates, entities, limit)
+        else:
+            products = self._hybrid_ranking(rule_candidates, cf_candidates, content_candidates, entities, limit)
+        self._notify(progress, stage, products=products)
+
+    def _notify(self, progress, stage, message=None, products=None):
+        """调用进度回调，回调出错不影响推荐"""
+        if progress is None:
+            return
+        try:
+            progress(stage, message=message, products=products)
+        except Exception as e:
+            logger.error(f"推送推荐进度出错: {e}")
+
+    def _get_precomputed_candidates(self, user, entities, limit):
+        """读取离线预计算的个性化候选，与当前实体条件和库存求交集；没有预计算结果时返回 None"""
+        if self.as_of is not None:
+            return None
+        try:
+            precomputed = get_user_candidates(user.id)
+        except Exception as e:
+            logger.error(f"读取预计算推荐出错: {e}")
+            return None
+        if precomputed is None:
+            return None
+
+        candidate_ids = precomputed['ids']
+        if entities.get('category'):
+            # 总榜之外再合并对应分类的切片，保证按分类筛选后仍有足够的候选
+            category_ids = Category.objects.filter(
+                name__icontains=entities['category']
+            ).values_list('id', flat=True)
+            for category_id in category_ids:
+                candidate_ids = candidate_ids + precomputed['categories'].get(category_id, [])
+        rank = {}
+        for product_id in candidate_ids:
+            rank.setdefault(product_id, len(rank))
+
+        products = Product.objects.filter(
+            self._build_query(entities),
+            id__in=list(rank),
+            stock__gt=0
+        )
+        return sorted(products, key=lambda p: rank[p.id])[:limit]
+
+    def _get_session_candidates(self, session_items, entities, limit):
+        """用转移表根据会话中的商品序列给下一个商品打分，再按实体条件和库存过滤"""
+        if not session_items or self.as_of is not None:
+            return []
+        try:
+            table = get_transition_table()
+            if table is None:
+                return []
+
+            scores = dict(table.score(session_items, limit * 4))
+            if not scores:
+                return []
+
+            products = Product.objects.filter(
+                self._build_query(entities),
+                id__in=list(scores),
+                stock__gt=0
+            )
+            return sorted(products, key=lambda p: scores[p.id], reverse=True)[:limit]
+
+        except Exception as e:
+            logger.error(f"会话推荐错误: {e}")
+            return []
+
+    def _merge_candidates(self, first, second):
+        """合并两组候选，保持顺序并去重"""
+        if not first:
+            return second
+        seen = {product.id for product in first}
+        return first + [product for product in second if product.id not in seen]
+
+    def _get_copurchase_candidates(self, user, entities, limit):
+        """根据用户购买过的商品，取与之经常一起购买的商品（由订单事件增量维护）"""
+        if self.as_of is not None:
+            return []
+        try:
+            seed_ids = list(UserProductInteraction.objects.filter(
+                user=user, weight__gt=0
+            ).order_by('-weight').values_list('product_id', flat=True)[:10])
+            if not seed_ids:
+                return []
+
+            scores = dict(ProductCoPurchase.objects.filter(
+                product_id__in=seed_ids, count__gt=0
+            ).exclude(other_id__in=seed_ids).values('other_id').annotate(
+                score=Sum('count')
+            ).order_by('-score').values_list('other_id', 'score')[:limit * 4])
+            if not scores:
+                return []
+
+            products = Product.objects.filter(
+                self._build_query(entities),
+                id__in=list(scores),
+                stock__gt=0
+            )
+            return sorted(products, key=lambda p: scores[p.id], reverse=True)[:limit]
+
+        except Exception as e:
+            logger.error(f"共同购买推荐错误: {e}")
+            return []
+
+    def _matched_category_ids(self, entities):
+        """实体中的分类匹配到的分类ID（同一次推荐中规则过滤和协同过滤共用一次查询）"""
+        if not entities.get('category'):
+            return []
+        return self._shared('category_ids', {'category': entities['category']}, None, lambda: list(
+            Category.objects.filter(name__icontains=entities['category']).values_list('id', flat=True)
+        ))
+
+    def _get_indexed_candidates(self, category_ids, limit, band=None):
+        """用进程内的分类检索结构取价格范围内最新的有库存商品"""
+        product_ids = retrieval.top_k(category_ids, limit, band)
+        products_by_id = Product.objects.in_bulk(product_ids)
+        return [products_by_id[pk] for pk in product_ids if pk in products_by_id]
+
     def _get_rule_based_candidates(self, entities, limit):
         """基于规则的过滤获取候选商品"""
+        # 只有分类和价格条件时直接用检索结构，不必在数据库中排序
+        if self.as_of is None and not entities.get('brand') and not entities.get('feature'):
+            category_ids = self._matched_category_ids(entities)
+            if category_ids:
+                try:
+                    products = self._get_indexed_candidates(category_ids, limit, price_band(entities))
+                    if not products:
+                        # 放宽为只保留分类条件
+                        products = self._get_indexed_candidates(category_ids, limit)
+                    return products
+                except Exception as e:
+                    logger.error(f"分类检索结构查询错误: {e}")
+
         query = self._build_query(entities)
 
         # 查询符合条件的商品
-        products = Product.objects.filter(query).filter(stock__gt=0).order_by('-created_at')[:limit]
+        products = Product.objects.filter(query, self._as_of_query()).filter(stock__gt=0).order_by('-created_at')[:limit]
 
         # 如果没有匹配的商品，尝试放宽条件
         if not products.exists() and entities.get('category'):
@@ -219,7 +548,9 @@ class Recommender:
             categories = Category.objects.filter(name__icontains=category_name)
             if categories.exists():
                 category_ids = [c.id for c in categories]
-                products = Product.objects.filter(category__in=category_ids, stock__gt=0).order_by('-created_at')[
+                products = Product.objects.filter(
+                    self._as_of_query(), category__in=category_ids, stock__gt=0
+                ).order_by('-created_at')[
                            :limit]
 
         return list(products)
@@ -235,21 +566,17 @@ class Recommender:
 
             # 获取相似用户购买/查看过的商品
             # 优先考虑从订单中提取数据
-            base_query = Q(order__user__in=similar_users, order__status__in=['paid', 'shipped', 'completed'])
+            base_query = Q(order__user__in=similar_users, order__status__in=PURCHASED_STATUSES)
+            base_query &= self._as_of_query('order__created_at')
 
             # 如果有分类过滤条件，应用它
-            if entities.get('category'):
-                category_name = entities['category']
-                categories = Category.objects.filter(name__icontains=category_name)
-                if categories.exists():
-                    category_ids = [c.id for c in categories]
-                    base_query &= Q(product__category__in=category_ids)
+            category_ids = self._matched_category_ids(entities)
+            if category_ids:
+                base_query &= Q(product__category__in=category_ids)
 
             # 如果有品牌过滤条件，应用它
             if entities.get('brand'):
-                brand = entities['brand']
-                base_query &= (Q(product__name__icontains=brand) |
-                               Q(product__specifications__brand__icontains=brand))
+                base_query &= self._brand_query(entities['brand'], prefix='product__')
 
             # 聚合计算商品得分（购买次数）
             product_scores = OrderItem.objects.filter(base_query).values(
@@ -286,16 +613,29 @@ class Recommender:
                 # 获取用户最近购买的商品
                 recent_order_items = OrderItem.objects.filter(
                     order__user=user,
-                    order__status__in=['paid', 'shipped', 'completed']
-                ).order_by('-order__created_at')[:5]
-
-                if recent_order_items.exists():
-                    seed_products = [item.product for item in recent_order_items]
+                    order__status__in=PURCHASED_STATUSES
+                ).filter(
+                    self._as_of_query('order__created_at')
+                ).select_related('product').order_by('-order__created_at')[:5]
+                seed_products = [item.product for item in recent_order_items]
+
+                # 补充最近浏览/点击过的商品（由行为事件压缩得到，离线评估时不可用）
+                if self.as_of is None and len(seed_products) < 5:
+                    seen = {product.id for product in seed_products}
+                    recent_ids = [
+                        product_id for product_id, _ in get_recent_interactions(user.id)
+                        if product_id not in seen
+                    ][:5 - len(seed_products)]
+                    if recent_ids:
+                        recent_products = Product.objects.in_bulk(recent_ids)
+                        seed_products.extend(recent_products[pid] for pid in recent_ids if pid in recent_products)
 
             # 如果没有种子商品，使用当前实体条件获取一些相关商品作为种子
             if not seed_products:
                 query = self._build_query(entities)
-                seed_products = list(Product.objects.filter(query).filter(stock__gt=0).order_by('-created_at')[:3])
+                seed_products = list(
+                    Product.objects.filter(query, self._as_of_query()).filter(stock__gt=0).order_by('-created_at')[:3]
+                )
 
             # 仍然没有种子商品，返回空结果
             if not seed_products:
@@ -303,49 +643,42 @@ class Recommender:
 
             # 获取种子商品的分类和特性
             seed_categories = {product.category_id for product in seed_products}
+            per_seed = limit // 2
+            if per_seed <= 0:
+                return []
 
-            # 基于种子商品的特性查找相似商品
-            content_based_candidates = []
+            # 种子商品所在分类的相似商品一次查出，每个分类多取一个，排除种子本身后仍够 per_seed 个
+            similar_products = Product.objects.filter(
+                self._as_of_query(),
+                category_id__in=seed_categories,
+                stock__gt=0
+            )
 
-            for seed_product in seed_products:
-                # 在相同分类中查找相似商品
-                similar_products = Product.objects.filter(
-                    category=seed_product.category,
-                    stock__gt=0
-                ).exclude(
-                    id=seed_product.id
-                )
+            # 如果有品牌偏好，应用它
+            if entities.get('brand'):
+                similar_products = similar_products.filter(self._brand_query(entities['brand']))
 
-                # 如果有品牌偏好，应用它
-                if entities.get('brand'):
-                    brand = entities['brand']
-                    similar_products = similar_products.filter(
-                        Q(name__icontains=brand) | Q(specifications__brand__icontains=brand)
-                    )
+            # 应用价格过滤
+            band = price_band(entities)
+            if band is not None:
+                similar_products = similar_products.filter(band.as_query())
 
-                # 应用价格过滤
-                if entities.get('price'):
-                    price = entities['price']
-                    min_price = price * 0.8
-                    max_price = price * 1.2
-                    similar_products = similar_products.filter(price__gte=min_price, price__lte=max_price)
-                elif entities.get('price_range'):
-                    price_range = entities['price_range']
-                    if price_range == '1000以下':
-                        similar_products = similar_products.filter(price__lt=1000)
-                    elif price_range == '1000-2000':
-                        similar_products = similar_products.filter(price__gte=1000, price__lte=2000)
-                    elif price_range == '2000-3000':
-                        similar_products = similar_products.filter(price__gte=2000, price__lte=3000)
-                    elif price_range == '3000-5000':
-                        similar_products = similar_products.filter(price__gte=3000, price__lte=5000)
-                    elif price_range == '5000-8000':
-                        similar_products = similar_products.filter(price__gte=5000, price__lte=8000)
-                    elif price_range == '8000以上':
-                        similar_products = similar_products.filter(price__gte=8000)
-
-                # 限制数量并添加到候选列表
-                content_based_candidates.extend(list(similar_products[:limit // 2]))
+            rows = similar_products.annotate(
+                category_rank=Window(RowNumber(), partition_by=F('category_id'), order_by=F('id').asc())
+            ).filter(
+                category_rank__lte=per_seed + 1
+            ).order_by('category_id', 'id')
+            by_category = defaultdict(list)
+            for product in rows:
+                by_category[product.category_id].append(product)
+
+            # 按种子顺序在同分类中取相似商品，排除种子本身
+            content_based_candidates = []
+            for seed_product in seed_products:
+                content_based_candidates.extend([
+                    product for product in by_category[seed_product.category_id]
+                    if product.id != seed_product.id
+                ][:per_seed])
 
             # 去重
             seen_ids = set()
@@ -367,7 +700,9 @@ class Recommender:
             # 获取目标用户的购买历史
             user_purchases = OrderItem.objects.filter(
                 order__user=user,
-                order__status__in=['paid', 'shipped', 'completed']
+                order__status__in=PURCHASED_STATUSES
+            ).filter(
+                self._as_of_query('order__created_at')
             ).values_list('product_id', flat=True)
 
             user_product_set = set(user_purchases)
@@ -378,7 +713,8 @@ class Recommender:
 
             # 查找有共同购买商品的用户
             similar_users_query = Order.objects.filter(
-                status__in=['paid', 'shipped', 'completed'],
+                self._as_of_query(),
+                status__in=PURCHASED_STATUSES,
                 items__product_id__in=user_product_set
             ).exclude(
                 user=user
@@ -402,7 +738,7 @@ class Recommender:
         """获取热门商品"""
         try:
             # 基础查询
-            base_query = Q(stock__gt=0)
+            base_query = Q(stock__gt=0) & self._as_of_query()
 
             # 应用分类过滤
             if entities.get('category'):
@@ -412,13 +748,22 @@ class Recommender:
                     category_ids = [c.id for c in categories]
                     base_query &= Q(category__in=category_ids)
 
-            # 计算热门商品（基于最近30天的销量）
-            thirty_days_ago = timezone.now() - timedelta(days=30)
+            if self.as_of is None:
+                # 在线请求直接使用订单事件增量维护的热度，不再聚合订单表
+                popular_products = Product.objects.filter(base_query).order_by(
+                    F('popularity__score').desc(nulls_last=True), '-created_at'
+                )[:limit]
+                return list(popular_products)
+
+            # 离线评估按截止时间计算热门商品（基于最近30天的销量）
+            now = self.as_of
+            thirty_days_ago = now - timedelta(days=30)
 
             popular_products = Product.objects.filter(base_query).annotate(
                 sales=Sum('orderitem__quantity',
                           filter=Q(orderitem__order__created_at__gte=thirty_days_ago,
-                                   orderitem__order__status__in=['paid', 'shipped', 'completed']))
+                                   orderitem__order__status__in=PURCHASED_STATUSES) &
+                          self._as_of_query('orderitem__order__created_at'))
             ).order_by('-sales', '-created_at')[:limit]
 
             return list(popular_products)
@@ -561,7 +906,7 @@ class Recommender:
 
         return message
 
-    def _handle_product_info(self, entities):
+    def _handle_product_info(self, entities, progress=None):
         """处理商品信息查询逻辑"""
         query = self._build_query(entities)
 
@@ -588,6 +933,7 @@ class Recommender:
                 message = f"以下是{entities['category']}的相关信息："
             else:
                 message = "以下是您查询的产品信息："
+            self._notify(progress, 'message', message=message)
 
             return {
                 "products": list(products),
@@ -603,47 +949,59 @@ class Recommender:
                 "algorithm": "error"
             }
 
-    def _handle_product_comparison(self, entities):
+    def _handle_product_comparison(self, entities, progress=None):
         """处理商品比较逻辑"""
         query = self._build_query(entities)
 
         try:
-            products = Product.objects.filter(query).filter(stock__gt=0).order_by('-created_at')[:5]
+            products = list(Product.objects.filter(query).filter(stock__gt=0).order_by('-created_at')[:5])
 
-            if not products.exists():
+            if not products:
                 return {
                     "products": [],
                     "message": "抱歉，没有找到可比较的商品。",
                     "algorithm": "comparison"
                 }
 
+            # 构建比较消息（不依赖查到的商品，先推送）
+            if entities.get('feature') and entities.get('category'):
+                message = f"以下是{entities['category']}中{entities['feature']}表现的比较："
+            elif entities.get('brand') and entities.get('category'):
+                message = f"以下是{entities['brand']}与其他品牌{entities['category']}的比较："
+            elif entities.get('category'):
+                message = f"以下是{entities['category']}的品牌比较："
+            else:
+                message = "以下是相关产品的比较："
+            self._notify(progress, 'message', message=message)
+
             # 如果只有一个品牌，则寻找同类别的其他品牌产品进行比较
             if entities.get('brand') and len(products) < 2:
                 category_ids = [p.category_id for p in products]
+                # 只按品牌属性排除（走 (key, value) 索引），不再对商品名做全表匹配
                 other_brand_products = Product.objects.filter(
                     category__in=category_ids,
                     stock__gt=0
                 ).exclude(
-                    Q(name__icontains=entities['brand']) | Q(specifications__brand__icontains=entities['brand'])
+                    id__in=attributes.products_with_value('brand', entities['brand'])
+                ).exclude(
+                    id__in=[p.id for p in products]
                 ).order_by('-created_at')[:4]
 
-                products = list(products) + list(other_brand_products)
+                products = products + list(other_brand_products)
 
-            # 构建比较消息
-            if entities.get('feature') and entities.get('category'):
-                message = f"以下是{entities['category']}中{entities['feature']}表现的比较："
-            elif entities.get('brand') and entities.get('category'):
-                message = f"以下是{entities['brand']}与其他品牌{entities['category']}的比较："
-            elif entities.get('category'):
-                message = f"以下是{entities['category']}的品牌比较："
-            else:
-                message = "以下是相关产品的比较："
+            # 按预先构建的分类规格矩阵对齐各商品的数值参数
+            try:
+                comparison = compare_products(products, entities.get('feature'))
+            except Exception as e:
+                logger.error(f"规格比较出错: {e}")
+                comparison = None
 
             return {
                 "products": products,
                 "message": message,
                 "algorithm": "comparison",
-                "comparison_feature": entities.get('feature')
+                "comparison_feature": entities.get('feature'),
+                "comparison": comparison
             }
 
         except Exception as e:
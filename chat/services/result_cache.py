@@ -0,0 +1,176 @@
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from products.models import Category, Product
+from products.versions import get_versions, listing_tag, product_tag
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'LOCAL_MAXSIZE': 512,  # 进程内 LRU 最大条目数
+    'TIMEOUT': 600,  # Django 缓存中的过期时间（秒）
+    'REPORT_EVERY': 1000,  # 每多少次查询输出一次命中率
+}
+
+CACHE_KEY_PREFIX = 'recs:result:'
+
+
+class RecommendationResultCache:
+    """
+    推荐结果两级缓存
+
+    - 第一级：进程内 LRU
+    - 第二级：settings.CACHES 中配置的 Django 缓存
+
+    缓存键由意图、规范化后的实体和用户分群组成，缓存值只保存商品ID列表，
+    读取时再批量加载商品。每个条目记录两类版本号：
+    - 结果中每个商品的版本号：这些商品任一被修改或删除，条目失效
+    - 筛选分类的列表版本号：有商品可能新匹配筛选条件（上架、补货、改价、改名、换分类）时递增
+    其他商品的普通库存扣减不会让条目失效。
+    """
+
+    def __init__(self, options=None):
+        self.options = {**DEFAULT_OPTIONS, **getattr(settings, 'RECOMMENDATION_CACHE', {}), **(options or {})}
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'stale': 0}
+
+    @staticmethod
+    def normalize_entities(entities):
+        """去掉空值并统一大小写，保证等价的实体得到相同的键"""
+        normalized = {}
+        for key, value in (entities or {}).items():
+            if value in (None, '', [], {}):
+                continue
+            if isinstance(value, str):
+                value = value.strip().lower()
+            normalized[key] = value
+        return normalized
+
+    def make_key(self, intent, entities, segment):
+        payload = json.dumps(
+            [intent, self.normalize_entities(entities), segment],
+            ensure_ascii=False,
+            sort_keys=True,
+            default=str,
+        )
+        return CACHE_KEY_PREFIX + hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+    def get(self, intent, entities, segment):
+        """命中时返回与 Recommender 相同结构的结果字典，否则返回 None"""
+        key = self.make_key(intent, entities, segment)
+
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None:
+                self._local.move_to_end(key)
+        level = 'local_hits'
+
+        if entry is None:
+            entry = cache.get(key)
+            level = 'shared_hits'
+
+        if entry is None:
+            self._record('misses')
+            return None
+
+        if not self._is_fresh(entry):
+            self._discard(key)
+            self._record('stale')
+            self._record('misses')
+            return None
+
+        if level == 'shared_hits':
+            self._remember(key, entry)
+        self._record(level)
+        return self._hydrate(entry)
+
+    def set(self, intent, entities, segment, result):
+        """缓存一次推荐结果（只保存商品ID）"""
+        key = self.make_key(intent, entities, segment)
+        tags = self._dependency_tags(entities, result.get('products', []))
+        entry = {
+            'ids': [product.id for product in result.get('products', [])],
+            'result': {k: v for k, v in result.items() if k != 'products'},
+            'versions': get_versions(tags),
+        }
+        cache.set(key, entry, self.options['TIMEOUT'])
+        self._remember(key, entry)
+
+    def stats(self):
+        """返回各级命中次数与命中率"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['local_size'] = len(self._local)
+        lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+        stats['lookups'] = lookups
+        stats['hit_ratio'] = (stats['local_hits'] + stats['shared_hits']) / lookups if lookups else 0.0
+        stats['local_hit_ratio'] = stats['local_hits'] / lookups if lookups else 0.0
+        return stats
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def _dependency_tags(self, entities, products):
+        """结果依赖的版本标签：结果中的商品，以及筛选分类（未按分类筛选时为整个目录）的列表版本"""
+        tags = [product_tag(product.id) for product in products]
+        category_name = (entities or {}).get('category')
+        if category_name:
+            category_ids = list(
+                Category.objects.filter(name__icontains=category_name).values_list('id', flat=True)
+            )
+            if category_ids:
+                return tags + [listing_tag(category_id) for category_id in category_ids]
+        return tags + [listing_tag()]
+
+    def _is_fresh(self, entry):
+        stored = entry['versions']
+        return get_versions(stored.keys()) == stored
+
+    def _hydrate(self, entry):
+        ids = entry['ids']
+        products_by_id = Product.objects.select_related('category').in_bulk(ids) if ids else {}
+        result = dict(entry['result'])
+        result['products'] = [products_by_id[pk] for pk in ids if pk in products_by_id]
+        return result
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._local[key] = entry
+            self._local.move_to_end(key)
+            while len(self._local) > self.options['LOCAL_MAXSIZE']:
+                self._local.popitem(last=False)
+
+    def _discard(self, key):
+        with self._lock:
+            self._local.pop(key, None)
+        cache.delete(key)
+
+    def _record(self, counter):
+        with self._lock:
+            self._stats[counter] += 1
+            lookups = self._stats['local_hits'] + self._stats['shared_hits'] + self._stats['misses']
+        report_every = self.options['REPORT_EVERY']
+        if counter != 'stale' and report_every and lookups % report_every == 0:
+            stats = self.stats()
+            logger.info(
+                "推荐结果缓存命中率: %.2f%% (进程内 %.2f%%), 查询 %d 次, 失效 %d 次",
+                stats['hit_ratio'] * 100,
+                stats['local_hit_ratio'] * 100,
+                stats['lookups'],
+                stats['stale'],
+            )
+
+
+# 进程级单例，DialogueManager 每次请求都会新建 Recommender，缓存需要跨实例共享
+result_cache = RecommendationResultCache()
+
+# 输入联想预热的推荐候选（规则过滤、热门商品），只需要撑到用户发出下一轮
+candidate_cache = RecommendationResultCache({'TIMEOUT': 60, 'REPORT_EVERY': 0})
@@ -0,0 +1,127 @@
+"""
+相同计算的合并执行（single-flight）
+
+同一进程内，相同键的计算同一时刻只执行一次，其他线程等待并共享结果。
+可选地在 Django 缓存中加一把跨进程的锁：拿不到锁的进程轮询共享缓存（由调用方提供 lookup），
+持锁进程写入结果后直接读取；锁释放后仍没有结果时自己计算。
+"""
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'CACHE_LOCK': False,  # 是否启用跨进程锁（需要 lookup 才生效）
+    'LOCK_TIMEOUT': 10,  # 跨进程锁的过期时间（秒），持锁进程崩溃时自动释放
+    'WAIT_TIMEOUT': 10,  # 最多等待其他线程或进程的秒数，超时后自己计算
+    'POLL_INTERVAL': 0.05,  # 轮询共享缓存的间隔（秒）
+}
+
+LOCK_KEY_PREFIX = 'singleflight:'
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """按键合并并发的相同计算"""
+
+    def __init__(self, name, options=None):
+        self.name = name
+        self.options = {**DEFAULT_OPTIONS, **getattr(settings, 'CHAT_SINGLE_FLIGHT', {}), **(options or {})}
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    def do(self, key, func, lookup=None):
+        """
+        执行 func()，相同 key 的并发调用只执行一次
+
+        Args:
+            key: 计算的键，调用方负责规范化
+            func: 无参数的计算函数
+            lookup: 可选，从共享缓存读取结果的函数，没有结果时返回 None；启用跨进程锁时使用
+
+        Returns:
+            tuple: (结果, 是否来自其他调用)。共享的结果是同一个对象，调用方不应修改
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if call.event.wait(self.options['WAIT_TIMEOUT']):
+                if call.error is not None:
+                    raise call.error
+                self._record('shared')
+                return call.result, True
+            # 等待超时，不再等待，自己计算
+            self._record('wait_timeouts')
+            return func(), False
+
+        try:
+            call.result, shared = self._run(key, func, lookup)
+            return call.result, shared
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._stats)
+            metrics['in_flight'] = len(self._calls)
+        return metrics
+
+    def _run(self, key, func, lookup):
+        if not self.options['CACHE_LOCK'] or lookup is None:
+            self._record('executed')
+            return func(), False
+
+        digest = hashlib.md5(str(key).encode('utf-8')).hexdigest()
+        lock_key = f'{LOCK_KEY_PREFIX}{self.name}:{digest}'
+        token = uuid.uuid4().hex
+        if cache.add(lock_key, token, self.options['LOCK_TIMEOUT']):
+            try:
+                self._record('executed')
+                return func(), False
+            finally:
+                # 只释放自己的锁；超时后被其他进程拿到的锁不动
+                if cache.get(lock_key) == token:
+                    cache.delete(lock_key)
+
+        # 其他进程正在计算，轮询共享缓存
+        deadline = time.monotonic() + self.options['WAIT_TIMEOUT']
+        while time.monotonic() < deadline:
+            time.sleep(self.options['POLL_INTERVAL'])
+            result = lookup()
+            if result is not None:
+                self._record('shared_remote')
+                return result, True
+            if cache.get(lock_key) is None:
+                # 持锁进程已结束但没有写入结果（出错或结果不可缓存）
+                break
+        self._record('executed')
+        return func(), False
+
+    def _record(self, counter):
+        with self._lock:
+            self._stats[counter] += 1
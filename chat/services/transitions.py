@@ -0,0 +1,170 @@
+"""
+会话内的下一个商品推荐
+
+离线任务（build_item_transitions 命令）统计行为事件和订单中相邻商品的转移次数，
+每个商品只保留得分最高的若干后继商品，按压缩稀疏行的形式存为几个定长数组放进缓存。
+各进程把数组加载到内存，请求时对会话中的每个商品做一次二分查找和一次切片即可打分。
+"""
+import logging
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY = 'recs:transitions'
+CACHE_TIMEOUT = 36 * 3600
+RELOAD_INTERVAL = 600  # 进程内的转移表最多使用多久后重新从缓存读取（秒）
+
+MAX_NEXT = 20  # 每个商品保留的后继商品数
+SESSION_GAP = 3600  # 两次行为间隔超过该秒数视为不同会话
+RECENCY_DECAY = 0.7  # 会话中越早的商品权重越低
+
+
+class TransitionTable:
+    """
+    商品转移表
+
+    items 为升序排列的商品ID，第 i 个商品的后继商品位于
+    next_ids[offsets[i]:offsets[i + 1]]，对应的得分在 scores 的同一区间。
+    """
+
+    def __init__(self, items, offsets, next_ids, scores, built_at=None):
+        self.items = items
+        self.offsets = offsets
+        self.next_ids = next_ids
+        self.scores = scores
+        self.built_at = built_at
+
+    @classmethod
+    def build(cls, sequences, max_next=MAX_NEXT):
+        """
+        从商品序列统计转移次数
+
+        Args:
+            sequences: 可迭代的商品ID序列，每个序列按时间排列
+        """
+        counts = defaultdict(Counter)
+        for sequence in sequences:
+            for current, following in zip(sequence, sequence[1:]):
+                if current != following:
+                    counts[current][following] += 1
+
+        items = sorted(counts)
+        offsets = [0]
+        next_ids = []
+        scores = []
+        for product_id in items:
+            followers = counts[product_id].most_common(max_next)
+            total = sum(counts[product_id].values())
+            next_ids.extend(following for following, _ in followers)
+            scores.extend(count / total for _, count in followers)
+            offsets.append(len(next_ids))
+
+        return cls(
+            np.array(items, dtype=np.int64),
+            np.array(offsets, dtype=np.int64),
+            np.array(next_ids, dtype=np.int64),
+            np.array(scores, dtype=np.float32),
+            built_at=time.time(),
+        )
+
+    def __len__(self):
+        return len(self.items)
+
+    def followers(self, product_id):
+        """返回商品的 (后继商品ID数组, 得分数组)"""
+        i = np.searchsorted(self.items, product_id)
+        if i >= len(self.items) or self.items[i] != product_id:
+            return self.next_ids[:0], self.scores[:0]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.next_ids[start:end], self.scores[start:end]
+
+    def score(self, session_items, limit, exclude=()):
+        """
+        根据会话中的商品序列给候选的下一个商品打分
+
+        Args:
+            session_items: 按时间排列的商品ID，最后一个是最近的
+            limit: 返回数量
+            exclude: 不参与推荐的商品ID
+
+        Returns:
+            list: 按得分降序的 [(product_id, score), ...]
+        """
+        scores = defaultdict(float)
+        weight = 1.0
+        for product_id in reversed(session_items):
+            next_ids, next_scores = self.followers(product_id)
+            for next_id, next_score in zip(next_ids.tolist(), next_scores.tolist()):
+                scores[next_id] += weight * next_score
+            weight *= RECENCY_DECAY
+
+        excluded = set(exclude) | set(session_items)
+        ranked = [(product_id, score) for product_id, score in scores.items() if product_id not in excluded]
+        ranked.sort(key=lambda item: item[1], reverse=True)
+        return ranked[:limit]
+
+    def to_cache(self):
+        return {
+            'built_at': self.built_at,
+            'items': self.items.tobytes(),
+            'offsets': self.offsets.tobytes(),
+            'next_ids': self.next_ids.tobytes(),
+            'scores': self.scores.tobytes(),
+        }
+
+    @classmethod
+    def from_cache(cls, entry):
+        return cls(
+            np.frombuffer(entry['items'], dtype=np.int64),
+            np.frombuffer(entry['offsets'], dtype=np.int64),
+            np.frombuffer(entry['next_ids'], dtype=np.int64),
+            np.frombuffer(entry['scores'], dtype=np.float32),
+            built_at=entry['built_at'],
+        )
+
+
+def split_sessions(events, gap=SESSION_GAP):
+    """
+    把按时间排列的 (product_id, timestamp) 切分成会话
+
+    Returns:
+        list: 商品ID序列的列表
+    """
+    sessions = []
+    current = []
+    last_time = None
+    for product_id, timestamp in events:
+        if last_time is not None and (timestamp - last_time).total_seconds() > gap:
+            sessions.append(current)
+            current = []
+        current.append(product_id)
+        last_time = timestamp
+    if current:
+        sessions.append(current)
+    return [session for session in sessions if len(session) > 1]
+
+
+def store_transition_table(table):
+    cache.set(CACHE_KEY, table.to_cache(), CACHE_TIMEOUT)
+
+
+_table = None
+_loaded_at = 0.0
+
+
+def get_transition_table():
+    """返回进程内的转移表，定期从缓存刷新；没有时返回 None"""
+    global _table, _loaded_at
+    now = time.monotonic()
+    if _table is None or now - _loaded_at >= RELOAD_INTERVAL:
+        _loaded_at = now
+        try:
+            entry = cache.get(CACHE_KEY)
+            _table = TransitionTable.from_cache(entry) if entry is not None else None
+        except Exception as e:
+            logger.error(f"加载商品转移表失败: {e}")
+    return _table
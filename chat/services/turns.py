@@ -0,0 +1,195 @@
+"""
+一轮对话的处理流程
+
+同步接口、异步接口和 WebSocket 共用 run_turn：
+    load     取得活跃会话（优先读会话状态缓存），记录用户消息
+    respond  对话管理与推荐，结束时提交会话状态
+    persist  记录系统回复；本轮的消息和推荐记录合并为一次批量写入
+各阶段在同一个事务中执行，整轮的查询次数受 QUERY_BUDGET 约束，测试中超出预算直接失败。
+消息和推荐记录在事务提交后才交给后台线程写入，回滚的一轮不会留下记录。
+意图识别不访问数据库，在事务之外完成。
+
+handle_turn / handle_turn_async 在此之外加上过载控制（见 load_shedding）：
+降级模式下只用规则识别意图、推荐使用非个性化缓存；拒绝模式下抛出 ChatOverloaded。
+
+handle_batch 一次处理多条消息：意图识别整批进行，各轮依次在用户的活跃会话中执行，
+实体条件相同的推荐过滤在整批内只查询一次。
+"""
+import asyncio
+import logging
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from ..models import Message
+from .chat_log import chat_log
+from .dialogue_manager import DialogueManager, turn_entities
+from .history import reference_structured_data
+from .inference import InferenceOverloaded, inference, recognize, recognize_batch
+from .load_shedding import DEGRADED, ChatOverloaded, overload
+from .query_budget import QueryBudget
+from .typeahead import typeahead
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'QUERY_BUDGET': 20,  # 一轮对话最多执行的查询数
+    'BATCH_MAX_ITEMS': 100,  # handle_batch 一次最多处理的消息数
+}
+
+_dialogue_manager = None
+_dialogue_manager_lock = threading.Lock()
+
+
+def get_dialogue_manager():
+    """进程内共享的 DialogueManager（不保存请求相关的状态）"""
+    global _dialogue_manager
+    if _dialogue_manager is None:
+        with _dialogue_manager_lock:
+            if _dialogue_manager is None:
+                _dialogue_manager = DialogueManager()
+    return _dialogue_manager
+
+
+def run_turn(dm, user, text, nlp_result, conversation=None, progress=None, degraded=False):
+    """
+    在一个事务中执行一轮对话
+
+    Args:
+        dm: DialogueManager
+        user: 已登录的用户
+        text: 消息文本
+        nlp_result: 意图识别结果
+        conversation: 调用方已经取得的活跃会话，为空时在这里获取
+        progress: 可选的进度回调，见 Recommender.get_recommendations
+        degraded: 过载降级模式，推荐不做个性化，消息记录不等待缓冲区
+
+    Returns:
+        dict: DialogueManager.process_message 的返回值
+
+    Raises:
+        QueryBudgetExceeded: 测试环境中查询次数超出预算
+    """
+    options = {**DEFAULT_OPTIONS, **getattr(settings, 'CHAT_TURN', {})}
+    with QueryBudget(options['QUERY_BUDGET'], 'chat turn') as budget, transaction.atomic(), chat_log.batch(block=not degraded):
+        budget.stage('load')
+        if conversation is None:
+            conversation = dm._get_or_create_conversation(user)
+        chat_log.log_message(conversation.id, Message.MessageType.USER_TEXT, text)
+
+        budget.stage('respond')
+        response = dm.process_message(
+            user, {'text': text, 'nlp_result': nlp_result}, conversation, progress, degraded
+        )
+        typeahead.record_turn(
+            user, nlp_result['intent'], turn_entities(response['context'].get('entities', {}), nlp_result['entities'])
+        )
+
+        budget.stage('persist')
+        chat_log.log_message(
+            conversation.id,
+            Message.MessageType.SYSTEM_TEXT,
+            response['response'],
+            # 商品只保存引用，读取历史时再补全卡片
+            reference_structured_data(response.get('structured_data'))
+        )
+    return response
+
+
+def handle_turn(user, text):
+    """
+    同步处理一条用户消息
+
+    Raises:
+        ChatOverloaded: 系统过载
+    """
+    with overload.admit() as mode:
+        degraded = mode == DEGRADED
+        # 意图识别（模型在进程内只加载一次），不占用事务
+        nlp_result = recognize(text, use_model=not degraded)
+        return run_turn(get_dialogue_manager(), user, text, nlp_result, degraded=degraded)
+
+
+def handle_batch(user, items):
+    """
+    依次处理多条用户消息
+
+    Args:
+        user: 已登录的用户
+        items: [{'text': 消息文本, 'conversation': 可选的会话ID}]；
+               会话ID用于确认消息发往用户当前的活跃会话，不一致时该条返回错误
+
+    Returns:
+        list: 与 items 顺序一致，每项为 {'text': ..., 'response': process_message 的返回值}
+              或 {'text': ..., 'error': 错误信息}；单条失败只回滚该轮，不影响其他消息，
+              过载拒绝的消息另带 retry_after
+
+    Raises:
+        ChatOverloaded: 系统过载，整批被拒绝
+    """
+    dm = get_dialogue_manager()
+    # 整批识别计为一次请求；之后每轮单独接受过载控制，耗时统计与单条接口一致
+    with overload.admit() as mode:
+        nlp_results = recognize_batch([item['text'] for item in items], use_model=mode != DEGRADED)
+
+    results = []
+    with dm.recommender.shared_filters():
+        for item, nlp_result in zip(items, nlp_results):
+            text = item['text']
+            try:
+                with overload.admit() as mode:
+                    # 活跃会话从会话状态缓存读取；上一轮结束了会话时这里取到新会话
+                    conversation = dm._get_or_create_conversation(user)
+                    expected = item.get('conversation')
+                    if expected is not None and expected != conversation.id:
+                        results.append({'text': text, 'error': f'会话 {expected} 不是当前的活跃会话'})
+                        continue
+                    response = run_turn(dm, user, text, nlp_result, conversation, degraded=mode == DEGRADED)
+                results.append({'text': text, 'response': response})
+            except ChatOverloaded as e:
+                results.append({'text': text, 'error': str(e), 'retry_after': e.retry_after})
+            except Exception as e:
+                logger.error(f"批量处理消息出错: {e}", exc_info=True)
+                results.append({'text': text, 'error': '处理消息时出现问题'})
+    return results
+
+
+async def handle_turn_async(user, text, progress=None):
+    """
+    处理一条用户消息
+
+    Args:
+        user: 已登录的用户
+        text: 消息文本
+        progress: 可选的进度回调，在工作线程中调用，见 Recommender.get_recommendations
+
+    Returns:
+        dict: DialogueManager.process_message 的返回值
+
+    Raises:
+        ChatOverloaded: 系统过载
+    """
+    with overload.admit() as mode:
+        degraded = mode == DEGRADED
+        dm = await sync_to_async(get_dialogue_manager, thread_sensitive=False)()
+
+        # 模型推理与会话查询同时进行
+        nlp_result, conversation = await asyncio.gather(
+            _recognize(text, degraded),
+            dm.aget_or_create_conversation(user),
+        )
+
+        # 事务和查询计数都绑定在线程的数据库连接上，整轮在同一个线程中执行
+        return await sync_to_async(run_turn, thread_sensitive=False)(
+            dm, user, text, nlp_result, conversation, progress, degraded
+        )
+
+
+async def _recognize(text, degraded):
+    try:
+        return await inference.process_input(text, use_model=not degraded)
+    except InferenceOverloaded:
+        # 推理线程池排满时本轮退回规则识别，不让请求超时
+        return await inference.process_input(text, use_model=False)
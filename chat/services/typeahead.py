@@ -0,0 +1,219 @@
+"""
+输入联想：用户输入过程中预测意图和实体，并预热推荐缓存
+
+预测只用规则识别意图和实体抽取，不调用模型。与实际的一轮一样，预测的实体会合并用户活跃会话中保存的实体。
+规则意图明确且实体足够时在后台线程中预热实际一轮会读取的数据：
+- 未登录用户、商品信息查询和比较：计算非个性化推荐，写入推荐结果缓存
+- 已登录用户的推荐：结果是个性化的，预热其中与用户无关的规则过滤和热门商品候选（见 Recommender.prewarm_candidates）
+两种情况都会预热商品卡片。预热后记录用户的预测键，用户发出下一轮时统计意图和实体是否一致（next_turn_hits）。
+
+预热是投机性的：后台线程排满、服务处于降级或拒绝模式、或最近已经预热过时直接跳过。
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from products.cards import card_list
+
+from .conversation_state import conversation_store
+from .dialogue_manager import turn_entities
+from .inference import recognize
+from .load_shedding import NORMAL, overload
+from .result_cache import candidate_cache, result_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'MIN_LENGTH': 2,  # 少于该字数不预测
+    'MAX_LENGTH': 100,  # 只取输入的前多少个字
+    'PREWARM': True,
+    'PREWARM_CONFIDENCE': 0.8,  # 预测置信度达到该值时预热
+    'PREWARM_WORKERS': 2,
+    'PREWARM_PENDING': 8,  # 正在执行和排队的预热任务上限，超过时丢弃
+    'PREWARM_INTERVAL': 30,  # 相同意图和实体在该秒数内只预热一次
+    'HIT_WINDOW': 120,  # 预热后该秒数内发出的下一轮计入命中率统计
+}
+
+
+def rule_confidence(intent, entities):
+    """规则预测的置信度：意图明确时按识别出的实体数递增"""
+    if intent == 'unknown':
+        return 0.0
+    found = sum(1 for value in entities.values() if value)
+    return min(0.4 + 0.2 * found, 0.95)
+
+
+class TypeaheadPredictor:
+    """输入联想预测与推荐缓存预热"""
+
+    def __init__(self, options=None):
+        self.options = {**DEFAULT_OPTIONS, **(options or getattr(settings, 'CHAT_TYPEAHEAD', {}))}
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.options['PREWARM_PENDING'])
+        self._recent = {}  # 预测键 -> 最近一次预热的时间
+        self._expected = {}  # 用户ID -> (预测键, 预热时间)，用于统计下一轮的命中率
+        self._stats = Counter()
+
+    def predict(self, text, user=None):
+        """
+        预测部分输入的意图和实体
+
+        Args:
+            text: 输入框中尚未发送的文本
+            user: 当前用户，已登录时合并其活跃会话中保存的实体
+
+        Returns:
+            dict: {'intent', 'confidence', 'entities'（只含本次识别出的实体）, 'prewarmed'}，输入过短时返回 None
+        """
+        text = text.strip()[:self.options['MAX_LENGTH']]
+        if len(text) < self.options['MIN_LENGTH']:
+            return None
+
+        result = recognize(text, use_model=False)
+        intent, entities = result['intent'], result['entities']
+        merged_entities = turn_entities(self._context_entities(user), entities)
+        confidence = rule_confidence(intent, merged_entities)
+        self._record('predictions')
+
+        prewarmed = False
+        if self.options['PREWARM'] and confidence >= self.options['PREWARM_CONFIDENCE']:
+            personalized = self._personalized(intent, user)
+            key = self._key(intent, merged_entities, personalized)
+            prewarmed = self._schedule(key, intent, merged_entities, personalized)
+            self._expect(user, key)
+        return {
+            'intent': intent,
+            'confidence': round(confidence, 2),
+            'entities': {key: value for key, value in entities.items() if value},
+            'prewarmed': prewarmed,
+        }
+
+    def record_turn(self, user, intent, entities):
+        """
+        用户实际发出一轮时调用，统计预热的意图和实体是否与这一轮一致
+
+        Args:
+            entities: 本轮推荐使用的实体（已合并会话中保存的实体）
+        """
+        with self._lock:
+            expected = self._expected.pop(user.id, None)
+        if expected is None or time.monotonic() - expected[1] > self.options['HIT_WINDOW']:
+            return
+        hit = expected[0] == self._key(intent, entities, self._personalized(intent, user))
+        self._record('next_turn_hits' if hit else 'next_turn_misses')
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+        turns = stats.get('next_turn_hits', 0) + stats.get('next_turn_misses', 0)
+        stats['next_turn_hit_ratio'] = stats.get('next_turn_hits', 0) / turns if turns else 0.0
+        stats['candidate_cache'] = candidate_cache.stats()
+        return stats
+
+    def _context_entities(self, user):
+        if user is None or not user.is_authenticated:
+            return {}
+        try:
+            # 联想请求只读会话，不能像 get_active 那样在没有会话时新建
+            conversation = conversation_store.peek(user)
+            return conversation.context.get('entities', {}) if conversation is not None else {}
+        except Exception as e:
+            logger.error(f"读取会话上下文出错: {e}")
+            return {}
+
+    @staticmethod
+    def _personalized(intent, user):
+        return intent == 'recommend' and user is not None and user.is_authenticated
+
+    @staticmethod
+    def _key(intent, entities, personalized):
+        return result_cache.make_key(intent, entities, 'user' if personalized else 'anon')
+
+    def _expect(self, user, key):
+        """记录用户下一轮预期的预测键，过期的记录顺带清理"""
+        if user is None or not user.is_authenticated:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._expected = {
+                user_id: expected for user_id, expected in self._expected.items()
+                if now - expected[1] <= self.options['HIT_WINDOW']
+            }
+            self._expected[user.id] = (key, now)
+
+    def _schedule(self, key, intent, entities, personalized):
+        """提交预热任务，跳过时返回 False"""
+        if overload.mode != NORMAL:
+            self._record('skipped_overload')
+            return False
+
+        from .turns import get_dialogue_manager
+        recommender = get_dialogue_manager().recommender
+        now = time.monotonic()
+        with self._lock:
+            last = self._recent.get(key)
+            if last is not None and now - last < self.options['PREWARM_INTERVAL']:
+                self._stats['skipped_recent'] += 1
+                return False
+            self._recent = {
+                cached_key: at for cached_key, at in self._recent.items()
+                if now - at < self.options['PREWARM_INTERVAL']
+            }
+            self._recent[key] = now
+
+        if not self._slots.acquire(blocking=False):
+            self._forget(key)
+            self._record('dropped')
+            return False
+        try:
+            self._get_executor().submit(self._prewarm, recommender, intent, entities, personalized)
+        except RuntimeError:
+            # 进程退出时线程池已关闭
+            self._slots.release()
+            self._forget(key)
+            return False
+        return True
+
+    def _forget(self, key):
+        """没有提交的预热不算最近预热过"""
+        with self._lock:
+            self._recent.pop(key, None)
+
+    def _prewarm(self, recommender, intent, entities, personalized):
+        try:
+            if personalized:
+                product_ids = recommender.prewarm_candidates(entities)
+            else:
+                # 不带用户和会话商品，得到的是非个性化结果，get_recommendations 会写入结果缓存
+                result = recommender.get_recommendations(intent, entities)
+                product_ids = [product.id for product in result.get('products', [])]
+            card_list(product_ids)
+            self._record('prewarmed')
+        except Exception as e:
+            logger.error(f"预热推荐缓存出错: {e}")
+            self._record('errors')
+        finally:
+            self._slots.release()
+            close_old_connections()
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.options['PREWARM_WORKERS'], thread_name_prefix='chat-prewarm'
+                    )
+        return self._executor
+
+    def _record(self, counter):
+        with self._lock:
+            self._stats[counter] += 1
+
+
+typeahead = TypeaheadPredictor()
@@ -0,0 +1,191 @@
+"""
+后台批量写入
+
+请求线程只把记录放进内存中的有界缓冲区，由后台线程按数量或时间触发批量写库，
+进程退出时把剩余记录写完。缓冲区满时短暂等待后台线程腾出空间，仍然满则丢弃并计数。
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundBatcher:
+    """
+    后台批量写入的基类，子类实现 write_batch(items)
+
+    Args:
+        name: 名称，用于日志和线程名
+        max_queue: 缓冲区最大条数
+        batch_size: 达到该数量立即写入，也是单次写入的最大条数
+        flush_interval: 距上次写入超过该秒数时写入
+        block_timeout: 缓冲区满时最多等待的秒数，为 0 时不等待
+        drop_oldest: 缓冲区满时丢弃最旧的记录（环形缓冲），否则丢弃新记录
+        enabled: 为 False 时在调用线程中同步写入（测试环境使用）
+    """
+
+    def __init__(self, name, max_queue=10000, batch_size=200, flush_interval=1.0,
+                 block_timeout=0.0, drop_oldest=False, enabled=True):
+        self.name = name
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self.drop_oldest = drop_oldest
+        self.enabled = enabled
+
+        self._buffer = deque()
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+        self._collecting = threading.local()
+        self._metrics = {
+            'enqueued': 0,
+            'written': 0,
+            'dropped': 0,
+            'flushes': 0,
+            'failures': 0,
+            'last_flush_ms': 0.0,
+        }
+        atexit.register(self.shutdown)
+
+    def submit(self, item):
+        """放入一条记录，返回是否成功入队"""
+        pending = getattr(self._collecting, 'items', None)
+        if pending is not None:
+            pending.append(item)
+            return True
+        if not self.enabled:
+            self._write([item])
+            return True
+        return self._enqueue(item)
+
+    def submit_many(self, items, block=True):
+        """放入多条记录；同步写入时合并为一次 write_batch。block 为 False 时缓冲区满直接丢弃，不等待"""
+        items = list(items)
+        if not items:
+            return True
+        if not self.enabled:
+            self._write(items)
+            return True
+        return all([self._enqueue(item, block) for item in items])
+
+    @contextmanager
+    def batch(self, block=True):
+        """
+        在当前线程中收集 submit 的记录，正常退出时一起提交
+
+        块内出现异常时丢弃收集到的记录。嵌套使用时由最外层提交。
+        在数据库事务中退出时等事务提交后再提交：后台线程用自己的连接写入，
+        不能早于事务提交，否则写入的记录可能引用回滚掉的行。
+        """
+        if getattr(self._collecting, 'items', None) is not None:
+            yield
+            return
+        self._collecting.items = []
+        try:
+            yield
+        except BaseException:
+            self._collecting.items = None
+            raise
+        items, self._collecting.items = self._collecting.items, None
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(lambda: self.submit_many(items, block))
+        else:
+            self.submit_many(items, block)
+
+    def _enqueue(self, item, block=True):
+        with self._condition:
+            self._ensure_started()
+            if len(self._buffer) >= self.max_queue:
+                if self.drop_oldest:
+                    self._buffer.popleft()
+                    self._metrics['dropped'] += 1
+                elif block and self.block_timeout > 0:
+                    self._condition.notify_all()
+                    self._condition.wait_for(lambda: len(self._buffer) < self.max_queue, self.block_timeout)
+                if len(self._buffer) >= self.max_queue:
+                    self._metrics['dropped'] += 1
+                    logger.warning(f"{self.name} 缓冲区已满，丢弃一条记录")
+                    return False
+            self._buffer.append(item)
+            self._metrics['enqueued'] += 1
+            if len(self._buffer) >= self.batch_size:
+                self._condition.notify_all()
+        return True
+
+    def flush(self):
+        """把缓冲区中的记录全部写入"""
+        with self._flush_lock:
+            while True:
+                with self._condition:
+                    batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                    self._condition.notify_all()
+                if not batch:
+                    break
+                self._write(batch)
+
+    def shutdown(self):
+        """停止后台线程并写完剩余记录"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval * 5)
+        self.flush()
+
+    def metrics(self):
+        with self._condition:
+            metrics = dict(self._metrics)
+            metrics['queue_size'] = len(self._buffer)
+        return metrics
+
+    def write_batch(self, items):
+        raise NotImplementedError
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name=f'{self.name}-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._stopped or len(self._buffer) >= self.batch_size,
+                    self.flush_interval,
+                )
+                stopped = self._stopped
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+            if stopped:
+                break
+
+    def _write(self, batch):
+        started = time.monotonic()
+        try:
+            self.write_batch(batch)
+        except Exception as e:
+            with self._condition:
+                self._metrics['failures'] += 1
+            logger.error(f"{self.name} 批量写入失败（{len(batch)} 条）: {e}", exc_info=True)
+            if len(batch) > 1:
+                # 逐条重试，避免一条坏记录拖累整批
+                for item in batch:
+                    self._write([item])
+            return
+        elapsed = (time.monotonic() - started) * 1000
+        with self._condition:
+            self._metrics['written'] += len(batch)
+            self._metrics['flushes'] += 1
+            self._metrics['last_flush_ms'] = elapsed
@@ -1,3 +1,583 @@
+import json
+import random
+import re
+import tempfile
+from unittest import mock
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from chat.models import ArchivedConversation, Conversation, Message, Recommendation
+from chat.services.archive import ConversationArchiver
+from chat.services.chat_log import ChatLogBuffer, chat_log
+from chat.services.conversation_state import ConversationStateStore, conversation_store
+from chat.services.dialogue_manager import DialogueManager
+from chat.services.query_budget import QueryBudget, QueryBudgetExceeded
+from chat.services.recommender import Recommender
+from chat.services.turns import run_turn
+from chat.services.typeahead import typeahead
+from orders.models import Order, OrderItem
+from products import search
+from products.attributes import sync_attributes
+from products.models import Category, Product
+
+User = get_user_model()
+
+CATEGORY_NAMES = ['手机', '电脑', '平板', '耳机', '相机', '智能手表', '路由器', '游戏机']
+BRAND_NAMES = ['苹果', '华为', '小米', '索尼', '三星', 'OPPO', 'vivo', '联想']
+FEATURE_NAMES = ['拍照', '游戏', '续航', '屏幕', '音质', '性能']
+
+# 允许全表扫描的小表（分类表只有几十行，按名称模糊匹配无法走索引）
+SMALL_TABLES = {'category'}
+
+
+def _mysql_full_scans(plan):
+    scans = []
+    if isinstance(plan, dict):
+        if plan.get('access_type') == 'ALL':
+            scans.append(plan.get('table_name'))
+        for value in plan.values():
+            scans.extend(_mysql_full_scans(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            scans.extend(_mysql_full_scans(value))
+    return scans
+
+
+def _postgresql_full_scans(plan):
+    scans = []
+    if isinstance(plan, dict):
+        if plan.get('Node Type') == 'Seq Scan':
+            scans.append(plan.get('Relation Name'))
+        for value in plan.values():
+            scans.extend(_postgresql_full_scans(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            scans.extend(_postgresql_full_scans(value))
+    return scans
+
+
+def full_table_scans(sql):
+    """对一条 SELECT 执行 EXPLAIN，返回被全表扫描的表名"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(f'EXPLAIN FORMAT=JSON {sql}')
+            return _mysql_full_scans(json.loads(cursor.fetchone()[0]))
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+            plan = cursor.fetchone()[0]
+            return _postgresql_full_scans(json.loads(plan) if isinstance(plan, str) else plan)
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            scans = []
+            for row in cursor.fetchall():
+                match = re.match(r'SCAN (?:TABLE )?(\w+)$', row[-1])
+                if match:
+                    scans.append(match.group(1))
+            return scans
+    return []
+
+
+class QueryPlanRegressionTests(TestCase):
+    """
+    热点查询的执行计划与查询次数回归测试
+
+    在预置数据上执行推荐、对话管理和订单相关的热点路径，
+    记录每条 SELECT 的 EXPLAIN，出现全表扫描或查询次数超出预算时失败。
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(42)
+        merchant = User.objects.create_user(username='merchant', password='x', role='merchant')
+        cls.users = User.objects.bulk_create([
+            User(username=f'user{i}', password='x') for i in range(40)
+        ])
+        categories = Category.objects.bulk_create([Category(name=name) for name in CATEGORY_NAMES])
+
+        products = []
+        for i in range(400):
+            category = categories[i % len(categories)]
+            brand = BRAND_NAMES[rng.randrange(len(BRAND_NAMES))]
+            feature = FEATURE_NAMES[rng.randrange(len(FEATURE_NAMES))]
+            products.append(Product(
+                name=f'{brand}{category.name}{i}',
+                description=f'这款{category.name}{feature}出色',
+                price=Decimal(rng.randrange(300, 12000)),
+                category=category,
+                merchant=merchant,
+                stock=rng.randrange(0, 50),
+                specifications={'品牌': brand, '特性': [feature]},
+            ))
+        cls.products = Product.objects.bulk_create(products)
+        for product in cls.products:
+            search.index_product(product)
+            sync_attributes(product)
+
+        statuses = ['paid', 'shipped', 'completed', 'pending', 'cancelled']
+        orders = Order.objects.bulk_create([
+            Order(user=cls.users[i % len(cls.users)], status=statuses[i % len(statuses)])
+            for i in range(200)
+        ])
+        Order.objects.update(created_at=timezone.now() - timedelta(days=3))
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=1, price=product.price)
+            for order in orders
+            for product in rng.sample(cls.products, rng.randrange(1, 4))
+        ])
+
+        Conversation.objects.bulk_create([
+            Conversation(
+                user=cls.users[i % len(cls.users)],
+                current_state=Conversation.State.values[i % len(Conversation.State.values)],
+                context={},
+            )
+            for i in range(120)
+        ])
+
+    def setUp(self):
+        self.user = self.users[0]
+        self.recommender = Recommender()
+
+    def assertHotPath(self, func, max_queries):
+        """执行热点路径，检查查询次数和每条 SELECT 的执行计划"""
+        with CaptureQueriesContext(connection) as captured:
+            func()
+        self.assertLessEqual(
+            len(captured), max_queries,
+            f'查询次数超出预算 {max_queries}:\n' + '\n'.join(q['sql'] for q in captured),
+        )
+        for query in captured:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            scans = [table for table in full_table_scans(sql) if table not in SMALL_TABLES]
+            self.assertFalse(scans, f'出现全表扫描 {scans}:\n{sql}')
+
+    def test_rule_based_candidates_by_category(self):
+        self.assertHotPath(
+            lambda: self.recommender._get_rule_based_candidates({'category': '手机'}, 10),
+            max_queries=4,
+        )
+
+    def test_rule_based_candidates_by_category_and_price(self):
+        self.assertHotPath(
+            lambda: self.recommender._get_rule_based_candidates(
+                {'category': '电脑', 'price_range': '3000-5000'}, 10
+            ),
+            max_queries=4,
+        )
+
+    def test_rule_based_candidates_by_brand_and_feature(self):
+        self.assertHotPath(
+            lambda: self.recommender._get_rule_based_candidates(
+                {'category': '手机', 'brand': '华为', 'feature': '拍照'}, 10
+            ),
+            max_queries=6,
+        )
+
+    def test_popular_products(self):
+        self.assertHotPath(
+            lambda: self.recommender._get_popular_products({'category': '耳机'}, 5),
+            max_queries=3,
+        )
+
+    def test_similar_users(self):
+        self.assertHotPath(lambda: self.recommender._find_similar_users(self.user), max_queries=2)
+
+    def test_collaborative_filtering_candidates(self):
+        self.assertHotPath(
+            lambda: self.recommender._get_collaborative_filtering_candidates(self.user, {'category': '手机'}, 10),
+            max_queries=6,
+        )
+
+    def test_active_conversation_lookup(self):
+        # 与 DialogueManager._get_or_create_conversation 中的查询一致
+        self.assertHotPath(
+            lambda: Conversation.objects.filter(
+                user=self.user,
+                current_state__in=[
+                    Conversation.State.INIT,
+                    Conversation.State.COLLECTING,
+                    Conversation.State.RECOMMENDING,
+                ],
+            ).order_by('-updated_at').first(),
+            max_queries=1,
+        )
+
+    def test_order_list(self):
+        self.assertHotPath(
+            lambda: list(Order.objects.filter(user=self.user).order_by('-created_at')),
+            max_queries=1,
+        )
+
+    def test_user_purchase_history(self):
+        self.assertHotPath(
+            lambda: list(OrderItem.objects.filter(
+                order__user=self.user,
+                order__status__in=['paid', 'shipped', 'completed'],
+            ).order_by('-order__created_at')[:5]),
+            max_queries=1,
+        )
+
+    def test_chat_turn_within_budget(self):
+        # 整轮对话（会话、推荐、商品卡片、消息记录）超出 CHAT_TURN 预算时 run_turn 抛出 QueryBudgetExceeded
+        nlp_result = {'intent': 'recommend', 'entities': {'category': '手机', 'price_range': '3000-5000'}}
+        # 消息记录在事务提交后写入
+        with self.captureOnCommitCallbacks(execute=True):
+            response = run_turn(DialogueManager(), self.users[1], '推荐一款三千到五千的手机', nlp_result)
+        self.assertTrue(response['response'])
+        self.assertEqual(
+            Message.objects.filter(conversation__user=self.users[1]).count(), 2
+        )
+
+    def test_query_budget_guard(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with QueryBudget(1, 'test', enforce=True) as budget:
+                budget.stage('orders')
+                list(Order.objects.filter(user=self.user)[:1])
+                list(Order.objects.filter(user=self.users[1])[:1])
+
+
+class ChatTurnTransactionTests(TestCase):
+    """一轮对话回滚时不能留下消息和推荐记录（后台线程用自己的连接写入，必须等事务提交）"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='turn_user', password='x')
+
+    def setUp(self):
+        cache.clear()
+        conversation_store._local.clear()
+
+    def test_rolled_back_turn_submits_no_messages(self):
+        nlp_result = {'intent': 'greeting', 'entities': {}}
+        with mock.patch.object(chat_log, 'submit_many') as submit_many:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                with self.assertRaises(RuntimeError), transaction.atomic():
+                    run_turn(DialogueManager(), self.user, '你好', nlp_result)
+                    # 本轮的记录已经收集完，事务在提交前失败
+                    raise RuntimeError('commit failed')
+        submit_many.assert_not_called()
+        self.assertEqual(callbacks, [])
+        self.assertFalse(Message.objects.filter(conversation__user=self.user).exists())
+        # 回滚掉的新会话也不能留在会话状态缓存里
+        self.assertIsNone(cache.get(f'chat:conversation:{self.user.id}'))
+
+    def test_messages_are_submitted_after_commit(self):
+        nlp_result = {'intent': 'greeting', 'entities': {}}
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            run_turn(DialogueManager(), self.user, '你好', nlp_result)
+            # 事务提交前没有任何记录交给写入线程
+            self.assertFalse(Message.objects.filter(conversation__user=self.user).exists())
+        for callback in callbacks:
+            callback()
+        self.assertEqual(Message.objects.filter(conversation__user=self.user).count(), 2)
+
+
+class ConversationStateStoreTests(TestCase):
+    """多个工作进程（各自一个 ConversationStateStore）共享缓存时，不能基于过期的副本提交"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='state_user', password='x')
+
+    def setUp(self):
+        cache.clear()
+        self.worker_a = ConversationStateStore({'WRITE_BACK': True})
+        self.worker_b = ConversationStateStore({'WRITE_BACK': True})
+        for store in (self.worker_a, self.worker_b):
+            # 测试中手动 flush，不让后台写回线程用另一个连接访问数据库
+            store._ensure_started = lambda: None
+
+    def commit(self, store, conversation):
+        with self.captureOnCommitCallbacks(execute=True):
+            store.commit(conversation)
+
+    def test_reads_newer_revision_committed_by_other_worker(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.worker_a.get_active(self.user)
+        self.worker_b.get_active(self.user)
+
+        first.context = {'entities': {'category': '手机'}}
+        self.commit(self.worker_a, first)
+
+        # B 刚读过旧版本，也要看到 A 提交的新版本
+        current = self.worker_b.get_active(self.user)
+        self.assertEqual(current.context, {'entities': {'category': '手机'}})
+        self.assertEqual(current._state_revision, first._state_revision)
+
+    def test_concurrent_commit_on_same_revision_is_rejected(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.worker_a.get_active(self.user)
+        turn_a = self.worker_a.get_active(self.user)
+        turn_b = self.worker_b.get_active(self.user)
+
+        turn_a.context = {'entities': {'category': '手机'}}
+        self.commit(self.worker_a, turn_a)
+        turn_b.context = {'entities': {'category': '电脑'}}
+        self.commit(self.worker_b, turn_b)
+
+        self.assertEqual(self.worker_b.metrics()['conflicts'], 1)
+        for store in (self.worker_a, self.worker_b):
+            self.assertEqual(store.get_active(self.user).context, {'entities': {'category': '手机'}})
+        # 被拒绝的修改不会由 B 的写回线程写进数据库
+        self.worker_b.flush(force=True)
+        self.worker_a.flush(force=True)
+        self.assertEqual(Conversation.objects.get(id=turn_a.id).context, {'entities': {'category': '手机'}})
+
+
+class FeatureRecallTests(TestCase):
+    """特性条件是包含匹配：规格值或描述中包含特性的商品都要能查到"""
+
+    @classmethod
+    def setUpTestData(cls):
+        merchant = User.objects.create_user(username='feature_merchant', password='x', role='merchant')
+        category = Category.objects.create(name='手机')
+        cls.fast_charge = Product.objects.create(
+            name='快充手机', description='轻薄机身', price=Decimal('2999'), category=category,
+            merchant=merchant, stock=5, specifications={'充电': '65W快充', '品牌': '小米'},
+        )
+        cls.long_battery = Product.objects.create(
+            name='长续航手机', description='超长待机', price=Decimal('1999'), category=category,
+            merchant=merchant, stock=5, specifications={'电池': '6000mAh', '品牌': '华为'},
+        )
+
+    def matched(self, feature):
+        query = Recommender()._feature_query(feature)
+        return set(Product.objects.filter(query).values_list('id', flat=True))
+
+    def test_partial_specification_value(self):
+        self.assertEqual(self.matched('快充'), {self.fast_charge.id})
+
+    def test_description_substring(self):
+        self.assertEqual(self.matched('待机'), {self.long_battery.id})
+
+    def test_specification_key(self):
+        self.assertEqual(self.matched('电池'), {self.long_battery.id})
+
+
+class ArchivePurgeTests(TestCase):
+    """归档只删除导出之后没有变化的会话，选出后又有新对话的会话要留在热表"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='archive_user', password='x')
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.archiver = ConversationArchiver({'DIR': self.directory.name, 'PAUSE': 0})
+        self.conversation = Conversation.objects.create(user=self.user, current_state=Conversation.State.CLOSED)
+        Message.objects.create(conversation=self.conversation, message_type=Message.MessageType.USER_TEXT, content='你好')
+        Conversation.objects.filter(id=self.conversation.id).update(updated_at=timezone.now() - timedelta(days=60))
+
+    def new_turn(self):
+        Message.objects.create(conversation=self.conversation, message_type=Message.MessageType.USER_TEXT, content='还在吗')
+        Conversation.objects.filter(id=self.conversation.id).update(updated_at=timezone.now())
+
+    def test_turn_after_export_is_not_purged(self):
+        write_segment = self.archiver._write_segment
+
+        def write_then_turn(day, records):
+            # 分段文件写完、删除之前，用户又发了一轮消息
+            segment = write_segment(day, records)
+            self.new_turn()
+            return segment
+
+        with mock.patch.object(self.archiver, '_write_segment', side_effect=write_then_turn):
+            stats = self.archiver.run()
+        self.assertEqual(stats['deleted'], 0)
+        self.assertEqual(Message.objects.filter(conversation=self.conversation).count(), 2)
+
+        # 会话再次过期后重新导出，归档里包含新消息
+        Conversation.objects.filter(id=self.conversation.id).update(updated_at=timezone.now() - timedelta(days=60))
+        self.archiver.run()
+        self.assertFalse(Conversation.objects.filter(id=self.conversation.id).exists())
+        archived = ArchivedConversation.objects.get(conversation_id=self.conversation.id)
+        self.assertEqual(archived.message_count, 2)
+        self.assertEqual(len(self.archiver.load([archived])[0]['messages']), 2)
+
+    def test_already_exported_conversation_with_new_messages_is_reexported(self):
+        # 上次运行导出后中断，之后会话又有新消息（写回模式下 updated_at 可能尚未更新）
+        with mock.patch.object(self.archiver, '_purge', return_value=0):
+            self.archiver.run()
+        Message.objects.create(conversation=self.conversation, message_type=Message.MessageType.USER_TEXT, content='还在吗')
+
+        self.archiver.run()
+        archived = ArchivedConversation.objects.get(conversation_id=self.conversation.id)
+        self.assertEqual(archived.message_count, 2)
+        self.assertFalse(Message.objects.filter(conversation_id=self.conversation.id).exists())
+
+    def test_purge_evicts_cached_conversation_state(self):
+        conversation_store._publish_loaded(self.user.id, {
+            'id': self.conversation.id, 'user_id': self.user.id, 'state': Conversation.State.CLOSED,
+            'context': {}, 'revision': 1,
+        })
+        self.archiver.run()
+        self.assertIsNone(cache.get(f'chat:conversation:{self.user.id}'))
+
+
+class AsyncChatViewTests(TestCase):
+    """异步聊天接口对格式错误的请求体返回 400"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='async_user', password='x')
+
+    def test_malformed_body_is_rejected(self):
+        self.client.force_login(self.user)
+        url = reverse('chat:chat_api_async')
+        for body in ('[]', '"你好"', '{"text": 123}', '{"text": ["你好"]}', '{"text": "  "}', '{'):
+            with self.subTest(body=body):
+                response = self.client.post(url, body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+
+
+class TypeaheadContextTests(TestCase):
+    """输入联想只读取会话上下文，不为没有会话的用户新建会话"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='typeahead_user', password='x')
+
+    def setUp(self):
+        cache.clear()
+        conversation_store._local.clear()
+        # 不在后台线程预热推荐；规则识别依赖的分词模型测试环境中不一定有
+        for patcher in (
+            mock.patch.object(typeahead, '_schedule', return_value=False),
+            mock.patch('chat.services.typeahead.recognize', return_value={
+                'intent': 'recommend', 'entities': {'category': '手机'},
+            }),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_predict_does_not_create_conversation(self):
+        self.assertIsNotNone(typeahead.predict('推荐一款手机', self.user))
+        self.assertFalse(Conversation.objects.filter(user=self.user).exists())
+        self.assertIsNone(cache.get(f'chat:conversation:{self.user.id}'))
+
+    def test_reads_entities_of_existing_conversation(self):
+        Conversation.objects.create(
+            user=self.user, current_state=Conversation.State.COLLECTING, context={'entities': {'brand': '华为'}}
+        )
+        self.assertEqual(typeahead._context_entities(self.user), {'brand': '华为'})
+        self.assertEqual(Conversation.objects.filter(user=self.user).count(), 1)
+
+
+class RecommendationProgressTests(TestCase):
+    """推荐的每个候选生成阶段都推送临时结果，客户端可以逐步替换商品卡片"""
+
+    @classmethod
+    def setUpTestData(cls):
+        merchant = User.objects.create_user(username='progress_merchant', password='x', role='merchant')
+        category = Category.objects.create(name='耳机')
+        for index in range(4):
+            Product.objects.create(
+                name=f'耳机{index}', description='降噪', price=Decimal(100 + index), category=category,
+                merchant=merchant, stock=5, specifications={'品牌': '索尼'},
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_every_stage_carries_products(self):
+        events = []
+        Recommender().get_recommendations(
+            'recommend', {'category': '耳机'}, limit=3,
+            progress=lambda stage, message=None, products=None: events.append((stage, message, products)),
+        )
+        self.assertEqual(events[0][0], 'message')
+        self.assertIsNotNone(events[0][1])
+        stages = events[1:]
+        self.assertEqual([stage for stage, _, _ in stages][:2], ['rule_based', 'session'])
+        self.assertIn('content_based', [stage for stage, _, _ in stages])
+        for stage, _, products in stages:
+            with self.subTest(stage=stage):
+                self.assertTrue(products)
+                self.assertLessEqual(len(products), 3)
+
+
+class ChatLogWriteBehindTests(TestCase):
+    """后台批量写入按提交顺序写入消息和推荐记录，缓冲区满时丢弃而不阻塞请求"""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='log_user', password='x')
+        merchant = User.objects.create_user(username='log_merchant', password='x', role='merchant')
+        category = Category.objects.create(name='相机')
+        cls.conversation = Conversation.objects.create(user=user)
+        cls.products = [
+            Product.objects.create(
+                name=f'相机{index}', description='微单', price=Decimal(3000 + index), category=category,
+                merchant=merchant, stock=5, specifications={},
+            )
+            for index in range(2)
+        ]
+
+    def setUp(self):
+        self.buffer = ChatLogBuffer()
+        self.buffer.enabled = True
+        self.buffer.batch_size = 2
+        # 测试中手动 flush，不启动后台线程
+        self.buffer._ensure_started = lambda: None
+
+    def test_flush_preserves_submission_order(self):
+        product_ids = [product.id for product in self.products]
+        with self.captureOnCommitCallbacks(execute=True), self.buffer.batch():
+            self.buffer.log_message(self.conversation.id, Message.MessageType.USER_TEXT, '第一条')
+            self.buffer.log_recommendation(self.conversation.id, 'hybrid', product_ids + product_ids[:1])
+            self.buffer.log_message(self.conversation.id, Message.MessageType.SYSTEM_TEXT, '第二条')
+        self.assertFalse(Message.objects.filter(conversation=self.conversation).exists())
+
+        self.buffer.flush()
+        contents = list(Message.objects.filter(conversation=self.conversation).order_by('id').values_list('content', flat=True))
+        self.assertEqual(contents, ['第一条', '第二条'])
+        recommendation = Recommendation.objects.get(conversation=self.conversation)
+        self.assertEqual(sorted(recommendation.products.values_list('id', flat=True)), sorted(product_ids))
+        metrics = self.buffer.metrics()
+        self.assertEqual((metrics['written'], metrics['flushes'], metrics['queue_size']), (3, 2, 0))
+
+    def test_full_queue_drops_new_records(self):
+        self.buffer.max_queue = 1
+        self.buffer.block_timeout = 0
+        self.assertTrue(self.buffer.log_message(self.conversation.id, Message.MessageType.USER_TEXT, '保留'))
+        self.assertFalse(self.buffer.log_message(self.conversation.id, Message.MessageType.USER_TEXT, '丢弃'))
+        self.buffer.flush()
+        self.assertEqual(self.buffer.metrics()['dropped'], 1)
+        self.assertEqual(list(Message.objects.filter(conversation=self.conversation).values_list('content', flat=True)), ['保留'])
+
+
+class ChatViewErrorTests(TestCase):
+    """聊天接口出错时只返回通用提示，异常和调用栈只记录在服务端日志"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='view_user', password='x')
+
+    def test_error_response_has_no_traceback(self):
+        self.client.force_login(self.user)
+        with mock.patch('chat.views.handle_turn', side_effect=RuntimeError('secret detail')), \
+                self.assertLogs('chat.views', 'ERROR') as logs:
+            response = self.client.post(reverse('chat:chat_api'), {'text': '你好'}, content_type='application/json')
+        self.assertEqual(response.status_code, 500)
+        self.assertNotIn('trace', response.json())
+        self.assertNotIn('secret detail', response.content.decode())
+        self.assertIn('Traceback', logs.output[0])
 
-# Create your tests here.
+    def test_malformed_body_is_rejected(self):
+        self.client.force_login(self.user)
+        for body in ('[]', '{"text": 1}', '{'):
+            with self.subTest(body=body):
+                response = self.client.post(reverse('chat:chat_api'), body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
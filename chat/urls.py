@@ -18,11 +18,15 @@ from django.urls import path
 ]
 '''
 from django.urls import path
-from .views import ChatView, ConversationHistoryView
+from .views import AsyncChatView, ChatBatchView, ChatMetricsView, ChatSuggestView, ChatView, ConversationHistoryView
 
 app_name = 'chat'
 
 urlpatterns = [
     path('api/', ChatView.as_view(), name='chat_api'),
+    path('api/async/', AsyncChatView.as_view(), name='chat_api_async'),
+    path('api/batch/', ChatBatchView.as_view(), name='chat_api_batch'),
+    path('suggest/', ChatSuggestView.as_view(), name='chat_suggest'),
     path('history/', ConversationHistoryView.as_view(), name='chat_history'),
+    path('metrics/', ChatMetricsView.as_view(), name='chat_metrics'),
 ]
\ No newline at end of file
@@ -1,4 +1,6 @@
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
@@ -7,15 +9,28 @@ from django.shortcuts import render
 import json
 import logging
 
-from .models import Conversation, Message, Recommendation
-from .services.nlp_processor import NLPProcessor
-from .services.dialogue_manager import DialogueManager
-from products.models import Product
-from .serializers import ConversationSerializer
+from .services import history
+from .services.archive import archiver
+from .services.chat_log import chat_log
+from .services.conversation_state import conversation_store
+from .services.dialogue_manager import build_client_messages
+from .services.inference import recognition_metrics
+from .services.load_shedding import ChatOverloaded, overload
+from .services.recommender import recommendation_flight
+from .services.turns import DEFAULT_OPTIONS as TURN_OPTIONS, handle_batch, handle_turn, handle_turn_async
+from .services.typeahead import typeahead
+from CRS_System.log_pipeline import pipeline_metrics
 
 logger = logging.getLogger(__name__)
 
 
+def overloaded_response(error):
+    """过载时快速拒绝，带上重试时间"""
+    response = JsonResponse({'error': '当前咨询人数较多，请稍后再试', 'retry_after': error.retry_after}, status=503)
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 @method_decorator(login_required, name='dispatch')
 class ChatView(View):
@@ -25,110 +40,178 @@ class ChatView(View):
     def post(self, request):
         try:
             data = json.loads(request.body)
-            text = data.get('text', '').strip()
-            print("收到请求：", data)
-            print("用户：", request.user)
-
-            if not text:
-                return JsonResponse({'error': '消息不能为空'}, status=400)
-
-            # 获取或创建会话
-            conversation, _ = Conversation.objects.get_or_create(
-                user=request.user,
-                current_state=Conversation.State.INIT,
-                defaults={'context': {}},
-            )
+        except ValueError:
+            return JsonResponse({'error': '请求格式错误'}, status=400)
+        text = data.get('text') if isinstance(data, dict) else None
+        if not isinstance(text, str) or not text.strip():
+            return JsonResponse({'error': '消息不能为空'}, status=400)
+        text = text.strip()
 
-            # 创建用户消息
-            Message.objects.create(
-                conversation=conversation,
-                message_type=Message.MessageType.USER_TEXT,
-                content=text
-            )
+        try:
+            # 意图识别、会话、对话管理和消息记录，过载时降级或拒绝
+            response = handle_turn(request.user, text)
 
-            # 处理消息
-            nlp = NLPProcessor()
-            nlp_result = nlp.process_input(text)
-
-            dm = DialogueManager()
-            response = dm.process_message(request.user, {'text': text, 'nlp_result': nlp_result})
-
-            # 更新会话状态
-            conversation.current_state = response['state']
-            conversation.context = response.get('context', {})
-            conversation.save()
-
-            # 创建系统回复消息
-            # 存储结构化数据
-            system_message = Message.objects.create(
-                conversation=conversation,
-                message_type=Message.MessageType.SYSTEM_TEXT,
-                content=response['response'],
-                structured_data=response.get('structured_data')
-            )
+            return JsonResponse({'messages': build_client_messages(text, response)})
+        except ChatOverloaded as e:
+            return overloaded_response(e)
+        except Exception as e:
+            logger.error(f"Chat API error: {e}", exc_info=True)
+            return JsonResponse({'error': '系统暂时出现问题，请稍后再试'}, status=500)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+@method_decorator(login_required, name='dispatch')
+class ChatBatchView(View):
+    """
+    批量聊天接口，供集成方和测试工具一次提交多条消息
+
+    请求体: {"items": [{"text": "...", "conversation": 可选的会话ID}, ...]}
+    响应: {"results": [...]}，顺序与 items 一致，每项为 {"messages": [...]} 或 {"error": "..."}
+    """
+
+    def post(self, request):
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({'error': '请求格式错误'}, status=400)
+        items = data.get('items') if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items:
+            return JsonResponse({'error': 'items 必须是非空列表'}, status=400)
+
+        max_items = {**TURN_OPTIONS, **getattr(settings, 'CHAT_TURN', {})}['BATCH_MAX_ITEMS']
+        if len(items) > max_items:
+            return JsonResponse({'error': f'一次最多提交 {max_items} 条消息'}, status=400)
+
+        # 格式错误的条目单独返回错误，其余条目照常处理
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            text = item.get('text') if isinstance(item, dict) else None
+            conversation = item.get('conversation') if isinstance(item, dict) else None
+            if not isinstance(text, str) or not text.strip():
+                results[index] = {'error': '消息不能为空'}
+            elif conversation is not None and not isinstance(conversation, int):
+                results[index] = {'error': 'conversation 必须是会话ID'}
+            else:
+                valid.append((index, {'text': text.strip(), 'conversation': conversation}))
+
+        try:
+            outcomes = handle_batch(request.user, [item for _, item in valid]) if valid else []
+        except ChatOverloaded as e:
+            return overloaded_response(e)
+        except Exception as e:
+            logger.error(f"Chat batch API error: {e}", exc_info=True)
+            return JsonResponse({'error': '系统暂时出现问题，请稍后再试'}, status=500)
+
+        for (index, _), outcome in zip(valid, outcomes):
+            if 'error' in outcome:
+                results[index] = {key: value for key, value in outcome.items() if key != 'text'}
+            else:
+                results[index] = {'messages': build_client_messages(outcome['text'], outcome['response'])}
+        return JsonResponse({'results': results})
+
+
+@method_decorator(login_required, name='dispatch')
+class ChatSuggestView(View):
+    """
+    输入联想：根据输入框中尚未发送的文本预测意图和实体
 
-            # 如果有商品数据，为每个商品创建单独的消息
-            products_data = []
-            if response.get('structured_data') and response['structured_data'].get('products'):
-                for product in response['structured_data']['products']:
-                    products_data.append({
-                        'id': product['id'],
-                        'name': product['name'],
-                        'price': product['price'],
-                        'description': product['description'],
-                        'image': product['image'],
-                        'category': product['category']
-                    })
-
-            # 构建响应
-            messages = []
-            # 获取用户消息
-            user_msg = Message.objects.filter(
-                conversation=conversation,
-                message_type=Message.MessageType.USER_TEXT
-            ).last()
-
-            if user_msg:
-                messages.append({
-                    'message_type': 'user',
-                    'content': user_msg.content
-                })
-
-            # 添加系统回复
-            messages.append({
-                'message_type': 'system',
-                'content': system_message.content
-            })
-
-            # 添加商品数据
-            for product in products_data:
-                messages.append({
-                    'message_type': 'product',
-                    'content': product['name'],
-                    'structured_data': product
-                })
-
-            return JsonResponse({'messages': messages})
+    GET 参数:
+        q: 当前输入的文本
+    预测的实体合并用户活跃会话中保存的实体；置信度足够高时在后台预热推荐缓存，响应不等待预热完成。
+    """
+
+    def get(self, request):
+        prediction = typeahead.predict(request.GET.get('q', ''), request.user)
+        if prediction is None:
+            return JsonResponse({'intent': None, 'entities': {}, 'prewarmed': False})
+        return JsonResponse(prediction)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncChatView(View):
+    """
+    异步聊天接口（需要以 ASGI 方式部署）
+
+    意图识别在专用的有界线程池中执行，同时用异步 ORM 查找会话；
+    对话管理和推荐仍是同步代码，放到线程中执行，不占用事件循环。
+    """
+
+    async def post(self, request):
+        # Django 4.2 的 login_required 不支持异步视图，这里自行检查
+        user = await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+        if user is None:
+            return JsonResponse({'error': '请先登录'}, status=401)
+
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({'error': '请求格式错误'}, status=400)
+        text = data.get('text') if isinstance(data, dict) else None
+        if not isinstance(text, str) or not text.strip():
+            return JsonResponse({'error': '消息不能为空'}, status=400)
+        text = text.strip()
+
+        try:
+            response = await handle_turn_async(user, text)
+        except ChatOverloaded as e:
+            return overloaded_response(e)
         except Exception as e:
-            import traceback
-            logger.error(f"Chat API error: {e}" + traceback.format_exc())
-            return JsonResponse({'error': str(e), 'trace': traceback.format_exc()}, status=500)
+            logger.error(f"Async chat API error: {e}", exc_info=True)
+            return JsonResponse({'error': '系统暂时出现问题，请稍后再试'}, status=500)
+
+        return JsonResponse({'messages': build_client_messages(text, response)})
 
 
 @method_decorator(login_required, name='dispatch')
 class ConversationHistoryView(View):
+    """
+    会话历史
+
+    GET 参数:
+        limit: 每页会话数，默认 20，最多 50
+        cursor: 上一页返回的 next_cursor
+        format: 为 ndjson 时以流式响应逐行输出游标之后的全部会话（每行一个 JSON 对象）
+        archived: 为 1 时读取已归档的会话（从归档文件按需加载）
+    """
+
+    def get(self, request):
+        cursor = request.GET.get('cursor') or None
+        size = history.page_size(request.GET.get('limit'))
+        try:
+            if cursor:
+                history.decode_cursor(cursor)
+        except history.InvalidCursor as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        if request.GET.get('archived') == '1':
+            return JsonResponse(archiver.get_page(request.user, cursor, size))
+
+        if request.GET.get('format') == 'ndjson':
+            lines = (
+                json.dumps(conversation, ensure_ascii=False) + '\n'
+                for conversation in history.iter_conversations(request.user, cursor, chunk_size=size)
+            )
+            return StreamingHttpResponse(lines, content_type='application/x-ndjson; charset=utf-8')
+
+        return JsonResponse(history.get_page(request.user, cursor, size))
+
+
+@method_decorator(login_required, name='dispatch')
+class ChatMetricsView(View):
+    """聊天服务的运行指标（过载控制模式及切换次数、写入缓冲区、会话状态缓存、并发合并、输入联想预热、日志队列），仅管理员可见"""
+
     def get(self, request):
-        conversations = Conversation.objects.filter(user=request.user).prefetch_related('messages')
-        history = []
-        for conv in conversations:
-            history.append({
-                'id': conv.id,
-                'messages': [
-                    {
-                        'message_type': msg.message_type,
-                        'content': msg.content,
-                        'structured_data': msg.structured_data
-                    } for msg in conv.messages.all()
-                ]
-            })
-        return JsonResponse(history, safe=False)
\ No newline at end of file
+        if not request.user.is_staff:
+            return JsonResponse({'error': '无权访问'}, status=403)
+        return JsonResponse({
+            'load_shedding': overload.metrics(),
+            'chat_log': chat_log.metrics(),
+            'conversation_state': conversation_store.metrics(),
+            'typeahead': typeahead.metrics(),
+            'logging': pipeline_metrics(),
+            'single_flight': {
+                'nlp': recognition_metrics(),
+                'recommendations': recommendation_flight.metrics(),
+            },
+        })
@@ -23,6 +23,12 @@ class Order(models.Model):
         db_table = 'orders_order'
         verbose_name = '订单信息'
         verbose_name_plural = '订单信息'
+        indexes = [
+            # 订单列表、用户购买历史、相似用户查找
+            models.Index(fields=['user', 'status', '-created_at'], name='order_user_status_created_idx'),
+            # 热门商品：最近 30 天内指定状态的订单
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+        ]
 
 class OrderItem(models.Model):
     order = models.ForeignKey('Order', on_delete=models.CASCADE, related_name='items', verbose_name='订单')
@@ -37,6 +43,10 @@ class OrderItem(models.Model):
         db_table = 'orders_orderitem'
         verbose_name = '订单项信息'
         verbose_name_plural = '订单项信息'
+        indexes = [
+            # 从商品关联到订单状态时只需扫描索引
+            models.Index(fields=['product', 'order'], name='orderitem_product_order_idx'),
+        ]
 
     def get_total(self):
         return self.quantity * self.price
\ No newline at end of file
@@ -0,0 +1,4 @@
+from django.dispatch import Signal
+
+# 订单状态变化时发送，参数：order, old_status, new_status
+order_status_changed = Signal()
@@ -3,7 +3,18 @@ from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from .models import Order, OrderItem
+from .signals import order_status_changed
 from products.models import Product
+from chat.models import InteractionEvent
+from chat.services.events import record_event
+
+
+def _change_status(order, status):
+    """更新订单状态并发出状态变化事件"""
+    old_status = order.status
+    order.status = status
+    order.save()
+    order_status_changed.send(sender=Order, order=order, old_status=old_status, new_status=status)
 
 @login_required
 def create_order(request):
@@ -36,6 +47,7 @@ def create_order(request):
         order.save()
         product.stock -= quantity
         product.save()
+        record_event(request, product.id, InteractionEvent.Type.ADD_TO_ORDER)
         messages.success(request, '商品已{}成功！'.format('购买' if is_buy_now else '加入订单'))
         if is_buy_now:
             return redirect('order_detail', pk=order.id)
@@ -48,17 +60,15 @@ def order_detail(request, pk):
     order = get_object_or_404(Order, pk=pk, user=request.user)
     if request.method == 'POST':
         if request.POST.get('action') == 'cancel':
-            order.status = '已取消'
             for item in order.items.all():
                 item.product.stock += item.quantity
                 item.product.save()
-            order.save()
+            _change_status(order, '已取消')
             messages.success(request, '订单已取消！')
             return redirect('order_list')
         elif request.POST.get('action') == 'confirm_receipt':
             if order.status == '已发货':
-                order.status = '已完成'
-                order.save()
+                _change_status(order, '已完成')
                 messages.success(request, '确认收货成功！')
                 return redirect('order_detail', pk=order.id)
             messages.error(request, '订单状态不支持确认收货！')
@@ -77,8 +87,7 @@ def pay_order(request, pk):
     order = get_object_or_404(Order, pk=pk, user=request.user)
     if request.method == 'POST':
         if order.status == '待支付':
-            order.status = '已支付'
-            order.save()
+            _change_status(order, '已支付')
             messages.success(request, '支付成功！')
             return JsonResponse({'status': 'success', 'message': '支付成功！订单状态已更新。'})
         return JsonResponse({'status': 'error', 'message': '订单状态不支持支付！'})
@@ -88,8 +97,7 @@ def pay_order(request, pk):
 def ship_order(request, pk):
     order = get_object_or_404(Order, pk=pk)
     if request.user == order.items.first().product.merchant and order.status == '已支付':
-        order.status = '已发货'
-        order.save()
+        _change_status(order, '已发货')
         messages.success(request, '订单已发货！')
         return redirect('merchant_orders')
     messages.error(request, '无权操作或订单状态错误！')
@@ -0,0 +1,97 @@
+"""
+商品属性抽取
+
+把 Product.specifications 展开成 (key, value, numeric_value) 行写入 ProductAttribute，
+品牌、特性等过滤条件改为对属性表的索引查找，不再扫描 JSON 列。
+"""
+import re
+import unicodedata
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import ProductAttribute
+
+# 同义的规格键统一成一个名字
+KEY_ALIASES = {
+    '品牌': 'brand',
+}
+
+MAX_KEY_LENGTH = 100
+MAX_VALUE_LENGTH = 255
+
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+
+
+def normalize_text(value):
+    return unicodedata.normalize('NFKC', str(value)).strip().lower()
+
+
+def normalize_key(key):
+    key = normalize_text(key)
+    return KEY_ALIASES.get(key, key)[:MAX_KEY_LENGTH]
+
+
+def parse_numeric(value):
+    """取属性值中的第一个数字，没有数字时返回 None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _NUMBER_RE.search(str(value))
+    return float(match.group()) if match else None
+
+
+def extract_attributes(specifications, prefix=''):
+    """
+    展开规格 JSON
+
+    列表中的每个元素单独成行，嵌套字典的键用 "." 连接。
+
+    Returns:
+        list: [(key, value, numeric_value), ...]
+    """
+    rows = []
+    if not isinstance(specifications, dict):
+        return rows
+    for raw_key, raw_value in specifications.items():
+        key = normalize_key(f'{prefix}{raw_key}')
+        if isinstance(raw_value, dict):
+            rows.extend(extract_attributes(raw_value, prefix=f'{key}.'))
+            continue
+        values = raw_value if isinstance(raw_value, (list, tuple)) else [raw_value]
+        for value in values:
+            if value is None or isinstance(value, (dict, list, tuple)):
+                continue
+            rows.append((key, normalize_text(value)[:MAX_VALUE_LENGTH], parse_numeric(value)))
+    return rows
+
+
+def sync_attributes(product):
+    """用商品当前的规格重建属性行"""
+    rows = set(extract_attributes(product.specifications))
+    with transaction.atomic():
+        ProductAttribute.objects.filter(product=product).delete()
+        ProductAttribute.objects.bulk_create([
+            ProductAttribute(product=product, key=key, value=value, numeric_value=numeric_value)
+            for key, value, numeric_value in rows
+        ])
+
+
+def products_with_value(key, value):
+    """属性 key 以 value 开头的商品ID子查询（前缀匹配可以使用 (key, value) 索引）"""
+    return ProductAttribute.objects.filter(
+        key=normalize_key(key),
+        value__startswith=normalize_text(value),
+    ).values('product_id')
+
+
+def term_query(term, field='id'):
+    """
+    属性名或属性值等于 term 的商品条件，两个分支分别使用 key / value 索引
+
+    只做精确匹配；属性值中包含 term 的情况由调用方通过规格字段的倒排索引补上。
+    """
+    term = normalize_text(term)
+    return (Q(**{f'{field}__in': ProductAttribute.objects.filter(key=term).values('product_id')}) |
+            Q(**{f'{field}__in': ProductAttribute.objects.filter(value=term).values('product_id')}))
@@ -0,0 +1,88 @@
+"""
+商品卡片缓存
+
+商品卡片（名称、价格、描述、图片、分类名）序列化为 JSON 字节后缓存，键包含商品 ID 和商品版本号。
+批量读取时先一次 get_many 取版本号，再一次 get_many 取卡片，未命中的商品用一次查询补齐并回填。
+商品保存或删除时递增版本号，旧卡片不再被读到，由过期时间清理。
+先读版本号再查数据库，查询期间商品被修改时回填的旧卡片落在旧版本的键上，不会覆盖新数据。
+"""
+import json
+
+from django.core.cache import cache
+
+from .models import Product
+from .versions import bump_versions, get_versions, product_tag
+
+CARD_KEY_PREFIX = 'product:card:'
+CARD_TIMEOUT = 6 * 3600
+
+CARD_FIELDS = ('id', 'name', 'price', 'description', 'image', 'category__name')
+
+
+def _card_key(product_id, version):
+    return f'{CARD_KEY_PREFIX}{product_id}:{version}'
+
+
+def build_card(product):
+    """由商品实例生成卡片，调用方应已 select_related('category')"""
+    return {
+        'id': product.id,
+        'name': product.name,
+        'price': float(product.price),
+        'description': product.description,
+        'image': product.image.url if product.image else None,
+        'category': product.category.name,
+    }
+
+
+def serialize_card(product):
+    return json.dumps(build_card(product), ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def get_card_bytes(product_ids):
+    """
+    批量读取序列化后的商品卡片
+
+    Returns:
+        dict: 商品 ID -> 卡片 JSON 字节，已删除的商品不在结果中
+    """
+    product_ids = list(dict.fromkeys(product_ids))
+    if not product_ids:
+        return {}
+
+    versions = get_versions(product_tag(product_id) for product_id in product_ids)
+    keys = {
+        product_id: _card_key(product_id, versions[product_tag(product_id)])
+        for product_id in product_ids
+    }
+    cached = cache.get_many(list(keys.values()))
+    cards = {
+        product_id: cached[key]
+        for product_id, key in keys.items()
+        if key in cached
+    }
+
+    missing = [product_id for product_id in product_ids if product_id not in cards]
+    if missing:
+        products = Product.objects.filter(id__in=missing).select_related('category').only(*CARD_FIELDS)
+        fetched = {product.id: serialize_card(product) for product in products}
+        if fetched:
+            cache.set_many({keys[product_id]: card for product_id, card in fetched.items()}, CARD_TIMEOUT)
+        cards.update(fetched)
+    return cards
+
+
+def get_cards(product_ids):
+    """批量读取商品卡片，返回 商品 ID -> 卡片"""
+    return {product_id: json.loads(card) for product_id, card in get_card_bytes(product_ids).items()}
+
+
+def card_list(product_ids):
+    """按给定顺序返回商品卡片列表，已删除的商品跳过"""
+    product_ids = list(product_ids)
+    cards = get_cards(product_ids)
+    return [cards[product_id] for product_id in product_ids if product_id in cards]
+
+
+def invalidate_cards(product_ids):
+    bump_versions(product_tag(product_id) for product_id in product_ids)
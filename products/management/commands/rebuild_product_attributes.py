@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from products.attributes import sync_attributes
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = '根据商品规格重建属性表（首次部署时使用，日常由商品保存增量维护）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='每批加载的商品数量')
+
+    def handle(self, *args, **options):
+        total = 0
+        products = Product.objects.only('id', 'specifications').order_by('id')
+        for product in products.iterator(chunk_size=options['batch_size']):
+            sync_attributes(product)
+            total += 1
+        self.stdout.write(self.style.SUCCESS(f'已为 {total} 个商品重建属性'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from products import search
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = '重建商品 n-gram 倒排索引（首次部署或索引损坏时使用，日常由商品保存增量维护）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='每批加载的商品数量')
+
+    def handle(self, *args, **options):
+        total = 0
+        for product in Product.objects.order_by('id').iterator(chunk_size=options['batch_size']):
+            search.index_product(product)
+            total += 1
+        search.invalidate_corpus_stats()
+        self.stdout.write(self.style.SUCCESS(f'已为 {total} 个商品重建检索索引'))
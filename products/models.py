@@ -54,6 +54,80 @@ class Product(models.Model):
         db_table = 'product'
         verbose_name = '商品信息'
         verbose_name_plural = '商品信息'
+        indexes = [
+            # 推荐规则过滤：分类 + 有库存 + 按上架时间倒序
+            models.Index(fields=['category', 'stock', '-created_at'], name='product_cat_stock_created_idx'),
+            # 按价格区间筛选
+            models.Index(fields=['price'], name='product_price_idx'),
+        ]
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+class SearchDocument(models.Model):
+    """参与检索的商品文档长度，用于计算 BM25 的平均文档长度"""
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='search_document',
+        verbose_name='商品'
+    )
+    length = models.PositiveIntegerField(verbose_name='文档长度')
+
+    class Meta:
+        db_table = 'product_search_document'
+        verbose_name = '检索文档'
+        verbose_name_plural = '检索文档'
+
+
+class SearchPosting(models.Model):
+    """n-gram 倒排索引的倒排记录"""
+    class Field(models.TextChoices):
+        NAME = 'name', '名称'
+        DESCRIPTION = 'description', '描述'
+        SPECIFICATIONS = 'spec', '规格'
+
+    term = models.CharField(max_length=32, verbose_name='词项')
+    field = models.CharField(max_length=20, choices=Field.choices, verbose_name='字段')
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='search_postings',
+        verbose_name='商品'
+    )
+    tf = models.PositiveIntegerField(verbose_name='词频')
+    doc_length = models.PositiveIntegerField(verbose_name='文档长度')
+
+    class Meta:
+        db_table = 'product_search_posting'
+        verbose_name = '倒排记录'
+        verbose_name_plural = '倒排记录'
+        indexes = [
+            models.Index(fields=['term', 'field', 'product'], name='search_term_field_idx'),
+        ]
+
+
+class ProductAttribute(models.Model):
+    """从商品规格 JSON 中抽取的属性，便于按索引过滤"""
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='attributes',
+        verbose_name='商品'
+    )
+    key = models.CharField(max_length=100, verbose_name='属性名')
+    value = models.CharField(max_length=255, verbose_name='规范化属性值')
+    numeric_value = models.FloatField(null=True, blank=True, verbose_name='数值')
+
+    class Meta:
+        db_table = 'product_attribute'
+        verbose_name = '商品属性'
+        verbose_name_plural = '商品属性'
+        indexes = [
+            models.Index(fields=['key', 'value', 'product'], name='attr_key_value_idx'),
+            models.Index(fields=['key', 'numeric_value'], name='attr_key_numeric_idx'),
+            models.Index(fields=['value', 'product'], name='attr_value_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key}={self.value}"
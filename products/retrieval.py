@@ -0,0 +1,301 @@
+"""
+按分类的价格区间 + 库存 + 新品排序检索
+
+每个分类在进程内维护一份按价格排序的商品数组，以及一棵线段树，
+叶子为有库存商品的上架时间戳（无库存为 -inf），内部节点取子节点最大值。
+"分类 C 中价格在 [a, b] 内最新的 k 个有库存商品" 先二分出价格区间，
+再从区间对应的 O(log n) 个节点出发用堆按时间戳取前 k 个叶子。
+
+库存变化只需更新一个叶子；价格、分类变化或新增商品时该分类在下次查询时重建。
+其他进程修改价格、分类等之后分类版本号会变化，本进程据此重建对应分类；
+只修改库存时分类版本号不变，本进程按分类的库存变更记录逐条修补对应的叶子（见 products.versions）。
+
+库存在锁内原地更新，O(log n)；不加锁读取的线程可能在一次查询中看到更新前后混合的状态，
+与数据库分页时有商品售罄的效果相同。重建查询数据库时不持有锁。
+"""
+import heapq
+import logging
+import threading
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from itertools import islice
+
+from django.db.models import Q
+
+from .models import Product
+from .versions import category_tag, get_stock_changes, get_versions, stock_tag
+
+logger = logging.getLogger(__name__)
+
+EMPTY = float('-inf')
+
+# 价格区间实体对应的价格范围
+PRICE_RANGES = {
+    '1000以下': (None, 1000),
+    '1000-2000': (1000, 2000),
+    '2000-3000': (2000, 3000),
+    '3000-5000': (3000, 5000),
+    '5000-8000': (5000, 8000),
+    '8000以上': (8000, None),
+}
+
+# 价格实体上下浮动的比例
+PRICE_TOLERANCE = 0.2
+
+# 落后的库存变更记录超过这个数时直接重建，不再逐条修补
+MAX_STOCK_PATCHES = 200
+
+
+class PriceBand(namedtuple('PriceBand', ['min_price', 'max_price', 'include_max'])):
+    """价格范围，下界包含，上界按 include_max 决定是否包含，None 表示不限"""
+
+    def contains(self, price):
+        if self.min_price is not None and price < self.min_price:
+            return False
+        if self.max_price is not None:
+            return price <= self.max_price if self.include_max else price < self.max_price
+        return True
+
+    def as_query(self, field='price'):
+        query = Q()
+        if self.min_price is not None:
+            query &= Q(**{f'{field}__gte': self.min_price})
+        if self.max_price is not None:
+            lookup = 'lte' if self.include_max else 'lt'
+            query &= Q(**{f'{field}__{lookup}': self.max_price})
+        return query
+
+
+def price_band(entities):
+    """从实体中的价格或价格区间得到价格范围，没有价格条件时返回 None"""
+    if entities.get('price'):
+        price = entities['price']
+        return PriceBand(price * (1 - PRICE_TOLERANCE), price * (1 + PRICE_TOLERANCE), True)
+    bounds = PRICE_RANGES.get(entities.get('price_range'))
+    if bounds is None:
+        return None
+    min_price, max_price = bounds
+    # "1000以下" 不包含 1000，其余区间包含上界
+    return PriceBand(min_price, max_price, min_price is not None)
+
+
+class CategoryIndex:
+    """一个分类的检索结构"""
+
+    def __init__(self, rows):
+        """
+        Args:
+            rows: 可迭代的 (product_id, price, stock, created_at)
+        """
+        rows = sorted(rows, key=lambda row: (row[1], row[0]))
+        self.ids = [row[0] for row in rows]
+        self.prices = [float(row[1]) for row in rows]
+        self.timestamps = [row[3].timestamp() for row in rows]
+        self.in_stock = bytearray(1 if row[2] > 0 else 0 for row in rows)
+        self.position = {product_id: i for i, product_id in enumerate(self.ids)}
+
+        self.size = 1
+        while self.size < max(len(rows), 1):
+            self.size *= 2
+        # tree 存子树中有库存商品的最大时间戳，counts 存子树中有库存的商品数
+        self.tree = [EMPTY] * (2 * self.size)
+        self.counts = [0] * (2 * self.size)
+        for i, timestamp in enumerate(self.timestamps):
+            if self.in_stock[i]:
+                self.tree[self.size + i] = timestamp
+                self.counts[self.size + i] = 1
+        for node in range(self.size - 1, 0, -1):
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+            self.counts[node] = self.counts[2 * node] + self.counts[2 * node + 1]
+
+    @classmethod
+    def build(cls, category_id):
+        return cls(Product.objects.filter(category_id=category_id).values_list(
+            'id', 'price', 'stock', 'created_at'
+        ))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def set_stock(self, product_id, stock):
+        """库存变化时更新对应叶子到根的路径，O(log n)"""
+        i = self.position.get(product_id)
+        if i is None:
+            return False
+        self.in_stock[i] = 1 if stock > 0 else 0
+        node = self.size + i
+        self.tree[node] = self.timestamps[i] if self.in_stock[i] else EMPTY
+        self.counts[node] = self.in_stock[i]
+        node //= 2
+        while node:
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+            self.counts[node] = self.counts[2 * node] + self.counts[2 * node + 1]
+            node //= 2
+        return True
+
+    def price_span(self, band):
+        """价格范围对应的数组下标区间 [lo, hi)"""
+        if band is None:
+            return 0, len(self.ids)
+        lo = 0 if band.min_price is None else bisect_left(self.prices, float(band.min_price))
+        if band.max_price is None:
+            hi = len(self.ids)
+        elif band.include_max:
+            hi = bisect_right(self.prices, float(band.max_price))
+        else:
+            hi = bisect_left(self.prices, float(band.max_price))
+        return lo, max(lo, hi)
+
+    def _cover(self, lo, hi):
+        """把 [lo, hi) 拆成线段树上互不相交的节点"""
+        nodes = []
+        left, right = lo + self.size, hi + self.size
+        while left < right:
+            if left & 1:
+                nodes.append(left)
+                left += 1
+            if right & 1:
+                right -= 1
+                nodes.append(right)
+            left //= 2
+            right //= 2
+        return nodes
+
+    def count_in_stock(self, band=None):
+        """价格范围内有库存的商品数，O(log n)"""
+        lo, hi = self.price_span(band)
+        return sum(self.counts[node] for node in self._cover(lo, hi))
+
+    def out_of_stock(self, band=None):
+        """价格范围内无库存的商品ID，按价格排列"""
+        lo, hi = self.price_span(band)
+        return [self.ids[i] for i in range(lo, hi) if not self.in_stock[i]]
+
+    def top_k(self, k, band=None):
+        """
+        价格范围内最新的 k 个有库存商品
+
+        Returns:
+            list: 按上架时间从新到旧的 [(timestamp, product_id), ...]
+        """
+        lo, hi = self.price_span(band)
+        if k <= 0 or lo >= hi:
+            return []
+
+        heap = [(-self.tree[node], node) for node in self._cover(lo, hi) if self.tree[node] != EMPTY]
+        heapq.heapify(heap)
+
+        results = []
+        while heap and len(results) < k:
+            value, node = heapq.heappop(heap)
+            if node >= self.size:
+                results.append((-value, self.ids[node - self.size]))
+                continue
+            for child in (2 * node, 2 * node + 1):
+                if self.tree[child] != EMPTY:
+                    heapq.heappush(heap, (-self.tree[child], child))
+        return results
+
+
+_indexes = {}  # 分类ID -> (分类版本号, 库存变更序号, CategoryIndex)
+_indexes_lock = threading.Lock()
+
+
+def get_category_index(category_id):
+    """返回分类的检索结构，分类版本号变化后重建，只有库存变更时逐条修补"""
+    tag, seq_tag = category_tag(category_id), stock_tag(category_id)
+    versions = get_versions([tag, seq_tag])
+    version, seq = versions[tag], versions[seq_tag]
+    with _indexes_lock:
+        entry = _indexes.get(category_id)
+    if entry is not None and entry[0] == version:
+        if entry[1] >= seq:
+            return entry[2]
+        changes = get_stock_changes(category_id, entry[1], seq) if seq - entry[1] <= MAX_STOCK_PATCHES else None
+        if changes is not None:
+            with _indexes_lock:
+                current = _indexes.get(category_id)
+                if current is not None and current[0] == version:
+                    # 读取记录期间其他线程可能已经修补了一部分，跳过这部分
+                    for product_id, stock in changes[current[1] - entry[1]:]:
+                        current[2].set_stock(product_id, stock)
+                    if current[1] < seq:
+                        _indexes[category_id] = (version, seq, current[2])
+                    return current[2]
+    index = CategoryIndex.build(category_id)
+    with _indexes_lock:
+        # 重建期间其他线程已经替换过时不覆盖，版本号不对的条目由下一次查询重建
+        if _indexes.get(category_id) is entry:
+            _indexes[category_id] = (version, seq, index)
+    return index
+
+
+def top_k(category_ids, k, band=None):
+    """
+    多个分类中价格范围内最新的 k 个有库存商品
+
+    Returns:
+        list: 商品ID，按上架时间从新到旧
+    """
+    merged = heapq.merge(
+        *(get_category_index(category_id).top_k(k, band) for category_id in category_ids),
+        reverse=True
+    )
+    return [product_id for _, product_id in islice(merged, k)]
+
+
+class CategoryListing:
+    """
+    分类列表页的商品ID序列：有库存的按上架时间从新到旧，之后是无库存的商品
+
+    可以直接交给 Paginator，取某一页只需要计算到该页为止的前 k 个。
+    """
+
+    def __init__(self, index, band=None):
+        self.index = index
+        self.band = band
+        lo, hi = index.price_span(band)
+        self.total = hi - lo
+        self.in_stock = index.count_in_stock(band)
+
+    def __len__(self):
+        return self.total
+
+    def count(self):
+        return self.total
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start, stop, _ = key.indices(self.total)
+        ids = []
+        if start < self.in_stock:
+            ids = [product_id for _, product_id in self.index.top_k(min(stop, self.in_stock), self.band)][start:]
+        if stop > self.in_stock:
+            out_of_stock = self.index.out_of_stock(self.band)
+            ids += out_of_stock[max(start - self.in_stock, 0):stop - self.in_stock]
+        return ids
+
+
+def apply_product_change(product, old, created, stock_seq=None):
+    """
+    商品保存后更新本进程的检索结构（在递增分类版本号或写入库存变更记录之后调用）
+
+    Args:
+        old: 保存前的库存、价格、分类快照（products.signals 中记录）
+        stock_seq: 只有库存变化时 publish_stock_change 返回的序号
+
+    只有库存变化时在锁内原地更新；其他变化让相关分类在下次查询时重建。
+    """
+    if stock_seq is None:
+        with _indexes_lock:
+            for category_id in {old.get('category_id'), product.category_id}:
+                _indexes.pop(category_id, None)
+        return
+
+    with _indexes_lock:
+        entry = _indexes.get(product.category_id)
+        # 只有本进程持有的结构恰好停在上一条记录时直接更新，否则下次查询时按记录补齐
+        if entry is not None and entry[1] == stock_seq - 1:
+            entry[2].set_stock(product.id, product.stock)
+            _indexes[product.category_id] = (entry[0], stock_seq, entry[2])
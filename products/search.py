@@ -0,0 +1,205 @@
+"""
+商品全文检索
+
+中文没有词边界，MySQL 上的 icontains 又只能全表扫描，这里为商品名称、描述和
+展开后的规格建立单字/bigram/trigram 及字母数字前缀的倒排索引（SearchPosting 表），按 term 走索引查找，
+并用 BM25 对候选商品打分，返回 top-k。索引随商品保存增量维护。
+"""
+import heapq
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from .models import SearchDocument, SearchPosting
+
+Field = SearchPosting.Field
+
+# BM25 参数
+K1 = 1.2
+B = 0.75
+
+# 字段权重：名称命中比描述命中更重要
+FIELD_WEIGHTS = {
+    Field.NAME: 3.0,
+    Field.SPECIFICATIONS: 2.0,
+    Field.DESCRIPTION: 1.0,
+}
+
+MAX_TERM_LENGTH = 32
+MIN_PREFIX_LENGTH = 2
+STATS_CACHE_KEY = 'search:corpus_stats'
+
+_CJK = '\u3400-\u4dbf\u4e00-\u9fff'
+_RUN_RE = re.compile(f'[{_CJK}]+|[a-z0-9]+')
+_CJK_RE = re.compile(f'[{_CJK}]')
+_SEGMENT_RE = re.compile('[a-z]+|[0-9]+')
+
+
+def normalize(text):
+    return unicodedata.normalize('NFKC', str(text or '')).lower()
+
+
+def tokenize(text, ngram_sizes=(2, 3), expand=False):
+    """
+    切分词项：连续汉字切成 n-gram，字母数字串整体作为一个词项
+
+    单个汉字没有 n-gram 可切，直接作为词项保留。
+    建立索引时 expand 为 True，额外保留每个汉字，以及字母数字串和其中字母段、数字段的前缀，
+    这样查询单个汉字或型号、品牌的前缀（如用 iphone 查 iPhone15）时也能命中。
+    """
+    terms = []
+    for run in _RUN_RE.findall(normalize(text)):
+        if not _CJK_RE.match(run):
+            terms.append(run[:MAX_TERM_LENGTH])
+            if expand:
+                terms.extend(_prefixes(run))
+            continue
+        if len(run) == 1 or expand:
+            terms.extend(run)
+        if len(run) == 1:
+            continue
+        for n in ngram_sizes:
+            terms.extend(run[i:i + n] for i in range(len(run) - n + 1))
+    return terms
+
+
+def _prefixes(run):
+    """字母数字串的前缀（不含整串本身），以及字母段、数字段和它们的前缀"""
+    run = run[:MAX_TERM_LENGTH]
+    segments = _SEGMENT_RE.findall(run)
+    if len(segments) == 1:
+        segments = []
+    prefixes = {run[:i] for i in range(MIN_PREFIX_LENGTH, len(run))}
+    for segment in segments:
+        prefixes.update(segment[:i] for i in range(MIN_PREFIX_LENGTH, len(segment) + 1))
+    prefixes.discard(run)
+    return sorted(prefixes)
+
+
+def flatten_specifications(specifications):
+    """把规格 JSON 展开成文本，键和值都参与检索"""
+    parts = []
+    if isinstance(specifications, dict):
+        for key, value in specifications.items():
+            parts.append(str(key))
+            parts.append(flatten_specifications(value))
+    elif isinstance(specifications, (list, tuple)):
+        parts.extend(flatten_specifications(value) for value in specifications)
+    elif specifications is not None:
+        parts.append(str(specifications))
+    return ' '.join(parts)
+
+
+def _field_texts(product):
+    return {
+        Field.NAME: product.name,
+        Field.DESCRIPTION: product.description,
+        Field.SPECIFICATIONS: flatten_specifications(product.specifications),
+    }
+
+
+def index_product(product):
+    """重建单个商品的倒排记录"""
+    term_counts = {field: Counter(tokenize(text, expand=True)) for field, text in _field_texts(product).items()}
+    doc_length = sum(sum(counts.values()) for counts in term_counts.values())
+
+    with transaction.atomic():
+        old_length = SearchDocument.objects.filter(product=product).values_list('length', flat=True).first()
+        SearchPosting.objects.filter(product=product).delete()
+        SearchPosting.objects.bulk_create([
+            SearchPosting(term=term, field=field, product=product, tf=tf, doc_length=doc_length)
+            for field, counts in term_counts.items()
+            for term, tf in counts.items()
+        ])
+        SearchDocument.objects.update_or_create(product=product, defaults={'length': doc_length})
+
+    if old_length is None:
+        _adjust_corpus_stats(1, doc_length)
+    else:
+        _adjust_corpus_stats(0, doc_length - old_length)
+
+
+def invalidate_corpus_stats():
+    """商品删除时倒排记录随外键级联删除，统计信息下次查询时重新计算"""
+    cache.delete(STATS_CACHE_KEY)
+
+
+def corpus_stats():
+    """返回 (文档数, 总长度)"""
+    stats = cache.get(STATS_CACHE_KEY)
+    if stats is None:
+        aggregate = SearchDocument.objects.aggregate(docs=Count('id'), total_length=Sum('length'))
+        stats = (aggregate['docs'] or 0, aggregate['total_length'] or 0)
+        cache.set(STATS_CACHE_KEY, stats, None)
+    return stats
+
+
+def _adjust_corpus_stats(docs_delta, length_delta):
+    stats = cache.get(STATS_CACHE_KEY)
+    if stats is None:
+        return
+    cache.set(STATS_CACHE_KEY, (stats[0] + docs_delta, stats[1] + length_delta), None)
+
+
+def search(query, limit=100):
+    """
+    BM25 排序检索
+
+    Returns:
+        list: [(product_id, score), ...]，按得分降序，最多 limit 个
+    """
+    terms = set(tokenize(query))
+    if not terms:
+        return []
+
+    rows = SearchPosting.objects.filter(term__in=terms).values_list(
+        'term', 'product_id', 'field', 'tf', 'doc_length'
+    )
+
+    weighted_tf = defaultdict(float)
+    doc_lengths = {}
+    term_docs = defaultdict(set)
+    for term, product_id, field, tf, doc_length in rows:
+        weighted_tf[(product_id, term)] += FIELD_WEIGHTS.get(field, 1.0) * tf
+        doc_lengths[product_id] = doc_length
+        term_docs[term].add(product_id)
+
+    if not weighted_tf:
+        return []
+
+    docs, total_length = corpus_stats()
+    docs = max(docs, len(doc_lengths))
+    avg_length = total_length / docs if total_length else 1.0
+
+    scores = defaultdict(float)
+    for (product_id, term), tf in weighted_tf.items():
+        df = len(term_docs[term])
+        idf = math.log(1 + (docs - df + 0.5) / (df + 0.5))
+        norm = K1 * (1 - B + B * doc_lengths[product_id] / avg_length)
+        scores[product_id] += idf * tf * (K1 + 1) / (tf + norm)
+
+    return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+
+def matching_product_ids(text, fields):
+    """
+    返回在指定字段中包含 text 全部 bigram 的商品ID子查询
+
+    用于替代 icontains 过滤，可直接放进 Q(id__in=...)；text 无法切分时返回 None。
+    """
+    terms = set(tokenize(text, ngram_sizes=(2,)))
+    if not terms:
+        return None
+    return SearchPosting.objects.filter(
+        term__in=terms,
+        field__in=fields,
+    ).values('product_id').annotate(
+        matched=Count('term', distinct=True)
+    ).filter(
+        matched=len(terms)
+    ).values('product_id')
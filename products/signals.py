@@ -0,0 +1,124 @@
+import json
+import logging
+
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from . import retrieval, search
+from .attributes import sync_attributes
+from .cards import invalidate_cards
+from .models import Category, Product
+from .versions import bump_category_versions, bump_listing_versions, publish_stock_change
+
+logger = logging.getLogger(__name__)
+
+# 影响推荐结果的商品字段，变化时需要让相关缓存失效
+TRACKED_FIELDS = ('stock', 'price', 'category_id')
+
+# 参与全文检索的字段，变化时需要重建倒排记录
+SEARCH_FIELDS = ('name', 'description', 'specifications')
+
+
+def _search_text(instance):
+    return json.dumps(
+        [instance.name, instance.description, instance.specifications],
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+
+
+def _specifications_text(instance):
+    return json.dumps(instance.specifications, ensure_ascii=False, sort_keys=True, default=str)
+
+
+def _snapshot(instance):
+    deferred = instance.get_deferred_fields()
+    snapshot = {
+        field: getattr(instance, field)
+        for field in TRACKED_FIELDS
+        if field not in deferred
+    }
+    if not deferred.intersection(SEARCH_FIELDS):
+        snapshot['search_text'] = _search_text(instance)
+    if 'specifications' not in deferred:
+        snapshot['specifications'] = _specifications_text(instance)
+    return snapshot
+
+
+@receiver(post_init, sender=Product)
+def remember_tracked_fields(sender, instance, **kwargs):
+    """记录实例加载时的库存、价格、分类、检索文本和规格，用于保存时判断是否变化"""
+    instance._tracked_snapshot = _snapshot(instance) if instance.pk else {}
+
+
+@receiver(post_save, sender=Product)
+def invalidate_on_product_change(sender, instance, created, **kwargs):
+    old = getattr(instance, '_tracked_snapshot', {})
+    changed = created or any(
+        old.get(field) != getattr(instance, field)
+        for field in TRACKED_FIELDS
+    )
+    # 只有库存变化时不让分类版本号失效（规格矩阵等不依赖库存），其他进程按库存变更记录只修补这一个商品
+    stock_only = changed and not created and 'price' in old and all(
+        old.get(field) == getattr(instance, field) for field in TRACKED_FIELDS if field != 'stock'
+    )
+    if changed:
+        stock_seq = None
+        if stock_only:
+            stock_seq = publish_stock_change(instance.category_id, instance.pk, instance.stock)
+        else:
+            bump_category_versions({old.get('category_id'), instance.category_id})
+        try:
+            retrieval.apply_product_change(instance, old, created, stock_seq)
+        except Exception as e:
+            logger.error(f"更新商品检索结构失败: {e}", exc_info=True)
+
+    # 推荐结果缓存按商品ID和列表版本号失效：只扣减库存的保存只影响包含该商品的结果，
+    # 可能让商品新匹配某些筛选条件的变化才递增列表版本号
+    restocked = (old.get('stock') or 0) <= 0 < (instance.stock or 0)
+    if (
+        created
+        or restocked
+        or old.get('price') != instance.price
+        or old.get('category_id') != instance.category_id
+        or old.get('search_text') != _search_text(instance)
+    ):
+        bump_listing_versions({instance.category_id})
+
+    if created or old.get('search_text') != _search_text(instance):
+        try:
+            search.index_product(instance)
+        except Exception as e:
+            logger.error(f"更新商品检索索引失败: {e}", exc_info=True)
+
+    # 规格变化时同步属性表（ProductForm、后台编辑都会走到这里）
+    if created or old.get('specifications') != _specifications_text(instance):
+        try:
+            sync_attributes(instance)
+        except Exception as e:
+            logger.error(f"同步商品属性失败: {e}", exc_info=True)
+        # 按规格构建的比较矩阵依赖分类版本号
+        if not changed or stock_only:
+            bump_category_versions({instance.category_id})
+
+    # 卡片包含名称、描述、图片等未跟踪的字段，每次保存都让卡片失效
+    invalidate_cards([instance.pk])
+
+    instance._tracked_snapshot = _snapshot(instance)
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_on_product_delete(sender, instance, **kwargs):
+    bump_category_versions({instance.category_id})
+    invalidate_cards([instance.pk])
+    search.invalidate_corpus_stats()
+
+
+@receiver(post_save, sender=Category)
+def invalidate_cards_on_category_change(sender, instance, created, **kwargs):
+    # 卡片中包含分类名，分类修改时该分类下的卡片全部失效
+    if not created:
+        invalidate_cards(Product.objects.filter(category=instance).values_list('id', flat=True))
+    # 分类名变化会改变按名称匹配到的分类
+    bump_listing_versions({instance.pk})
@@ -1,3 +1,127 @@
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from products import retrieval, search
+from products.models import Category, Product, SearchPosting
+from products.versions import STOCK_CHANGE_KEY_PREFIX, category_tag, get_versions, publish_stock_change
+
+User = get_user_model()
+
+
+class SearchRecallTests(TestCase):
+    """倒排索引检索不能比 icontains 漏掉更多商品：单个汉字、型号和品牌前缀都要能查到"""
+
+    @classmethod
+    def setUpTestData(cls):
+        merchant = User.objects.create_user(username='merchant', password='x', role='merchant')
+        category = Category.objects.create(name='手机')
+        cls.phone = Product.objects.create(
+            name='苹果 iPhone15 Pro',
+            description='旗舰手机',
+            price=Decimal('6999'),
+            category=category,
+            merchant=merchant,
+            stock=10,
+            specifications={'品牌': '苹果'},
+        )
+        cls.other = Product.objects.create(
+            name='华为 Mate60',
+            description='长续航',
+            price=Decimal('5999'),
+            category=category,
+            merchant=merchant,
+            stock=10,
+            specifications={'品牌': '华为'},
+        )
+
+    def found(self, query):
+        return {product_id for product_id, _ in search.search(query)}
+
+    def test_alphanumeric_prefix(self):
+        self.assertEqual(self.found('iphone'), {self.phone.id})
+        self.assertEqual(self.found('iPhone15'), {self.phone.id})
+        self.assertEqual(self.found('mate'), {self.other.id})
+
+    def test_digit_segment(self):
+        self.assertEqual(self.found('15'), {self.phone.id})
+
+    def test_single_cjk_character(self):
+        self.assertIn(self.phone.id, self.found('机'))
+        self.assertEqual(self.found('苹'), {self.phone.id})
+
+    def test_matching_product_ids(self):
+        matched = set(search.matching_product_ids('iphone', [SearchPosting.Field.NAME]).values_list('product_id', flat=True))
+        self.assertEqual(matched, {self.phone.id})
+        matched = set(search.matching_product_ids('苹', [SearchPosting.Field.NAME]).values_list('product_id', flat=True))
+        self.assertEqual(matched, {self.phone.id})
+
+    def test_query_terms_are_not_expanded(self):
+        # 查询词不展开前缀，否则 BM25 会把只共享前缀的商品也算进来
+        self.assertEqual(search.tokenize('iphone'), ['iphone'])
+        self.assertIn('ip', search.tokenize('iphone', expand=True))
+
+
+class StockPatchTests(TestCase):
+    """只有库存变化时原地修补检索结构，不递增分类版本号，其他进程按库存变更记录修补而不重建"""
+
+    @classmethod
+    def setUpTestData(cls):
+        merchant = User.objects.create_user(username='stock_merchant', password='x', role='merchant')
+        cls.category = Category.objects.create(name='耳机')
+        cls.products = [
+            Product.objects.create(
+                name=f'耳机{index}', description='降噪', price=Decimal(100 + index), category=cls.category,
+                merchant=merchant, stock=5, specifications={'品牌': '索尼'},
+            )
+            for index in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        retrieval._indexes.clear()
+
+    def in_stock(self, index):
+        return {product_id for _, product_id in index.top_k(10)}
+
+    def test_local_stock_change_updates_in_place(self):
+        index = retrieval.get_category_index(self.category.id)
+        version = get_versions([category_tag(self.category.id)])
+        product = Product.objects.get(id=self.products[0].id)
+        product.stock = 0
+        with mock.patch.object(retrieval.CategoryIndex, 'build') as build:
+            product.save()
+            self.assertIs(retrieval.get_category_index(self.category.id), index)
+        build.assert_not_called()
+        self.assertEqual(get_versions([category_tag(self.category.id)]), version)
+        self.assertNotIn(product.id, self.in_stock(index))
+
+    def test_remote_stock_change_is_patched(self):
+        index = retrieval.get_category_index(self.category.id)
+        # 另一个进程修改了库存：数据库已更新，本进程只能看到共享缓存中的变更记录
+        Product.objects.filter(id=self.products[1].id).update(stock=0)
+        publish_stock_change(self.category.id, self.products[1].id, 0)
+        with mock.patch.object(retrieval.CategoryIndex, 'build') as build:
+            self.assertIs(retrieval.get_category_index(self.category.id), index)
+        build.assert_not_called()
+        self.assertEqual(self.in_stock(index), {self.products[0].id, self.products[2].id})
+
+    def test_missing_stock_change_rebuilds(self):
+        index = retrieval.get_category_index(self.category.id)
+        Product.objects.filter(id=self.products[1].id).update(stock=0)
+        seq = publish_stock_change(self.category.id, self.products[1].id, 0)
+        # 变更记录已过期
+        cache.delete(f'{STOCK_CHANGE_KEY_PREFIX}{self.category.id}:{seq}')
+        rebuilt = retrieval.get_category_index(self.category.id)
+        self.assertIsNot(rebuilt, index)
+        self.assertNotIn(self.products[1].id, self.in_stock(rebuilt))
+
+    def test_price_change_rebuilds(self):
+        index = retrieval.get_category_index(self.category.id)
+        product = Product.objects.get(id=self.products[2].id)
+        product.price = Decimal('50')
+        product.save()
+        self.assertIsNot(retrieval.get_category_index(self.category.id), index)
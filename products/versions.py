@@ -0,0 +1,111 @@
+"""
+商品目录版本号
+
+按分类维护单调递增的版本号，存放在 settings 中配置的 Django 缓存里，
+多个进程共享。依赖商品数据的各类缓存在写入时记录相关版本号，读取时比对，
+版本变化即视为失效，无需逐条删除缓存。
+
+只有库存变化时不递增分类版本号，而是按分类追加一条库存变更记录（序号 + 商品 + 库存），
+其他进程的检索结构据此只修补对应的商品，不必重建整个分类。
+"""
+from django.core.cache import cache
+
+VERSION_KEY_PREFIX = 'catalog:version:'
+STOCK_CHANGE_KEY_PREFIX = 'catalog:stock:'
+ALL_TAG = 'all'
+
+# 库存变更记录的保留时间（秒），过期后落后太多的进程改为重建
+STOCK_CHANGE_TIMEOUT = 3600
+
+
+def category_tag(category_id):
+    return f'cat:{category_id}'
+
+
+def product_tag(product_id):
+    return f'product:{product_id}'
+
+
+def stock_tag(category_id):
+    """分类中库存变更记录的序号"""
+    return f'stock:{category_id}'
+
+
+def listing_tag(category_id=None):
+    """分类中“可能新出现匹配商品”的版本标签，不传分类时表示整个目录"""
+    return f'listing:{category_id}' if category_id else f'listing:{ALL_TAG}'
+
+
+def _version_key(tag):
+    return f'{VERSION_KEY_PREFIX}{tag}'
+
+
+def get_versions(tags):
+    """批量读取标签版本号，未初始化的标签视为 0"""
+    tags = list(tags)
+    if not tags:
+        return {}
+    stored = cache.get_many([_version_key(tag) for tag in tags])
+    return {tag: stored.get(_version_key(tag), 0) for tag in tags}
+
+
+def catalog_version():
+    """整个商品目录的版本号，商品新增、删除或价格、分类、规格变化时递增（只改库存时不递增）"""
+    return get_versions([ALL_TAG])[ALL_TAG]
+
+
+def _incr(tag):
+    key = _version_key(tag)
+    # add 保证键存在，incr 在 Redis 中是原子操作
+    cache.add(key, 0, timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+        return 1
+
+
+def bump_versions(tags):
+    """递增标签版本号"""
+    for tag in set(tags):
+        _incr(tag)
+
+
+def bump_listing_versions(category_ids):
+    """有商品可能新匹配某些筛选条件时（上架、补货、改价、改名、换分类）递增分类及全局的列表版本号"""
+    tags = [listing_tag(category_id) for category_id in category_ids if category_id]
+    tags.append(listing_tag())
+    bump_versions(tags)
+
+
+def bump_category_versions(category_ids):
+    """商品变化时递增所属分类及全局目录的版本号"""
+    tags = [category_tag(category_id) for category_id in category_ids if category_id]
+    tags.append(ALL_TAG)
+    bump_versions(tags)
+
+
+def publish_stock_change(category_id, product_id, stock):
+    """
+    记录一次只有库存变化的商品修改
+
+    Returns:
+        int: 这条记录在分类中的序号
+    """
+    seq = _incr(stock_tag(category_id))
+    cache.set(f'{STOCK_CHANGE_KEY_PREFIX}{category_id}:{seq}', (product_id, stock), STOCK_CHANGE_TIMEOUT)
+    return seq
+
+
+def get_stock_changes(category_id, since, until):
+    """
+    读取分类中序号在 (since, until] 内的库存变更记录
+
+    Returns:
+        list: 按序号排列的 [(product_id, stock), ...]，有记录缺失（过期或尚未写入）时返回 None
+    """
+    keys = [f'{STOCK_CHANGE_KEY_PREFIX}{category_id}:{seq}' for seq in range(since + 1, until + 1)]
+    stored = cache.get_many(keys)
+    if len(stored) < len(keys):
+        return None
+    return [stored[key] for key in keys]
@@ -5,7 +5,10 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
 from django.db.models import Q
 from .models import Category, Product
+from . import cards, retrieval, search
 from orders.models import Order, OrderItem
+from chat.models import InteractionEvent
+from chat.services.events import record_event
 import matplotlib.pyplot as plt
 import io
 import base64
@@ -23,7 +26,8 @@ def home(request):
 
 def category_detail(request, pk):
     category = get_object_or_404(Category, pk=pk)
-    products = Product.objects.filter(category=category)
+    # 有库存的新品在前，分页只计算到当前页为止的商品ID
+    products = retrieval.CategoryListing(retrieval.get_category_index(category.id))
     paginator = Paginator(products, 35)
     page = request.GET.get('page')
     try:
@@ -32,6 +36,8 @@ def category_detail(request, pk):
         products_page = paginator.page(1)
     except EmptyPage:
         products_page = paginator.page(paginator.num_pages)
+    # 当前页的商品卡片从缓存批量读取
+    products_page.object_list = cards.card_list(products_page.object_list)
     context = {
         'category': category,
         'products': products_page,
@@ -39,14 +45,16 @@ def category_detail(request, pk):
     return render(request, 'products/category_detail.html', context)
 
 
+# 搜索结果最多保留的条数（按 BM25 得分排序）
+SEARCH_RESULT_LIMIT = 350
+
+
 def search_products(request):
     query = request.GET.get('q', '').strip()
     if query:
-        products = Product.objects.filter(
-            Q(name__icontains=query) | Q(description__icontains=query)
-        ).distinct()
+        products = [product_id for product_id, _ in search.search(query, limit=SEARCH_RESULT_LIMIT)]
     else:
-        products = Product.objects.all()
+        products = Product.objects.order_by('-created_at').values_list('id', flat=True)
     paginator = Paginator(products, 35)
     page = request.GET.get('page')
     try:
@@ -55,6 +63,8 @@ def search_products(request):
         products_page = paginator.page(1)
     except EmptyPage:
         products_page = paginator.page(paginator.num_pages)
+    # 分页针对排好序的商品ID，只读取当前页的商品卡片
+    products_page.object_list = cards.card_list(products_page.object_list)
     context = {
         'category': None,
         'products': products_page,
@@ -178,6 +188,12 @@ from .models import Product
 def product_detail(request, pk):
     product = get_object_or_404(Product, pk=pk)
 
+    # 从聊天推荐卡片进入时记为点击，否则记为浏览
+    if request.GET.get('src') == 'chat':
+        record_event(request, product.id, InteractionEvent.Type.CLICK, source='chat')
+    else:
+        record_event(request, product.id, InteractionEvent.Type.VIEW)
+
     # specifications 是一个已经解析好的 Python 字典
     specifications = product.specifications
 